@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apidocs.schema import read_schema, render_schema, write_schema
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the OpenAPI schema (YAML, JSON and gzipped copies) into API_SCHEMA_DIR so /api/schema/ '
+        'can serve it as a static file. Run it at build/deploy time, next to collectstatic.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', help='Write here instead of API_SCHEMA_DIR')
+        parser.add_argument('--check', action='store_true',
+                            help="Don't write anything; fail if the built schema is missing or out of date")
+
+    def handle(self, *args, **options):
+        rendered = render_schema()
+        if options['check']:
+            built = read_schema(options['dir'])
+            if built is None or any(built[fmt].body != body for fmt, body in rendered.items()):
+                raise CommandError('The built schema is missing or stale; run manage.py build_schema.')
+            self.stdout.write(self.style.SUCCESS('Schema is up to date.'))
+            return
+        for path in write_schema(rendered, options['dir']):
+            self.stdout.write(path)
+        self.stdout.write(self.style.SUCCESS(f'Schema built ({len(rendered["yaml"])} bytes of YAML).'))
@@ -0,0 +1,79 @@
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What a fresh worker does before it can answer its first request
+BOOT = """
+import json, time
+started = time.perf_counter()
+import {module}
+imported = time.perf_counter()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({{'import': imported - started, 'urls': time.perf_counter() - imported}}))
+"""
+
+LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| *(\S+)$')
+
+
+class Command(BaseCommand):
+    help = (
+        'Boot the app in a fresh interpreter with `python -X importtime` and report where cold start '
+        'time goes: wall clock for importing the WSGI/ASGI module and loading the URLconf, then '
+        'import time per top-level package (third-party libraries and our own apps).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', default='teacup.wsgi', help='What to import, e.g. teacup.asgi')
+        parser.add_argument('--top', type=int, default=15, help='Rows per table')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'teacup.settings'))
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', BOOT.format(module=options['module'])],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True,
+        )
+        total = time.perf_counter() - started
+        if result.returncode:
+            raise CommandError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'Boot failed')
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+
+        modules = []
+        for line in result.stderr.splitlines():
+            match = LINE.match(line)
+            if match:
+                modules.append((match[3], int(match[1]), int(match[2])))
+
+        by_package = defaultdict(lambda: [0, 0])
+        for name, self_us, _ in modules:
+            package = by_package[name.split('.')[0]]
+            package[0] += self_us
+            package[1] += 1
+        local_apps = {config.name.split('.')[0] for config in apps.get_app_configs()
+                      if config.path.startswith(str(settings.BASE_DIR))} | {'teacup'}
+
+        self.stdout.write(f'Process total {total * 1000:7.1f} ms (interpreter start to first request ready)')
+        self.stdout.write(f'  import {options["module"]:<14} {timings["import"] * 1000:7.1f} ms')
+        self.stdout.write(f'  URLconf {"":<13} {timings["urls"] * 1000:7.1f} ms')
+        self.stdout.write(f'  {len(modules)} modules imported')
+
+        self.stdout.write('\nSelf time by package:')
+        ranked = sorted(by_package.items(), key=lambda item: item[1][0], reverse=True)
+        for package, (self_us, count) in ranked[:options['top']]:
+            mark = ' (app)' if package in local_apps else ''
+            self.stdout.write(f'  {self_us / 1000:7.1f} ms  {count:4} modules  {package}{mark}')
+
+        self.stdout.write('\nSlowest imports (cumulative, i.e. including what they import):')
+        boot_chain = {'.'.join(options['module'].split('.')[:i + 1]) for i in range(options['module'].count('.') + 1)}
+        slowest = sorted((m for m in modules if m[0] not in boot_chain), key=lambda m: m[2], reverse=True)
+        for name, _, cumulative_us in slowest[:options['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:7.1f} ms  {name}')
@@ -0,0 +1,115 @@
+"""
+The OpenAPI schema, built once instead of on every request.
+
+`manage.py build_schema` renders it at build/deploy time into API_SCHEMA_DIR
+as openapi.yaml and openapi.json plus gzipped copies. The schema view loads
+those files once per process and serves them with an ETag; nothing from
+drf-spectacular is imported to do so. Without prebuilt files the schema is
+generated on the first request instead (once per process).
+"""
+import gzip
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+
+FORMATS = {
+    'yaml': 'application/vnd.oai.openapi',
+    'json': 'application/vnd.oai.openapi+json',
+}
+
+
+class SchemaFile:
+    """One rendered format: the raw and gzipped bytes and their ETag."""
+
+    def __init__(self, fmt, body, gzipped=None):
+        self.format = fmt
+        self.content_type = FORMATS[fmt]
+        self.body = body
+        self.gzipped = gzipped if gzipped is not None else compress(body)
+        self.etag = '"%s"' % hashlib.sha256(body).hexdigest()[:32]
+
+    @property
+    def gzip_etag(self):
+        # A different representation needs a different strong ETag
+        return self.etag[:-1] + '-gz"'
+
+
+def compress(body):
+    # mtime=0 so the same schema always gzips to the same bytes
+    return gzip.compress(body, compresslevel=9, mtime=0)
+
+
+def path_for(fmt, directory=None):
+    return os.path.join(directory or settings.API_SCHEMA_DIR, f'openapi.{fmt}')
+
+
+def render_schema():
+    """Generate the schema with drf-spectacular, as {format: bytes}."""
+    from drf_spectacular.renderers import OpenApiJsonRenderer, OpenApiYamlRenderer
+    from drf_spectacular.settings import spectacular_settings
+
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS()
+    schema = generator.get_schema(request=None, public=spectacular_settings.SERVE_PUBLIC)
+    return {
+        'yaml': OpenApiYamlRenderer().render(schema, renderer_context={}),
+        'json': OpenApiJsonRenderer().render(schema, renderer_context={}),
+    }
+
+
+def write_schema(rendered, directory=None):
+    """Write each format and its .gz next to it; returns the paths written."""
+    directory = directory or settings.API_SCHEMA_DIR
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    for fmt, body in rendered.items():
+        for path, data in ((path_for(fmt, directory), body), (path_for(fmt, directory) + '.gz', compress(body))):
+            # Write then rename, so a running server never reads half a file
+            tmp = f'{path}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, path)
+            written.append(path)
+    return written
+
+
+def read_schema(directory=None):
+    """The prebuilt schema as {format: SchemaFile}, or None if it hasn't been built."""
+    files = {}
+    for fmt in FORMATS:
+        path = path_for(fmt, directory)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            with open(path + '.gz', 'rb') as f:
+                gzipped = f.read()
+        except FileNotFoundError:
+            gzipped = None
+        files[fmt] = SchemaFile(fmt, body, gzipped)
+    return files
+
+
+_loaded = None
+_lock = threading.Lock()
+
+
+def get_schema():
+    """{format: SchemaFile} for this process: the prebuilt files, else generated once."""
+    global _loaded
+    if _loaded is None:
+        with _lock:
+            if _loaded is None:
+                files = read_schema()
+                if files is None:
+                    files = {fmt: SchemaFile(fmt, body) for fmt, body in render_schema().items()}
+                _loaded = files
+    return _loaded
+
+
+def forget_schema():
+    global _loaded
+    _loaded = None
@@ -0,0 +1,98 @@
+import gzip
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from . import schema
+
+YAML = b'openapi: 3.0.3\ninfo:\n  title: Teacup\n'
+JSON = b'{"openapi": "3.0.3", "info": {"title": "Teacup"}}'
+
+
+class SchemaViewTest(TestCase):
+    """Test serving the prebuilt schema."""
+
+    def setUp(self):
+        self.schema_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.schema_dir.cleanup)
+        settings_override = override_settings(API_SCHEMA_DIR=Path(self.schema_dir.name))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        schema.forget_schema()
+        self.addCleanup(schema.forget_schema)
+        schema.write_schema({'yaml': YAML, 'json': JSON})
+
+    def test_serves_yaml_with_etag(self):
+        """Test the schema comes from the built file with an ETag, and revalidates to a 304."""
+        response = self.client.get(reverse('schema'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, YAML)
+        self.assertEqual(response['Content-Type'], 'application/vnd.oai.openapi')
+
+        again = self.client.get(reverse('schema'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.content, b'')
+
+    def test_json_format(self):
+        """Test ?format=json and an Accept header both select JSON."""
+        self.assertEqual(self.client.get(reverse('schema'), {'format': 'json'}).content, JSON)
+        self.assertEqual(self.client.get(reverse('schema'), HTTP_ACCEPT='application/json').content, JSON)
+
+    def test_precompressed(self):
+        """Test gzip clients get the precompressed file under its own ETag."""
+        plain = self.client.get(reverse('schema'))
+        response = self.client.get(reverse('schema'), HTTP_ACCEPT_ENCODING='gzip, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content), YAML)
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+        self.assertIn('Accept-Encoding', response['Vary'])
+
+    def test_generated_without_build(self):
+        """Test the schema is generated on first request when nothing was built."""
+        for path in Path(self.schema_dir.name).iterdir():
+            path.unlink()
+        schema.forget_schema()
+        response = self.client.get(reverse('schema'), {'format': 'json'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/api/v1/posts/', response.content)
+
+    def test_docs_pages(self):
+        """Test the lazily loaded docs pages still render."""
+        self.assertEqual(self.client.get(reverse('swagger-ui')).status_code, 200)
+        self.assertEqual(self.client.get(reverse('redoc')).status_code, 200)
+
+
+class BuildSchemaCommandTest(TestCase):
+    """Test the build_schema command."""
+
+    def test_build_and_check(self):
+        """Test the command writes every format and --check notices a stale build."""
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('build_schema', dir=directory, stdout=StringIO(), stderr=StringIO())
+            names = sorted(path.name for path in Path(directory).iterdir())
+            self.assertEqual(names, ['openapi.json', 'openapi.json.gz', 'openapi.yaml', 'openapi.yaml.gz'])
+            built = (Path(directory) / 'openapi.yaml').read_bytes()
+            self.assertEqual(gzip.decompress((Path(directory) / 'openapi.yaml.gz').read_bytes()), built)
+
+            call_command('build_schema', dir=directory, check=True, stdout=StringIO(), stderr=StringIO())
+            (Path(directory) / 'openapi.yaml').write_bytes(YAML)
+            with self.assertRaises(CommandError):
+                call_command('build_schema', dir=directory, check=True, stdout=StringIO(), stderr=StringIO())
+
+
+class LazyAdminTest(TestCase):
+    """Test the admin still works with autodiscovery deferred."""
+
+    def test_admin_urls(self):
+        """Test the admin's models are registered once its URLs are used."""
+        from django.contrib import admin
+        from django.contrib.auth.models import User
+
+        response = self.client.get(reverse('admin:index'))
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(admin.site.is_registered(User))
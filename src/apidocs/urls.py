@@ -0,0 +1,9 @@
+from django.urls import path
+
+from . import views
+
+urlpatterns = [
+    path('schema/', views.schema, name='schema'),
+    path('docs/', views.swagger_ui, name='swagger-ui'),
+    path('redoc/', views.redoc, name='redoc'),
+]
@@ -0,0 +1,55 @@
+import functools
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.module_loading import import_string
+from django.views.decorators.http import require_safe
+
+from .schema import get_schema
+
+
+def _wants_json(request):
+    fmt = request.GET.get('format')
+    if fmt:
+        return fmt == 'json'
+    return 'json' in request.headers.get('Accept', '')
+
+
+@require_safe
+def schema(request):
+    """The prebuilt OpenAPI schema: YAML by default, JSON for ?format=json or Accept: ...json."""
+    schema_file = get_schema()['json' if _wants_json(request) else 'yaml']
+    use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    etag = schema_file.gzip_etag if use_gzip else schema_file.etag
+
+    if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+    if '*' in if_none_match or etag in if_none_match:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(schema_file.gzipped if use_gzip else schema_file.body,
+                                content_type=schema_file.content_type)
+        if use_gzip:
+            response['Content-Encoding'] = 'gzip'
+        response['Content-Disposition'] = f'inline; filename="openapi.{schema_file.format}"'
+    response['ETag'] = etag
+    response['Cache-Control'] = 'public, max-age=0, must-revalidate'
+    patch_vary_headers(response, ('Accept', 'Accept-Encoding'))
+    return response
+
+
+def lazy_view(view_path, **initkwargs):
+    """A class-based view that's only imported (and set up) when it first gets a request."""
+    @functools.cache
+    def load():
+        return import_string(view_path).as_view(**initkwargs)
+
+    def view(request, *args, **kwargs):
+        return load()(request, *args, **kwargs)
+    return view
+
+
+# drf-spectacular's views pull in most of its (and PyYAML's) modules, which no API
+# request needs; only import them once somebody opens the docs
+swagger_ui = lazy_view('drf_spectacular.views.SpectacularSwaggerView', url_name='schema')
+redoc = lazy_view('drf_spectacular.views.SpectacularRedocView', url_name='schema')
@@ -0,0 +1,148 @@
+"""
+Streaming NDJSON export of users, posts, comments, likes and follows.
+
+One JSON object per line, each with a "type":
+
+    {"type": "user", "id": 3, "username": "alice", ..., "bio": "..."}
+    {"type": "post", "id": 12, "author": 3, "content": "...", ...}
+
+Tables are read in keyset batches (WHERE id > last ORDER BY id LIMIT n)
+and each batch is iterated with .iterator(), so memory stays flat however
+big the table is, and no batch has to skip over rows with OFFSET. Lines are
+joined into chunks of about CHUNK_BYTES, optionally gzipped on the fly.
+
+The output is what bulk/importer.py reads back. Password hashes are never
+exported.
+"""
+import json
+import zlib
+from dataclasses import dataclass, field
+from datetime import date, datetime
+
+from django.contrib.auth.models import User
+from django.db.models import F, Q
+
+from posts.models import Comment, Like, Post
+from users.models import Follow
+
+BATCH_SIZE = 2000
+CHUNK_BYTES = 64 * 1024
+
+
+@dataclass(frozen=True)
+class Table:
+    """How one kind of record is read: its model, the values() it's built from and its type name."""
+    type: str
+    model: type
+    fields: tuple
+    expressions: dict = field(default_factory=dict)
+    # Foreign keys go out under the relation's name: author_id -> "author"
+    renames: dict = field(default_factory=dict)
+
+    def queryset(self):
+        if self.model is Post:
+            return Post.objects.all()  # posts queued for deletion stay out
+        return self.model._base_manager.all()
+
+
+TABLES = {
+    'users': Table('user', User, ('id', 'username', 'first_name', 'last_name', 'email', 'date_joined', 'is_active'), {
+        'bio': F('profile__bio'),
+        'profile_picture': F('profile__profile_picture'),
+        'website': F('profile__website'),
+        'location': F('profile__location'),
+    }),
+    'posts': Table('post', Post, (
+        'id', 'author_id', 'content', 'media_url', 'created_at', 'updated_at', 'likes_total', 'comments_total',
+    ), renames={'author_id': 'author'}),
+    'comments': Table('comment', Comment, ('id', 'post_id', 'author_id', 'content', 'created_at', 'updated_at'),
+                      renames={'post_id': 'post', 'author_id': 'author'}),
+    'likes': Table('like', Like, ('id', 'user_id', 'post_id', 'created_at'),
+                   renames={'user_id': 'user', 'post_id': 'post'}),
+    'follows': Table('follow', Follow, ('id', 'follower_id', 'followed_id', 'created_at'),
+                     renames={'follower_id': 'follower', 'followed_id': 'followed'}),
+}
+
+
+def _default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+encoder = json.JSONEncoder(default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def keyset(queryset, batch_size=BATCH_SIZE):
+    """Yield the rows of a values() queryset in primary key order, batch by batch."""
+    last = None
+    while True:
+        batch = queryset.order_by('pk')
+        if last is not None:
+            batch = batch.filter(pk__gt=last)
+        count = 0
+        for row in batch[:batch_size].iterator(chunk_size=batch_size):
+            count += 1
+            last = row['id']
+            yield row
+        if count < batch_size:
+            return
+
+
+def records(name, where=None, batch_size=BATCH_SIZE):
+    """Yield one table's records (dicts with their "type"), optionally filtered by a Q."""
+    table = TABLES[name]
+    queryset = table.queryset()
+    if where is not None:
+        queryset = queryset.filter(where)
+    renames = table.renames
+    for row in keyset(queryset.values(*table.fields, **table.expressions), batch_size):
+        yield {'type': table.type, **{renames.get(key, key): value for key, value in row.items()}}
+
+
+def table_records(names=TABLES, batch_size=BATCH_SIZE):
+    """Every record of the given tables, table after table."""
+    for name in names:
+        yield from records(name, batch_size=batch_size)
+
+
+def user_records(user, batch_size=BATCH_SIZE):
+    """A user's own data: their profile, posts, comments, likes and follows both ways."""
+    yield from records('users', Q(pk=user.pk), batch_size)
+    yield from records('posts', Q(author=user), batch_size)
+    yield from records('comments', Q(author=user), batch_size)
+    yield from records('likes', Q(user=user), batch_size)
+    yield from records('follows', Q(follower=user) | Q(followed=user), batch_size)
+
+
+def ndjson_chunks(items, compress=False, chunk_bytes=CHUNK_BYTES):
+    """Encode records as NDJSON and yield it in chunks of about `chunk_bytes` (gzipped if `compress`)."""
+    gzip = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+    lines = []
+    size = 0
+    for item in items:
+        line = encoder.encode(item).encode() + b'\n'
+        lines.append(line)
+        size += len(line)
+        if size >= chunk_bytes:
+            chunk = b''.join(lines)
+            lines, size = [], 0
+            if gzip:
+                chunk = gzip.compress(chunk)
+                if not chunk:
+                    continue
+            yield chunk
+    chunk = b''.join(lines)
+    if gzip:
+        chunk = gzip.compress(chunk) + gzip.flush()
+    if chunk:
+        yield chunk
+
+
+def write_export(items, fileobj, compress=False):
+    """Write an export to an open binary file; returns the number of bytes written."""
+    written = 0
+    for chunk in ndjson_chunks(items, compress):
+        fileobj.write(chunk)
+        written += len(chunk)
+    return written
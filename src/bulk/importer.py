@@ -0,0 +1,309 @@
+"""
+Bulk NDJSON import of users, posts, comments, likes and follows.
+
+Reads the format bulk/export.py writes (one {"type": ...} object per line)
+and writes it in batches of multi-row INSERTs built straight from the
+records: no model instances, no save(), so none of the per-row signals run
+(no profile re-saves, counter bumps, tag indexing, notifications or stream
+events). Everything they would have kept up to date is rebuilt once at the
+end for the imported rows only: post like/comment counters, comment thread
+paths, follow counters, the tag index and trending counts, and the
+autocomplete index. Comments come in as top-level ones (replies aren't
+carried over).
+
+Records get new ids here. The ids in the file are only used to connect
+records to each other, so referenced records must come earlier in the file
+(users before their posts, posts before their likes), as they do in an
+export. Records pointing at something that wasn't imported are skipped, as
+are users whose username is already taken.
+
+Passwords must be pre-hashed (any hasher in PASSWORD_HASHERS); users without
+one get an unusable password. created_at/updated_at/date_joined from the file
+are kept.
+"""
+import secrets
+import time
+from collections import Counter
+from itertools import islice
+
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, identify_hasher
+from django.contrib.auth.models import User
+from django.db import NotSupportedError, connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from posts.counters import refresh_counts
+from posts.models import Comment, Like, Post, PostTag
+from posts.tags import add_counts, bucket_for, extract_tags
+from posts.threads import fill_paths
+from users.autocomplete import mark_stale, reset_index
+from users.counters import refresh_follow_counts
+from users.models import Follow, UserProfile
+
+from .parsing import RecordError, parse_lines
+
+BATCH_SIZE = 5000
+# Parents before children: flushing one kind flushes everything before it first
+KINDS = ('user', 'post', 'comment', 'like', 'follow')
+PROFILE_FIELDS = ('bio', 'profile_picture', 'website', 'location')
+MAX_ERRORS = 100
+
+
+def insert_rows(model, columns, rows, returning=False, ignore_conflicts=False):
+    """
+    INSERT tuples of `columns` values in multi-row statements, skipping the ORM's per-value preparation.
+
+    The model's other columns get their field defaults. Returns the new ids
+    in row order when `returning`.
+    """
+    if not rows:
+        return []
+    ops = connection.ops
+    fields = [model._meta.get_field(name) for name in columns]
+    extra = [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key and field.name not in columns and field.attname not in columns
+    ]
+    defaults = tuple(field.get_db_prep_save(field.get_default(), connection) for field in extra)
+    datetimes = [i for i, field in enumerate(fields) if field.get_internal_type() == 'DateTimeField']
+
+    on_conflict = OnConflict.IGNORE if ignore_conflicts else None
+    names = ', '.join(ops.quote_name(field.column) for field in fields + extra)
+    row_sql = f'({", ".join(["%s"] * (len(fields) + len(extra)))})'
+    suffix = ops.on_conflict_suffix_sql(fields, on_conflict, None, None)
+    if returning:
+        suffix += f' RETURNING {ops.quote_name(model._meta.pk.column)}'
+    per_statement = max(ops.bulk_batch_size(fields + extra, rows), 1)
+
+    ids = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), per_statement):
+            chunk = rows[start:start + per_statement]
+            params = []
+            for row in chunk:
+                if datetimes:
+                    row = list(row)
+                    for i in datetimes:
+                        row[i] = ops.adapt_datetimefield_value(row[i])
+                params.extend(row)
+                params.extend(defaults)
+            cursor.execute(
+                f'{ops.insert_statement(on_conflict=on_conflict)} {ops.quote_name(model._meta.db_table)} '
+                f'({names}) VALUES {", ".join([row_sql] * len(chunk))} {suffix}',
+                params,
+            )
+            if returning:
+                ids.extend(pk for pk, in cursor.fetchall())
+    return ids
+
+
+def _password(value):
+    if not value:
+        # Same shape as make_password(None), without its slow per-character random string
+        return UNUSABLE_PASSWORD_PREFIX + secrets.token_urlsafe(30)
+    if not value.startswith(UNUSABLE_PASSWORD_PREFIX):
+        identify_hasher(value)  # ValueError for plain text or an unknown hasher
+    return value
+
+
+class Importer:
+    """
+    Feed records in with add(), then call finish().
+
+    Keeps a source id -> new id map for users and posts, which is what bounds
+    memory: roughly 100 bytes per imported user and post.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {kind: [] for kind in KINDS}
+        self.user_ids = {}
+        self.post_ids = {}
+        self.imported = Counter()
+        self.skipped = Counter()
+        self.errors = []
+        self.tag_counts = Counter()
+        self.now = timezone.now()
+
+    def error(self, message):
+        self.skipped['error'] += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append(message)
+
+    def add(self, record):
+        if isinstance(record, RecordError):
+            return self.error(str(record))
+        kind = record['type']
+        if kind not in self.pending:
+            return self.error(f'Unknown record type {kind!r}')
+        self.pending[kind].append(record)
+        if len(self.pending[kind]) >= self.batch_size:
+            self.flush(kind)
+
+    def flush(self, kind=KINDS[-1]):
+        """Write the pending records of `kind` and of every kind it can refer to."""
+        for name in KINDS[:KINDS.index(kind) + 1]:
+            batch, self.pending[name] = self.pending[name], []
+            if batch:
+                with transaction.atomic():
+                    getattr(self, f'_write_{name}s')(batch)
+
+    def _write_users(self, records):
+        by_username = {}
+        for record in records:
+            username = record.get('username')
+            if not isinstance(username, str) or not 0 < len(username) <= 150 or 'id' not in record:
+                self.error(f'Invalid user record {record.get("id")!r}')
+            elif username in by_username:
+                self.skipped['user'] += 1
+            else:
+                by_username[username] = record
+        taken = set(User.objects.filter(username__in=list(by_username)).values_list('username', flat=True))
+        self.skipped['user'] += len(taken)
+
+        users, sources = [], []
+        for username, record in by_username.items():
+            if username in taken:
+                continue
+            try:
+                password = _password(record.get('password'))
+            except ValueError:
+                self.error(f'User {username!r}: password must be pre-hashed')
+                continue
+            users.append((
+                username,
+                password,
+                record.get('first_name') or '',
+                record.get('last_name') or '',
+                record.get('email') or '',
+                record.get('is_active', True),
+                record.get('date_joined') or self.now,
+            ))
+            sources.append(record)
+        user_ids = insert_rows(
+            User, ('username', 'password', 'first_name', 'last_name', 'email', 'is_active', 'date_joined'),
+            users, returning=True,
+        )
+        insert_rows(UserProfile, ('user', 'created_at', 'updated_at') + PROFILE_FIELDS, [
+            (user_id, user[-1], user[-1], *(record.get(name) for name in PROFILE_FIELDS))
+            for user_id, user, record in zip(user_ids, users, sources)
+        ])
+        for user_id, record in zip(user_ids, sources):
+            self.user_ids[record['id']] = user_id
+        self.imported['user'] += len(users)
+
+    def _write_posts(self, records):
+        posts, sources = [], []
+        for record in records:
+            author_id = self.user_ids.get(record.get('author'))
+            if author_id is None or not record.get('content'):
+                self.skipped['post'] += 1
+                continue
+            created_at = record.get('created_at') or self.now
+            posts.append((
+                author_id, record['content'], record.get('media_url'), created_at, record.get('updated_at') or created_at,
+            ))
+            sources.append(record.get('id'))
+        post_ids = insert_rows(Post, ('author', 'content', 'media_url', 'created_at', 'updated_at'), posts,
+                               returning=True)
+
+        tags = []
+        for post_id, (_, content, _, created_at, _), source_id in zip(post_ids, posts, sources):
+            if source_id is not None:
+                self.post_ids[source_id] = post_id
+            for tag in extract_tags(content):
+                tags.append((tag, post_id, created_at))
+                self.tag_counts[tag, bucket_for(created_at)] += 1
+        insert_rows(PostTag, ('tag', 'post', 'created_at'), tags)
+        self.imported['post'] += len(posts)
+
+    def _write_comments(self, records):
+        comments = []
+        for record in records:
+            post_id = self.post_ids.get(record.get('post'))
+            author_id = self.user_ids.get(record.get('author'))
+            if post_id is None or author_id is None or not record.get('content'):
+                self.skipped['comment'] += 1
+                continue
+            created_at = record.get('created_at') or self.now
+            comments.append((post_id, author_id, record['content'], created_at, record.get('updated_at') or created_at))
+        insert_rows(Comment, ('post', 'author', 'content', 'created_at', 'updated_at'), comments)
+        self.imported['comment'] += len(comments)
+
+    def _write_likes(self, records):
+        likes, seen = [], set()
+        for record in records:
+            user_id = self.user_ids.get(record.get('user'))
+            post_id = self.post_ids.get(record.get('post'))
+            if user_id is None or post_id is None or (user_id, post_id) in seen:
+                self.skipped['like'] += 1
+                continue
+            seen.add((user_id, post_id))
+            likes.append((user_id, post_id, record.get('created_at') or self.now))
+        # Duplicates further apart in the file are dropped by the unique constraint
+        insert_rows(Like, ('user', 'post', 'created_at'), likes, ignore_conflicts=True)
+        self.imported['like'] += len(likes)
+
+    def _write_follows(self, records):
+        follows, seen = [], set()
+        for record in records:
+            follower_id = self.user_ids.get(record.get('follower'))
+            followed_id = self.user_ids.get(record.get('followed'))
+            pair = (follower_id, followed_id)
+            if follower_id is None or followed_id is None or follower_id == followed_id or pair in seen:
+                self.skipped['follow'] += 1
+                continue
+            seen.add(pair)
+            follows.append((follower_id, followed_id, record.get('created_at') or self.now))
+        insert_rows(Follow, ('follower', 'followed', 'created_at'), follows, ignore_conflicts=True)
+        self.imported['follow'] += len(follows)
+
+    def finish(self):
+        """Write what's left, then rebuild everything the skipped signals would have maintained."""
+        self.flush()
+        post_ids = list(self.post_ids.values())
+        for start in range(0, len(post_ids), self.batch_size):
+            fill_paths(Comment.objects.filter(post_id__in=post_ids[start:start + self.batch_size]))
+            refresh_counts(post_ids[start:start + self.batch_size])
+        user_ids = list(self.user_ids.values())
+        for start in range(0, len(user_ids), self.batch_size):
+            refresh_follow_counts(user_ids[start:start + self.batch_size])
+        add_counts(self.tag_counts)
+        if self.user_ids:
+            mark_stale()
+            reset_index()
+
+
+def _numbered_batches(lines, size):
+    numbered = enumerate(lines, 1)
+    while batch := list(islice(numbered, size)):
+        yield batch
+
+
+def read_records(lines, workers=0, batch_size=BATCH_SIZE):
+    """Parse NDJSON lines into records, in order, optionally across `workers` processes."""
+    batches = _numbered_batches(lines, batch_size)
+    if not workers:
+        for batch in batches:
+            yield from parse_lines(batch)
+        return
+
+    import multiprocessing
+    with multiprocessing.Pool(workers) as pool:
+        # imap keeps file order, which the id mapping relies on
+        for parsed in pool.imap(parse_lines, batches):
+            yield from parsed
+
+
+def import_lines(lines, batch_size=BATCH_SIZE, workers=0, progress=None):
+    """Import NDJSON lines (bytes or str); returns the finished Importer with its counts and errors."""
+    if not connection.features.can_return_rows_from_bulk_insert:
+        raise NotSupportedError('Importing needs a database that returns ids from bulk inserts (PostgreSQL, SQLite)')
+    importer = Importer(batch_size)
+    started = time.perf_counter()
+    for count, record in enumerate(read_records(lines, workers, batch_size), 1):
+        importer.add(record)
+        if progress and count % 100_000 == 0:
+            progress(count, time.perf_counter() - started)
+    importer.finish()
+    return importer
@@ -0,0 +1,103 @@
+import os
+import resource
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from bulk.export import BATCH_SIZE, table_records, write_export
+from posts.models import Post
+
+USERNAME = 'bench_export_author'
+SEED_BATCH = 10_000
+
+
+def rss_bytes():
+    """Current resident set size (Linux), else the peak so far."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler(threading.Thread):
+    def __init__(self, interval=0.1):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.samples = []
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.samples.append(rss_bytes())
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed N posts and export the posts table as NDJSON, sampling RSS throughout to show memory '
+        'stays flat however many rows there are (e.g. --rows 10000000). Seeds the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--output', default=os.devnull)
+        parser.add_argument('--keep-data', action='store_true', help='Leave the seeded posts in place')
+
+    def handle(self, *args, **options):
+        author, _ = User.objects.get_or_create(username=USERNAME)
+        try:
+            self.seed(author, options['rows'])
+            self.export(options)
+        finally:
+            if not options['keep_data']:
+                # Raw delete: no per-row cascade collection for millions of posts
+                Post.all_objects.filter(author=author)._raw_delete(Post.all_objects.db)
+                author.delete()
+
+    def seed(self, author, rows):
+        existing = Post.all_objects.filter(author=author).count()
+        started = time.perf_counter()
+        for offset in range(existing, rows, SEED_BATCH):
+            with transaction.atomic():
+                Post.all_objects.bulk_create(
+                    Post(author=author, content=f'Bench post {i} ' + 'x' * 100)
+                    for i in range(offset, min(rows, offset + SEED_BATCH))
+                )
+        if rows > existing:
+            self.stdout.write(f'Seeded {rows - existing:,} posts in {time.perf_counter() - started:.1f}s')
+
+    def export(self, options):
+        sampler = RssSampler()
+        baseline = rss_bytes()
+        sampler.start()
+        count = 0
+        checkpoints = []
+
+        def counted(items):
+            nonlocal count
+            for item in items:
+                count += 1
+                if count % 500_000 == 0:
+                    checkpoints.append((count, rss_bytes()))
+                yield item
+
+        started = time.perf_counter()
+        with open(options['output'], 'wb') as f:
+            written = write_export(counted(table_records(['posts'], options['batch_size'])), f, options['gzip'])
+        elapsed = time.perf_counter() - started
+        sampler.stop_event.set()
+        sampler.join()
+
+        mb = 1024 * 1024
+        peak = max(sampler.samples or [rss_bytes()])
+        self.stdout.write(f'Exported {count:,} posts, {written / mb:,.0f} MB, in {elapsed:.1f}s '
+                          f'({count / elapsed:,.0f} rows/s)')
+        for rows, rss in checkpoints:
+            self.stdout.write(f'  after {rows:>11,} rows  RSS {rss / mb:7.1f} MB')
+        self.stdout.write(f'RSS before {baseline / mb:.1f} MB, peak {peak / mb:.1f} MB '
+                          f'(+{(peak - baseline) / mb:.1f} MB)')
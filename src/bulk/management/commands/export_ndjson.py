@@ -0,0 +1,60 @@
+import sys
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from bulk.export import BATCH_SIZE, TABLES, table_records, user_records, write_export
+
+
+class Command(BaseCommand):
+    help = (
+        'Export tables (or one user\'s data) as NDJSON with constant memory, unlike dumpdata. '
+        'Writes to stdout unless --output is given; gzips with --gzip or an --output ending in .gz.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', help=f'Any of {", ".join(TABLES)} (default: all)')
+        parser.add_argument('--user', help="Export this user's own data instead (id or username)")
+        parser.add_argument('--output', '-o', help='File to write')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        unknown = set(options['tables']) - set(TABLES)
+        if unknown:
+            raise CommandError(f'Unknown tables: {", ".join(sorted(unknown))}')
+        if options['user']:
+            lookup = {'pk': options['user']} if options['user'].isdigit() else {'username': options['user']}
+            try:
+                items = user_records(User.objects.get(**lookup), options['batch_size'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user {options["user"]!r}')
+        else:
+            items = table_records(options['tables'] or list(TABLES), options['batch_size'])
+
+        output = options['output']
+        compress = options['gzip'] or bool(output and output.endswith('.gz'))
+        counted = _Counter(items)
+        started = time.perf_counter()
+        if output:
+            with open(output, 'wb') as f:
+                written = write_export(counted, f, compress)
+        else:
+            written = write_export(counted, sys.stdout.buffer, compress)
+        elapsed = time.perf_counter() - started
+        self.stderr.write(
+            f'{counted.count} records, {written / 1e6:.1f} MB in {elapsed:.1f}s '
+            f'({counted.count / max(elapsed, 1e-9):,.0f} records/s)'
+        )
+
+
+class _Counter:
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
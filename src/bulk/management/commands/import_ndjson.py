@@ -0,0 +1,60 @@
+import gzip
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import NotSupportedError
+
+from bulk.importer import BATCH_SIZE, KINDS, import_lines
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users, profiles, posts, comments, likes and follows from NDJSON (the export_ndjson format) '
+        'with batched bulk inserts, then rebuild counters, tags and the autocomplete index. '
+        'Reads stdin unless a file is given; .gz files are decompressed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Parse JSON in this many extra processes (default: parse inline)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if path == '-':
+            source = sys.stdin.buffer
+        else:
+            try:
+                source = open(path, 'rb')
+            except OSError as e:
+                raise CommandError(e)
+            if path.endswith('.gz') or source.peek(2)[:2] == b'\x1f\x8b':
+                source.close()
+                source = gzip.open(path, 'rb')
+
+        def progress(count, elapsed):
+            self.stderr.write(f'  {count:,} records read ({count / elapsed:,.0f}/s)')
+
+        started = time.perf_counter()
+        try:
+            importer = import_lines(source, options['batch_size'], options['workers'], progress)
+        except NotSupportedError as e:
+            raise CommandError(e)
+        finally:
+            if source is not sys.stdin.buffer:
+                source.close()
+        elapsed = time.perf_counter() - started
+
+        total = sum(importer.imported.values())
+        for kind in KINDS:
+            if importer.imported[kind] or importer.skipped[kind]:
+                self.stdout.write(f'{kind}s: {importer.imported[kind]:,} imported, {importer.skipped[kind]:,} skipped')
+        for message in importer.errors:
+            self.stderr.write(message)
+        if importer.skipped['error']:
+            self.stderr.write(self.style.WARNING(f'{importer.skipped["error"]:,} records had errors'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {total:,} rows in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)'
+        ))
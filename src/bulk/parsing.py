@@ -0,0 +1,52 @@
+"""
+Decoding NDJSON export lines back into records.
+
+Kept free of Django imports so importer worker processes (--workers) can
+load it without setting Django up.
+"""
+import json
+from datetime import datetime, timezone
+
+DATETIME_FIELDS = ('date_joined', 'created_at', 'updated_at')
+
+
+class RecordError(ValueError):
+    pass
+
+
+def parse_line(line):
+    """One NDJSON line -> a record dict with its timestamps as aware datetimes."""
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise RecordError(f'Invalid JSON: {e}')
+    if not isinstance(record, dict) or not isinstance(record.get('type'), str):
+        raise RecordError('Expected an object with a "type"')
+    for name in DATETIME_FIELDS:
+        value = record.get(name)
+        if value is None:
+            continue
+        try:
+            value = datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            raise RecordError(f'Invalid {name}: {value!r}')
+        record[name] = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return record
+
+
+def parse_lines(numbered_lines):
+    """
+    Parse (line number, line) pairs, skipping blank lines.
+
+    Bad lines come back as RecordError instances in place of the record, so
+    one broken line doesn't stop the rest of the batch.
+    """
+    parsed = []
+    for number, line in numbered_lines:
+        if not line.strip():
+            continue
+        try:
+            parsed.append(parse_line(line))
+        except RecordError as e:
+            parsed.append(RecordError(f'Line {number}: {e}'))
+    return parsed
@@ -0,0 +1,189 @@
+import gzip
+import json
+import tempfile
+from io import StringIO
+from pathlib import Path
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from posts.models import Comment, Like, Post, PostTag, TagCount
+from users.autocomplete import search_users
+from users.models import Follow
+
+from .export import ndjson_chunks, records, table_records
+from .importer import import_lines
+
+
+class ExportTest(APITestCase):
+    """Test the streaming NDJSON export."""
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create_user(username='alice', password='testpass123')
+        self.bob = User.objects.create_user(username='bob', password='testpass123')
+        self.alice.profile.bio = 'Tea person'
+        self.alice.profile.save()
+        self.posts = [Post.objects.create(content=f'Post {i}', author=self.alice) for i in range(5)]
+        bobs = Post.objects.create(content='Bob here', author=self.bob)
+        Comment.objects.create(content='Hi', author=self.alice, post=bobs)
+        Like.objects.create(user=self.alice, post=bobs)
+        Like.objects.create(user=self.bob, post=self.posts[0])
+        Follow.objects.create(follower=self.alice, followed=self.bob)
+        Follow.objects.create(follower=self.bob, followed=self.alice)
+
+    def read(self, response):
+        body = b''.join(response.streaming_content)
+        if response['Content-Type'] == 'application/gzip':
+            body = gzip.decompress(body)
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    def test_keyset_batches(self):
+        """Test small batches still return every row once, in order."""
+        rows = list(records('posts', batch_size=2))
+        self.assertEqual([row['id'] for row in rows], sorted(post.pk for post in Post.objects.all()))
+        self.assertEqual(rows[0]['author'], self.alice.pk)
+
+    def test_my_export(self):
+        """Test /export/me/ streams the user's own records and nothing else."""
+        self.client.force_authenticate(user=self.alice)
+        response = self.client.get(reverse('export-me'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        lines = self.read(response)
+        kinds = [line['type'] for line in lines]
+        self.assertEqual(kinds, ['user'] + ['post'] * 5 + ['comment', 'like', 'follow', 'follow'])
+        self.assertEqual(lines[0]['bio'], 'Tea person')
+        self.assertNotIn('password', lines[0])
+
+    def test_gzip(self):
+        """Test ?gzip=1 streams a gzip file of the same lines."""
+        self.client.force_authenticate(user=self.alice)
+        plain = self.read(self.client.get(reverse('export-me')))
+        response = self.client.get(reverse('export-me'), {'gzip': '1'})
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(self.read(response), plain)
+
+    def test_tables_are_staff_only(self):
+        """Test whole-table dumps need a staff user."""
+        self.client.force_authenticate(user=self.alice)
+        self.assertEqual(self.client.get(reverse('export-list')).status_code, status.HTTP_403_FORBIDDEN)
+        self.alice.is_staff = True
+        self.alice.save()
+        response = self.client.get(reverse('export-list'), {'tables': 'likes,follows'})
+        self.assertEqual([line['type'] for line in self.read(response)], ['like'] * 2 + ['follow'] * 2)
+        bad = self.client.get(reverse('export-list'), {'tables': 'secrets'})
+        self.assertEqual(bad.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_chunking(self):
+        """Test lines are grouped into chunks and gzip output decompresses whole."""
+        items = ({'type': 'x', 'n': i} for i in range(1000))
+        chunks = list(ndjson_chunks(items, chunk_bytes=1024))
+        self.assertGreater(len(chunks), 5)
+        self.assertEqual(len(b''.join(chunks).splitlines()), 1000)
+        zipped = b''.join(ndjson_chunks(({'n': i} for i in range(1000)), compress=True, chunk_bytes=1024))
+        self.assertEqual(len(gzip.decompress(zipped).splitlines()), 1000)
+
+    def test_command(self):
+        """Test export_ndjson writes a gzip file when the name ends in .gz."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'dump.ndjson.gz'
+            call_command('export_ndjson', 'users', 'posts', output=str(path), stderr=StringIO())
+            lines = gzip.decompress(path.read_bytes()).decode().splitlines()
+            self.assertEqual(len(lines), 2 + 6)
+
+            path = Path(directory) / 'bob.ndjson'
+            call_command('export_ndjson', user='bob', output=str(path), stderr=StringIO())
+            self.assertEqual(json.loads(path.read_text().splitlines()[0])['username'], 'bob')
+
+
+class ImportTest(APITestCase):
+    """Test the bulk NDJSON importer."""
+
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user(username='taken', password='testpass123')
+        self.records = [
+            {'type': 'user', 'id': 1, 'username': 'carol', 'password': make_password('secret123'),
+             'date_joined': '2020-01-01T00:00:00+00:00', 'bio': 'Imported'},
+            {'type': 'user', 'id': 2, 'username': 'dave'},
+            {'type': 'user', 'id': 3, 'username': 'taken'},
+            {'type': 'user', 'id': 4, 'username': 'erin', 'password': 'plaintext'},
+            {'type': 'post', 'id': 10, 'author': 1, 'content': 'Hello #tea', 'created_at': '2020-01-02T10:30:00Z'},
+            {'type': 'post', 'id': 11, 'author': 2, 'content': 'Second'},
+            {'type': 'post', 'id': 12, 'author': 3, 'content': 'By a skipped user'},
+            {'type': 'comment', 'id': 20, 'post': 10, 'author': 2, 'content': 'Nice'},
+            {'type': 'like', 'id': 30, 'user': 2, 'post': 10},
+            {'type': 'like', 'id': 31, 'user': 1, 'post': 10},
+            {'type': 'like', 'id': 32, 'user': 1, 'post': 10},
+            {'type': 'follow', 'id': 40, 'follower': 2, 'followed': 1},
+            {'type': 'follow', 'id': 41, 'follower': 1, 'followed': 1},
+        ]
+
+    def lines(self):
+        return [json.dumps(record) for record in self.records] + ['', '{broken']
+
+    def test_import(self):
+        """Test records land with mapped ids, kept timestamps and rebuilt counters."""
+        importer = import_lines(self.lines(), batch_size=2)
+        self.assertEqual(importer.imported['user'], 2)
+        self.assertEqual(importer.skipped['user'], 1)
+        self.assertEqual(importer.skipped['post'], 1)
+        self.assertEqual(importer.skipped['follow'], 1)
+        self.assertEqual(importer.skipped['error'], 2)  # erin's plain password and the broken line
+
+        carol = User.objects.get(username='carol')
+        self.assertTrue(carol.check_password('secret123'))
+        self.assertEqual(carol.date_joined.year, 2020)
+        self.assertEqual(carol.profile.bio, 'Imported')
+        self.assertEqual(carol.profile.followers_total, 1)
+        self.assertFalse(User.objects.get(username='dave').has_usable_password())
+
+        post = Post.objects.get(content='Hello #tea')
+        self.assertEqual(post.author, carol)
+        self.assertEqual((post.created_at.year, post.created_at.hour), (2020, 10))
+        self.assertEqual((post.likes_total, post.comments_total), (2, 1))
+        self.assertTrue(PostTag.objects.filter(post=post, tag='#tea').exists())
+        self.assertEqual(TagCount.objects.get(tag='#tea').count, 1)
+        self.assertEqual([row[0] for row in search_users('car')], [carol.pk])
+
+        # auto_now fields behave normally again afterwards
+        self.assertEqual(Post.objects.create(content='New', author=carol).created_at.year, timezone.now().year)
+
+    def test_workers(self):
+        """Test parsing in worker processes gives the same result."""
+        importer = import_lines(self.lines(), batch_size=3, workers=2)
+        self.assertEqual(importer.imported, {'user': 2, 'post': 2, 'comment': 1, 'like': 2, 'follow': 1})
+
+    def test_export_round_trip(self):
+        """Test an export imports back under new names."""
+        alice = User.objects.create_user(username='alice', password='testpass123')
+        post = Post.objects.create(content='Hi @taken', author=alice)
+        Like.objects.create(user=alice, post=post)
+        exported = b''.join(ndjson_chunks(table_records())).splitlines()
+        alice.username = 'alice_old'
+        alice.save()
+        User.objects.filter(username='taken').update(username='taken_old')
+
+        importer = import_lines(exported)
+        self.assertEqual(importer.imported['user'], 2)
+        copy = Post.objects.exclude(pk=post.pk).get(content='Hi @taken')
+        self.assertEqual(copy.author.username, 'alice')
+        self.assertEqual(copy.likes_total, 1)
+        self.assertEqual(copy.created_at, post.created_at)
+
+    def test_command(self):
+        """Test import_ndjson reads gzipped files."""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'in.ndjson.gz'
+            path.write_bytes(gzip.compress('\n'.join(self.lines()).encode()))
+            out = StringIO()
+            call_command('import_ndjson', str(path), stdout=out, stderr=StringIO())
+        self.assertIn('users: 2 imported, 1 skipped', out.getvalue())
+        self.assertTrue(User.objects.filter(username='carol').exists())
@@ -0,0 +1,53 @@
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+from rest_framework import permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .export import TABLES, ndjson_chunks, table_records, user_records
+
+
+async def _async_chunks(chunks):
+    # Under ASGI Django would read a sync iterator into a list before sending it;
+    # pulling chunk by chunk on the thread the view ran on keeps memory flat
+    pull = sync_to_async(next)
+    while (chunk := await pull(chunks, None)) is not None:
+        yield chunk
+
+
+def ndjson_response(request, items, filename):
+    """Stream records as NDJSON, gzipped with ?gzip=1."""
+    compress = request.query_params.get('gzip') in ('1', 'true')
+    chunks = ndjson_chunks(items, compress)
+    if isinstance(request._request, ASGIRequest):
+        chunks = _async_chunks(chunks)
+    response = StreamingHttpResponse(
+        chunks, content_type='application/gzip' if compress else 'application/x-ndjson'
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}.ndjson{".gz" if compress else ""}"'
+    return response
+
+
+class ExportViewSet(viewsets.ViewSet):
+    """
+    Streaming NDJSON exports (see bulk/export.py).
+
+    /export/me/ is the signed-in user's own data; /export/?tables=posts,likes
+    dumps whole tables for analytics and is staff only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    throttle_scope = 'bulk'
+
+    def list(self, request):
+        """Dump whole tables (?tables= any of users, posts, comments, likes, follows; default all)."""
+        names = [name for name in request.query_params.get('tables', '').split(',') if name] or list(TABLES)
+        unknown = [name for name in names if name not in TABLES]
+        if unknown:
+            return Response({'error': f'Unknown tables: {", ".join(unknown)}.'}, status=status.HTTP_400_BAD_REQUEST)
+        return ndjson_response(request, table_records(names), 'teacup-' + '-'.join(names))
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def me(self, request):
+        """Everything the signed-in user created: profile, posts, comments, likes and follows."""
+        return ndjson_response(request, user_records(request.user), f'teacup-{request.user.username}')
@@ -0,0 +1,59 @@
+"""
+Async twins of the FeedViewSet list actions (see teacup/async_api.py).
+
+Same querysets, filters, pagination and serializer as the DRF actions; the
+difference is that the COUNT and the page load run together, and so do the
+author cards and the viewer's likes for the page. Blocked/muted authors and
+seen posts are left out before paginating, just as in the DRF actions.
+"""
+from django.http import JsonResponse
+
+from posts.async_views import serialize_posts
+from posts.models import Post
+from posts.serializers import PostListSerializer
+from teacup.async_api import async_reads, authenticate, error, gather_queries, not_authenticated, paginate
+
+from .seen import exclude_seen, wants_unseen
+from .views import FeedViewSet, FeedPagination
+
+
+async def post_page(request, user, queryset, action):
+    viewset = FeedViewSet(request=request, action=action, format_kwarg=None, args=(), kwargs={})
+
+    def filtered():
+        # The block/mute and seen filters may read the database for their cached sets
+        unblocked = viewset.filter_queryset(queryset)
+        return exclude_seen(user.id, unblocked) if wants_unseen(request) else unblocked
+
+    (queryset,) = await gather_queries(filtered)
+    posts, envelope = await paginate(request, queryset, FeedPagination)
+    if posts is None:
+        return error('Invalid page.', 404)
+    envelope['results'] = await serialize_posts(request, user, posts, PostListSerializer)
+    return JsonResponse(envelope)
+
+
+@async_reads(FeedViewSet.as_view({'get': 'my_feed'}))
+async def my_feed(request):
+    drf_request, user = await authenticate(request)
+    if not user.is_authenticated:
+        return not_authenticated(drf_request)
+    # Follow ids come from the short-lived cache the autocomplete uses
+    (followed,) = await gather_queries(lambda: FeedViewSet.feed_authors(user.id))
+    return await post_page(drf_request, user, FeedViewSet.feed_queryset(followed + [user.id]), 'my_feed')
+
+
+@async_reads(FeedViewSet.as_view({'get': 'discover'}))
+async def discover(request):
+    drf_request, user = await authenticate(request)
+    if not user.is_authenticated:
+        return not_authenticated(drf_request)
+    return await post_page(drf_request, user, Post.objects.all(), 'discover')
+
+
+@async_reads(FeedViewSet.as_view({'get': 'trending'}))
+async def trending(request):
+    drf_request, user = await authenticate(request)
+    if not user.is_authenticated:
+        return not_authenticated(drf_request)
+    return await post_page(drf_request, user, FeedViewSet.trending_queryset(), 'trending')
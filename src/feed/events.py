@@ -0,0 +1,228 @@
+"""
+In-process pub/sub behind the /feed/stream/ Server-Sent Events endpoint.
+
+Every open stream registers a Subscription with the process-wide Broker: the
+authors whose new posts it wants and the posts (on the viewer's screen) whose
+like/comment counts it wants. Writes publish straight into the broker from
+signals (see feed/signals.py), so a stream only wakes up when something it
+cares about happens; an idle stream is just a coroutine parked on its queue.
+
+Count changes are coalesced: touched post ids collect for
+FEED_STREAM_COUNT_DEBOUNCE seconds, then one query reads the fresh counters
+for all of them and fans them out, however many streams watch a hot post.
+
+The broker only sees writes made by its own process. With several server
+processes, set FEED_STREAM_POLL_INTERVAL and each process runs one Poller
+thread that picks up new posts and counter changes from the database for
+everything its streams are subscribed to. Streams drop events they've already
+sent, so a write seen both ways is delivered once.
+"""
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from posts.models import Post
+
+logger = logging.getLogger(__name__)
+
+# Events a stream can fall behind by before it's told to resync
+QUEUE_SIZE = 256
+POLL_BATCH = 1000
+
+
+class Subscription:
+    """One open stream: its interests and the asyncio queue its events land in."""
+
+    def __init__(self, authors, posts, loop=None):
+        self.authors = set(authors)
+        self.posts = set(posts)
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def deliver(self, event):
+        """Queue an event from any thread."""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            pass  # the loop is gone, the stream is closing anyway
+
+    def _put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class Broker:
+    """Routes post and counter events to the subscriptions interested in them."""
+
+    def __init__(self, debounce=None):
+        self.debounce = debounce
+        self._lock = threading.Lock()
+        self._by_author = defaultdict(set)
+        self._by_post = defaultdict(set)
+        self._dirty = set()
+        self._timer = None
+
+    def subscribe(self, subscription):
+        with self._lock:
+            for author_id in subscription.authors:
+                self._by_author[author_id].add(subscription)
+            for post_id in subscription.posts:
+                self._by_post[post_id].add(subscription)
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for index, keys in ((self._by_author, subscription.authors), (self._by_post, subscription.posts)):
+                for key in keys:
+                    subscribers = index.get(key)
+                    if subscribers is not None:
+                        subscribers.discard(subscription)
+                        if not subscribers:
+                            del index[key]
+
+    def watched_posts(self):
+        with self._lock:
+            return set(self._by_post)
+
+    def watched_authors(self):
+        with self._lock:
+            return set(self._by_author)
+
+    def __len__(self):
+        with self._lock:
+            return len({sub for subs in self._by_author.values() for sub in subs}
+                       | {sub for subs in self._by_post.values() for sub in subs})
+
+    def publish_post(self, post_id, author_id):
+        with self._lock:
+            subscribers = list(self._by_author.get(author_id, ()))
+        event = ('post', {'id': post_id, 'author': author_id})
+        for subscription in subscribers:
+            subscription.deliver(event)
+
+    def publish_counts(self, rows):
+        """Fan out (post_id, likes, comments) rows to the streams watching those posts."""
+        for post_id, likes, comments in rows:
+            with self._lock:
+                subscribers = list(self._by_post.get(post_id, ()))
+            event = ('counts', {'id': post_id, 'likes_count': likes, 'comments_count': comments})
+            for subscription in subscribers:
+                subscription.deliver(event)
+
+    def touch(self, post_ids=None):
+        """Note that counters changed for some posts (None: possibly all of them)."""
+        with self._lock:
+            watched = self._by_post.keys()
+            touched = set(watched) if post_ids is None else {pid for pid in post_ids if pid in watched}
+            if not touched:
+                return
+            self._dirty |= touched
+            debounce = settings.FEED_STREAM_COUNT_DEBOUNCE if self.debounce is None else self.debounce
+            if debounce <= 0:
+                schedule = False
+            elif self._timer is None:
+                self._timer = threading.Timer(debounce, self._timed_flush)
+                self._timer.daemon = True
+                schedule = True
+            else:
+                return
+        if schedule:
+            self._timer.start()
+        else:
+            self.flush_counts()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush_counts()
+        except Exception:
+            logger.exception('Could not publish counter updates')
+        finally:
+            close_old_connections()
+
+    def flush_counts(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            self.publish_counts(
+                Post.objects.filter(pk__in=dirty).values_list('id', 'likes_total', 'comments_total')
+            )
+
+
+class Poller(threading.Thread):
+    """
+    Polls the database for writes made by other processes.
+
+    One per process, no matter how many streams are open: each tick is one
+    query for new posts by watched authors and one for the watched posts'
+    counters, and nothing at all while no streams are open.
+    """
+
+    def __init__(self, broker, interval):
+        super().__init__(name='feed-stream-poller', daemon=True)
+        self.broker = broker
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.last_post_id = None
+        self.counts = {}
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('Feed stream poll failed')
+            finally:
+                close_old_connections()
+
+    def poll(self):
+        authors = self.broker.watched_authors()
+        posts = self.broker.watched_posts()
+        if self.last_post_id is None:
+            self.last_post_id = Post.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+        if not authors and not posts:
+            return
+
+        if authors:
+            new = list(
+                Post.objects.filter(pk__gt=self.last_post_id, author_id__in=authors)
+                .order_by('pk').values_list('pk', 'author_id')[:POLL_BATCH]
+            )
+            for post_id, author_id in new:
+                self.broker.publish_post(post_id, author_id)
+            if new:
+                self.last_post_id = new[-1][0]
+
+        self.counts = {post_id: counts for post_id, counts in self.counts.items() if post_id in posts}
+        changed = []
+        rows = Post.objects.filter(pk__in=posts).values_list('id', 'likes_total', 'comments_total')
+        for post_id, likes, comments in rows.iterator(chunk_size=POLL_BATCH):
+            if self.counts.get(post_id) != (likes, comments):
+                if post_id in self.counts:
+                    changed.append((post_id, likes, comments))
+                self.counts[post_id] = (likes, comments)
+        self.broker.publish_counts(changed)
+
+
+_broker = Broker()
+_poller = None
+_poller_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker, starting the poller on first use if it's configured."""
+    global _poller
+    interval = settings.FEED_STREAM_POLL_INTERVAL
+    if interval > 0 and _poller is None:
+        with _poller_lock:
+            if _poller is None:
+                _poller = Poller(_broker, interval)
+                _poller.start()
+    return _broker
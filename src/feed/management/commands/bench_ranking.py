@@ -0,0 +1,85 @@
+import random
+import statistics
+import time
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from feed.ranking import gather_candidates, rank
+
+BUDGET_MS = 20
+
+
+def synthetic_candidates(size, now, seed=0):
+    """`size` candidate rows over the ranking window, plus affinity/followee/fof maps of realistic size."""
+    rng = random.Random(seed)
+    authors = max(size // 10, 1)
+    rows = [
+        (
+            post_id,
+            rng.randrange(authors),
+            now - timedelta(seconds=rng.randrange(72 * 3600)),
+            int(rng.paretovariate(1.2)) - 1,
+            int(rng.paretovariate(1.5)) - 1,
+        )
+        for post_id in range(1, size + 1)
+    ]
+    # Sources overlap, so some candidates come in twice
+    rows += rng.sample(rows, size // 20)
+    affinity = {rng.randrange(authors): rng.random() * 3 for _ in range(200)}
+    followees = {rng.randrange(authors) for _ in range(min(300, authors))}
+    fof = {rng.randrange(authors): rng.randrange(1, 20) for _ in range(500)}
+    return rows, affinity, followees, fof
+
+
+def percentile(samples, pct):
+    return sorted(samples)[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+
+class Command(BaseCommand):
+    help = (
+        f'Time the For You scoring pass (feed/ranking.py rank()) against the candidate set size; '
+        f'the budget is {BUDGET_MS} ms. With --user, also time a full ranking for that user '
+        f'(candidate queries + scoring) against the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,2000,3000,5000,10000,20000')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--user', help='Username to rank a real feed for')
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        self.stdout.write(f'{"candidates":>10}  {"p50 ms":>7}  {"p95 ms":>7}  {"max ms":>7}')
+        for size in [int(s) for s in options['sizes'].split(',')]:
+            candidates = synthetic_candidates(size, now)
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                rank(*candidates[:1], now, *candidates[1:])
+                timings.append((time.perf_counter() - started) * 1000)
+            p95 = percentile(timings, 95)
+            flag = '' if p95 <= BUDGET_MS else '  over budget'
+            self.stdout.write(
+                f'{size:>10,}  {statistics.median(timings):>7.2f}  {p95:>7.2f}  {max(timings):>7.2f}{flag}'
+            )
+
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f'No user {options["user"]!r}')
+            gather, scoring = [], []
+            for _ in range(min(options['repeat'], 10)):
+                started = time.perf_counter()
+                rows, affinity, followees, fof = gather_candidates(user.pk, now)
+                gathered = time.perf_counter()
+                rank(rows, now, affinity, followees, fof)
+                gather.append((gathered - started) * 1000)
+                scoring.append((time.perf_counter() - gathered) * 1000)
+            self.stdout.write(
+                f'{user.username}: {len(rows):,} candidates, queries p50 {statistics.median(gather):.1f} ms, '
+                f'scoring p50 {statistics.median(scoring):.2f} ms'
+            )
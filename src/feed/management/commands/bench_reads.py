@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from posts.models import Post, Like
+from users.models import Follow
+
+from .bench_stream import session_cookie
+
+VIEWER = 'bench_reads_viewer'
+AUTHORS = 'bench_reads_author'
+
+
+class Command(BaseCommand):
+    help = (
+        'Hammer read endpoints on a running server with N concurrent keep-alive clients and report '
+        'requests/sec and latency percentiles. Run it once against gunicorn (WSGI) and once against '
+        'uvicorn (ASGI, async read views) to compare. Seeds throwaway users/posts in the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--paths', default='/api/v1/feed/my_feed/,/api/v1/feed/discover/,post,user',
+                            help="Comma separated paths; 'post' and 'user' mean a seeded detail page")
+        parser.add_argument('--concurrency', type=int, default=100)
+        parser.add_argument('--duration', type=float, default=10.0)
+        parser.add_argument('--authors', type=int, default=20)
+        parser.add_argument('--posts', type=int, default=25, help='Posts per seeded author')
+        parser.add_argument('--keep-data', action='store_true', help='Leave the seeded rows in place')
+
+    def handle(self, *args, **options):
+        cookie, paths = self.seed(options)
+        try:
+            for path in paths:
+                self.stdout.write(asyncio.run(self.run(path, cookie, options)))
+        finally:
+            if not options['keep_data']:
+                User.objects.filter(username__startswith='bench_reads_').delete()
+
+    def seed(self, options):
+        User.objects.filter(username__startswith='bench_reads_').delete()
+        viewer = User.objects.create_user(username=VIEWER)
+        authors = [User.objects.create_user(username=f'{AUTHORS}{i}') for i in range(options['authors'])]
+        Follow.objects.bulk_create([Follow(follower=viewer, followed=author) for author in authors])
+        posts = Post.objects.bulk_create(
+            [Post(content=f'Bench post {i}', author=author) for author in authors for i in range(options['posts'])]
+        )
+        Like.objects.bulk_create([Like(user=viewer, post=post) for post in posts[::3]])
+        named = {'post': f'/api/v1/posts/{posts[0].pk}/', 'user': f'/api/v1/users/{authors[0].pk}/'}
+        paths = [named.get(path, path) for path in options['paths'].split(',') if path]
+        return session_cookie(viewer), paths
+
+    async def fetch(self, host, port, path, cookie, conn):
+        """One GET over a kept-alive connection (reconnecting when the server closes it)."""
+        if conn[0] is None:
+            conn[:] = await asyncio.open_connection(host, port)
+        reader, writer = conn
+        writer.write(f'GET {path} HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n\r\n'.encode())
+        await writer.drain()
+        status = int((await reader.readline()).split()[1])
+        length, close = None, False
+        while (line := await reader.readline()) not in (b'\r\n', b''):
+            name, _, value = line.decode('latin-1').partition(':')
+            if name.lower() == 'content-length':
+                length = int(value)
+            elif name.lower() == 'connection' and value.strip().lower() == 'close':
+                close = True
+        if length is None:
+            await reader.read()
+            close = True
+        else:
+            await reader.readexactly(length)
+        if close:
+            writer.close()
+            conn[:] = [None, None]
+        return status
+
+    async def client(self, host, port, path, cookie, deadline, latencies, errors):
+        conn = [None, None]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                status = await self.fetch(host, port, path, cookie, conn)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError):
+                errors.append('connection')
+                conn[:] = [None, None]
+                continue
+            if status == 200:
+                latencies.append(time.perf_counter() - started)
+            else:
+                errors.append(status)
+        if conn[1] is not None:
+            conn[1].close()
+
+    async def run(self, path, cookie, options):
+        latencies, errors = [], []
+        started = time.perf_counter()
+        deadline = started + options['duration']
+        await asyncio.gather(*(
+            self.client(options['host'], options['port'], path, cookie, deadline, latencies, errors)
+            for _ in range(options['concurrency'])
+        ))
+        elapsed = time.perf_counter() - started
+        if not latencies:
+            return f'{path}: no successful requests ({len(errors)} errors, e.g. {errors[:3]})'
+        latencies.sort()
+
+        def pct(p):
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+        return (
+            f'{path:<32} {len(latencies) / elapsed:8.1f} req/s  '
+            f'p50 {pct(0.5):7.1f} ms  p95 {pct(0.95):7.1f} ms  p99 {pct(0.99):7.1f} ms  '
+            f'errors {len(errors)}'
+        )
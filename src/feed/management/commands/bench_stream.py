@@ -0,0 +1,135 @@
+import asyncio
+import os
+import resource
+import statistics
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.models import Post
+from users.models import Follow
+
+VIEWER = 'bench_stream_viewer'
+AUTHOR = 'bench_stream_author'
+
+
+def session_cookie(user):
+    """Cookie header value for a fresh logged-in session, so bench clients can skip the login form."""
+    session = SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = 'django.contrib.auth.backends.ModelBackend'
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.create()
+    return f'{settings.SESSION_COOKIE_NAME}={session.session_key}'
+
+
+def _cpu_seconds(pid):
+    """utime + stime of a process, from /proc (Linux only)."""
+    with open(f'/proc/{pid}/stat') as fh:
+        fields = fh.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class Command(BaseCommand):
+    help = (
+        'Open thousands of concurrent /feed/stream/ connections against a running ASGI server '
+        '(e.g. `uvicorn teacup.asgi:application`), measure idle server CPU, then create posts and '
+        'time how long they take to reach every stream. The server must share this database and, '
+        'since posts are written from this process, run with FEED_STREAM_POLL_INTERVAL set.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument('--clients', type=int, default=2000)
+        parser.add_argument('--posts', type=int, default=5)
+        parser.add_argument('--idle', type=float, default=10.0, help='Seconds to hold idle streams open')
+        parser.add_argument('--server-pid', type=int, help='Report CPU used by this process while idle')
+
+    def handle(self, *args, **options):
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = options['clients'] + 100
+        if soft < wanted:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+        cookie = self.setup()
+        try:
+            asyncio.run(self.run(cookie, options))
+        finally:
+            User.objects.filter(username__in=[VIEWER, AUTHOR]).delete()
+
+    def setup(self):
+        User.objects.filter(username__in=[VIEWER, AUTHOR]).delete()
+        viewer = User.objects.create_user(username=VIEWER)
+        self.author = User.objects.create_user(username=AUTHOR)
+        Follow.objects.create(follower=viewer, followed=self.author)
+        return session_cookie(viewer)
+
+    async def open_stream(self, host, port, cookie, received):
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write(
+            f'GET /api/v1/feed/stream/ HTTP/1.1\r\nHost: {host}\r\nCookie: {cookie}\r\n'
+            f'Accept: text/event-stream\r\n\r\n'.encode()
+        )
+        await writer.drain()
+        status = await reader.readline()
+        if b' 200 ' not in status:
+            writer.close()
+            raise CommandError(f'Stream rejected: {status.decode().strip()}')
+
+        async def listen():
+            while line := await reader.readline():
+                if line.startswith(b'data: {"id"'):
+                    received.append(time.perf_counter())
+        return writer, asyncio.create_task(listen())
+
+    async def run(self, cookie, options):
+        host, port, clients = options['host'], options['port'], options['clients']
+        received = []
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(self.open_stream(host, port, cookie, received) for _ in range(clients)), return_exceptions=True
+        )
+        streams = [result for result in results if not isinstance(result, BaseException)]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        self.stdout.write(
+            f'{len(streams)} streams open in {time.perf_counter() - started:.2f}s, {len(errors)} failed'
+            + (f' (first error: {errors[0]!r})' if errors else '')
+        )
+        if not streams:
+            return
+
+        cpu_before = _cpu_seconds(options['server_pid']) if options['server_pid'] else None
+        await asyncio.sleep(options['idle'])
+        if cpu_before is not None:
+            used = _cpu_seconds(options['server_pid']) - cpu_before
+            self.stdout.write(
+                f'Idle for {options["idle"]:.0f}s: server used {used:.2f}s CPU '
+                f'({100 * used / options["idle"]:.1f}% of a core)'
+            )
+
+        latencies = []
+        for _ in range(options['posts']):
+            received.clear()
+            sent = time.perf_counter()
+            await sync_to_async(Post.objects.create)(content='bench', author=self.author)
+            deadline = sent + 30
+            while len(received) < len(streams) and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+            latencies.extend(moment - sent for moment in received)
+            self.stdout.write(f'Post delivered to {len(received)}/{len(streams)} streams')
+
+        if latencies:
+            latencies.sort()
+            self.stdout.write(
+                f'Delivery latency: p50 {statistics.median(latencies) * 1000:.0f} ms  '
+                f'p99 {latencies[int(len(latencies) * 0.99) - 1] * 1000:.0f} ms  '
+                f'max {latencies[-1] * 1000:.0f} ms'
+            )
+        for writer, listener in streams:
+            listener.cancel()
+            writer.close()
@@ -0,0 +1,155 @@
+"""
+Ranked "For You" feed.
+
+Candidates (a few thousand post rows, no model instances) come from three
+sources over the last FEED_RANKED_WINDOW_HOURS:
+
+- recent posts by people the viewer follows
+- recent posts by friends of friends: authors the viewer's followees follow
+- the most liked recent posts overall (trending)
+
+They're scored in one vectorized NumPy pass:
+
+    social     = 1 + affinity + followed + log1p(friends of friends following the author)
+    engagement = 1 + log1p((likes + 2 * comments) / (age in hours + 2))
+    score      = social * engagement * 2 ** (-age / half life)
+
+where affinity is log1p of how often the viewer liked or commented on the
+author's posts lately. The ranked id list is cached per viewer for
+FEED_RANKED_CACHE_SECONDS and pages are cut from it, so paging is stable
+while the list lives.
+"""
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count
+from django.utils import timezone
+
+from posts.models import Comment, Like, Post
+from users.blocks import exclusions
+from users.models import Follow
+
+CACHE_PREFIX = 'feed:ranked:'
+ROW_FIELDS = ('id', 'author_id', 'created_at', 'likes_total', 'comments_total')
+
+AFFINITY_WEIGHT = 1.0
+FOLLOW_WEIGHT = 1.0
+FOF_WEIGHT = 0.5
+ENGAGEMENT_WEIGHT = 1.0
+COMMENT_WEIGHT = 2.0
+
+# Candidate budget split between the sources, as shares of FEED_RANKED_MAX_CANDIDATES
+FOLLOWED_SHARE = 0.5
+FOF_SHARE = 0.3
+TRENDING_SHARE = 0.2
+# Friends of friends are found through this many of the viewer's most recent follows
+FOF_SEED_FOLLOWS = 200
+FOF_AUTHORS = 500
+AFFINITY_DAYS = 30
+
+
+def _lookup(keys, mapping):
+    """Vectorized dict lookup: mapping[key] (or 0) for every element of `keys`."""
+    unique, inverse = np.unique(keys, return_inverse=True)
+    values = np.fromiter((mapping.get(key, 0) for key in unique.tolist()), dtype=np.float64, count=len(unique))
+    return values[inverse]
+
+
+def score(age_hours, likes, comments, affinity, followed, fof, half_life=None):
+    """Score candidate arrays (all the same length); higher is better."""
+    half_life = half_life or settings.FEED_RANKED_HALF_LIFE_HOURS
+    social = 1.0 + AFFINITY_WEIGHT * affinity + FOLLOW_WEIGHT * followed + FOF_WEIGHT * np.log1p(fof)
+    engagement = 1.0 + ENGAGEMENT_WEIGHT * np.log1p((likes + COMMENT_WEIGHT * comments) / (age_hours + 2.0))
+    return social * engagement * np.exp2(-age_hours / half_life)
+
+
+def rank(rows, now, affinity, followees, fof):
+    """
+    Rank candidate rows (tuples of ROW_FIELDS, duplicates allowed) and return post ids, best first.
+
+    affinity and fof map author id -> value; followees is a set of author ids.
+    """
+    if not rows:
+        return []
+    ids, authors, created, likes, comments = zip(*rows)
+    ids = np.array(ids, dtype=np.int64)
+    ids, first = np.unique(ids, return_index=True)
+    authors = np.array(authors, dtype=np.int64)[first]
+    now_ts = now.timestamp()
+    age_hours = np.maximum((now_ts - np.array([c.timestamp() for c in created]))[first] / 3600.0, 0.0)
+    scores = score(
+        age_hours,
+        np.array(likes, dtype=np.float64)[first],
+        np.array(comments, dtype=np.float64)[first],
+        _lookup(authors, affinity),
+        np.isin(authors, np.fromiter(followees, dtype=np.int64, count=len(followees))).astype(np.float64),
+        _lookup(authors, fof),
+    )
+    # Ties (e.g. no engagement anywhere) go to the newer post
+    order = np.lexsort((-ids, -scores))
+    return ids[order].tolist()
+
+
+def author_affinity(user_id, since):
+    """log1p(likes + 2 * comments) the viewer gave each author since `since`."""
+    weights = {}
+    likes = (
+        Like.objects.filter(user_id=user_id, created_at__gte=since)
+        .values_list('post__author_id').annotate(n=Count('*')).order_by()
+    )
+    for author_id, n in likes:
+        weights[author_id] = weights.get(author_id, 0) + n
+    comments = (
+        Comment.objects.filter(author_id=user_id, created_at__gte=since)
+        .values_list('post__author_id').annotate(n=Count('*')).order_by()
+    )
+    for author_id, n in comments:
+        weights[author_id] = weights.get(author_id, 0) + COMMENT_WEIGHT * n
+    weights.pop(user_id, None)
+    return {author_id: float(np.log1p(weight)) for author_id, weight in weights.items()}
+
+
+def gather_candidates(user_id, now=None):
+    """Candidate rows plus the affinity/followee/fof maps rank() needs."""
+    now = now or timezone.now()
+    limit = settings.FEED_RANKED_MAX_CANDIDATES
+    recent = Post.objects.filter(created_at__gte=now - timedelta(hours=settings.FEED_RANKED_WINDOW_HOURS))
+
+    followees = list(
+        Follow.objects.filter(follower_id=user_id).order_by('-created_at').values_list('followed_id', flat=True)
+    )
+    fof = dict(
+        Follow.objects.filter(follower_id__in=followees[:FOF_SEED_FOLLOWS])
+        .exclude(followed_id__in=followees + [user_id])
+        .values_list('followed_id').annotate(n=Count('*')).order_by('-n')[:FOF_AUTHORS]
+    )
+
+    rows = list(recent.filter(author_id__in=followees).order_by('-created_at')
+                .values_list(*ROW_FIELDS)[:int(limit * FOLLOWED_SHARE)]) if followees else []
+    if fof:
+        rows += recent.filter(author_id__in=list(fof)).order_by('-created_at').values_list(*ROW_FIELDS)[
+            :int(limit * FOF_SHARE)
+        ]
+    rows += recent.exclude(author_id=user_id).order_by('-likes_total', '-created_at').values_list(*ROW_FIELDS)[
+        :int(limit * TRENDING_SHARE)
+    ]
+    excluded = exclusions(user_id)
+    if excluded:
+        # Blocked and muted authors never make the list, so pages cut from it stay full
+        rows = [row for row in rows if row[1] not in excluded]
+    affinity = author_affinity(user_id, now - timedelta(days=AFFINITY_DAYS))
+    return rows, affinity, set(followees), fof
+
+
+def ranked_ids(user_id, refresh=False):
+    """The viewer's ranked post ids, from the cache unless it's stale or `refresh` is set."""
+    key = f'{CACHE_PREFIX}{user_id}'
+    ids = None if refresh else cache.get(key)
+    if ids is None:
+        now = timezone.now()
+        rows, affinity, followees, fof = gather_candidates(user_id, now)
+        ids = rank(rows, now, affinity, followees, fof)
+        cache.set(key, ids, settings.FEED_RANKED_CACHE_SECONDS)
+    return ids
@@ -0,0 +1,159 @@
+"""
+Which posts a user has already been shown, so the feeds can skip them.
+
+Clients report impressions in batches (POST /feed/seen/). Nothing is written
+per impression: they're kept in the shared cache in roaring-style
+containers. Post ids are split into chunks of 65536 (the high bits pick the
+cache key) and a chunk stores the low 16 bits of its seen ids as a sorted
+uint16 array while it has fewer than 4096 of them, then as an 8 KB bitmap.
+The two are told apart by length (the array is always shorter). A few
+hundred impressions cost a few hundred bytes, and nobody costs more than
+8 KB per 65536 post ids. Each write pushes the chunk's expiry out to
+SEEN_POSTS_TTL, so chunks of old posts age out on their own.
+
+A small list of the chunks a user has anything in sits next to them. The
+feeds leave seen posts out before paginating, so pages come back full: the
+newest SEEN_POSTS_EXCLUDE_MAX seen ids (two cache reads) go into the feed
+query, and its COUNT, as a NOT IN list of literals. The cap keeps that list
+short and well under the database's bound-parameter limit (999 on older
+SQLite builds), which caps it again. The cut-off is by post id:
+
+- my_feed and discover run newest first, so older seen posts past the cap
+  only turn up again deep in the feed.
+- trending only spans the last week, but once a user has seen more than the
+  cap among that week's posts, the oldest of those come back as well.
+- for_you filters its cached ranked id list instead, which is exact.
+
+?include_seen=1 turns it off.
+
+Two batches from the same user at the same moment can race (read, merge,
+write) and lose one; impressions are best-effort.
+"""
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+CACHE_PREFIX = 'feed:seen:'
+CHUNK_BITS = 16
+CHUNK_SIZE = 1 << CHUNK_BITS
+# At this many entries a bitmap (CHUNK_SIZE / 8 bytes) is no bigger than the array
+ARRAY_MAX = CHUNK_SIZE // 16
+BITMAP_BYTES = CHUNK_SIZE // 8
+MAX_BATCH = 500
+
+
+def _key(user_id, chunk):
+    return f'{CACHE_PREFIX}{user_id}:{chunk}'
+
+
+def _chunks_key(user_id):
+    return f'{CACHE_PREFIX}{user_id}:chunks'
+
+
+def decode(blob):
+    """Sorted low bits held by a container."""
+    if len(blob) == BITMAP_BYTES:
+        return np.flatnonzero(np.unpackbits(np.frombuffer(blob, dtype=np.uint8), bitorder='little')).astype(np.uint16)
+    return np.frombuffer(blob, dtype=np.uint16)
+
+
+def encode(lows):
+    """Container for sorted, unique low bits: an array while it's small, a bitmap after."""
+    lows = np.asarray(lows, dtype=np.uint16)
+    if len(lows) < ARRAY_MAX:
+        return lows.tobytes()
+    bits = np.zeros(CHUNK_SIZE, dtype=bool)
+    bits[lows] = True
+    return np.packbits(bits, bitorder='little').tobytes()
+
+
+def contains(blob, lows):
+    """Boolean mask: which of `lows` the container holds."""
+    lows = np.asarray(lows, dtype=np.int64)
+    if len(blob) == BITMAP_BYTES:
+        bitmap = np.frombuffer(blob, dtype=np.uint8)
+        return ((bitmap[lows >> 3] >> (lows & 7)) & 1).astype(bool)
+    return np.isin(lows, np.frombuffer(blob, dtype=np.uint16))
+
+
+def _split(post_ids):
+    ids = np.unique(np.asarray(post_ids, dtype=np.int64))
+    ids = ids[ids > 0]
+    return ids >> CHUNK_BITS, ids & (CHUNK_SIZE - 1), ids
+
+
+def mark_seen(user_id, post_ids):
+    """Add post ids to the user's seen set; returns how many ids were given (after dedupe)."""
+    chunks, lows, ids = _split(post_ids)
+    if not len(ids):
+        return 0
+    wanted = np.unique(chunks).tolist()
+    stored = cache.get_many([_key(user_id, chunk) for chunk in wanted] + [_chunks_key(user_id)])
+    updates = {_chunks_key(user_id): sorted(set(stored.get(_chunks_key(user_id), [])) | set(wanted))}
+    for chunk in wanted:
+        key = _key(user_id, chunk)
+        new = lows[chunks == chunk]
+        if key in stored:
+            new = np.union1d(decode(stored[key]), new)
+        updates[key] = encode(new)
+    cache.set_many(updates, settings.SEEN_POSTS_TTL)
+    return len(ids)
+
+
+def seen_ids(user_id, post_ids):
+    """The subset of `post_ids` the user has seen."""
+    chunks, lows, ids = _split(post_ids)
+    if not len(ids):
+        return set()
+    wanted = np.unique(chunks).tolist()
+    stored = cache.get_many([_key(user_id, chunk) for chunk in wanted])
+    seen = set()
+    for chunk in wanted:
+        blob = stored.get(_key(user_id, chunk))
+        if blob:
+            in_chunk = chunks == chunk
+            seen.update(ids[in_chunk][contains(blob, lows[in_chunk])].tolist())
+    return seen
+
+
+def recent_seen_ids(user_id, limit=None):
+    """Up to `limit` (SEEN_POSTS_EXCLUDE_MAX) of the user's seen post ids, newest first."""
+    limit = limit or settings.SEEN_POSTS_EXCLUDE_MAX
+    chunks = sorted(cache.get(_chunks_key(user_id)) or [], reverse=True)
+    if not chunks:
+        return []
+    stored = cache.get_many([_key(user_id, chunk) for chunk in chunks])
+    found = []
+    for chunk in chunks:
+        blob = stored.get(_key(user_id, chunk))
+        if blob:
+            found.append((decode(blob).astype(np.int64) + (chunk << CHUNK_BITS))[::-1])
+            if sum(map(len, found)) >= limit:
+                break
+    return np.concatenate(found)[:limit].tolist() if found else []
+
+
+def exclude_limit():
+    """How many seen ids a feed query may exclude: SEEN_POSTS_EXCLUDE_MAX, within half the parameter limit."""
+    max_params = connection.features.max_query_params
+    return min(settings.SEEN_POSTS_EXCLUDE_MAX, max_params // 2) if max_params else settings.SEEN_POSTS_EXCLUDE_MAX
+
+
+def exclude_seen(user_id, queryset):
+    """`queryset` without (the newest exclude_limit() of) the posts the user has seen."""
+    seen = recent_seen_ids(user_id, exclude_limit())
+    return queryset.exclude(pk__in=seen) if seen else queryset
+
+
+def drop_seen(user_id, posts):
+    """`posts` (Post instances or ids) without the ones the user has seen, order kept."""
+    posts = list(posts)
+    seen = seen_ids(user_id, [getattr(post, 'pk', post) for post in posts])
+    if not seen:
+        return posts
+    return [post for post in posts if getattr(post, 'pk', post) not in seen]
+
+
+def wants_unseen(request):
+    return request.query_params.get('include_seen') not in ('1', 'true')
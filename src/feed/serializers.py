@@ -0,0 +1,10 @@
+from rest_framework import serializers
+
+from .seen import MAX_BATCH
+
+
+class SeenPostsSerializer(serializers.Serializer):
+    """A batch of post impressions for POST /feed/seen/."""
+    post_ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_BATCH
+    )
@@ -0,0 +1,28 @@
+"""Feed the live stream broker (feed/events.py) from post, like and comment writes."""
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from posts.counters import counts_refreshed
+from posts.models import Post, Like, Comment
+
+from .events import get_broker
+
+
+@receiver(post_save, sender=Post)
+def publish_new_post(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: get_broker().publish_post(instance.pk, instance.author_id))
+
+
+@receiver(post_save, sender=Like)
+@receiver(post_delete, sender=Like)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+def publish_counts(sender, instance, **kwargs):
+    transaction.on_commit(lambda: get_broker().touch([instance.post_id]))
+
+
+@receiver(counts_refreshed)
+def publish_refreshed_counts(sender, post_ids, **kwargs):
+    transaction.on_commit(lambda: get_broker().touch(post_ids))
@@ -0,0 +1,118 @@
+"""
+GET /api/v1/feed/stream/ – Server-Sent Events for the feed.
+
+Instead of polling my_feed every few seconds, clients keep one EventSource
+open. It receives
+
+    event: post    data: {"id": 12, "author": 3}
+    event: counts  data: {"id": 7, "likes_count": 5, "comments_count": 2}
+    event: resync  data: {}
+
+for a new post by someone the viewer follows, new counts for a post on
+screen, and "you fell behind, refetch the feed" respectively.
+
+Pass the ids of the posts currently on screen as ?posts=1,2,3 to get their
+count updates. Streams end after FEED_STREAM_MAX_SECONDS and EventSource
+reconnects on its own, which also picks up follows made in the meantime.
+
+This is a plain async Django view rather than a DRF one (DRF views are
+sync-only), so it needs an ASGI server (uvicorn) to stream; under WSGI each
+open stream would pin a worker thread.
+"""
+import asyncio
+import json
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from users.autocomplete import following_ids
+
+from .events import Subscription, get_broker
+
+MAX_WATCHED_POSTS = 200
+
+
+def _authenticate(request):
+    """Run the API's configured authentication classes, so the stream accepts the same credentials."""
+    drf_request = Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    return drf_request.user
+
+
+def _followed_ids(user):
+    return list(following_ids(user.id))
+
+
+def parse_post_ids(value):
+    ids = []
+    for part in (value or '').split(','):
+        if part.strip().isdigit():
+            ids.append(int(part))
+    return ids[:MAX_WATCHED_POSTS]
+
+
+def format_event(name, data):
+    return f'event: {name}\ndata: {json.dumps(data)}\n\n'
+
+
+async def event_stream(subscription, max_seconds=None, keepalive=None):
+    """Yield SSE frames for a subscription until it times out or the client goes away."""
+    broker = get_broker()
+    max_seconds = settings.FEED_STREAM_MAX_SECONDS if max_seconds is None else max_seconds
+    keepalive = settings.FEED_STREAM_KEEPALIVE if keepalive is None else keepalive
+    deadline = time.monotonic() + max_seconds
+    sent_posts = set()
+    sent_counts = {}
+
+    broker.subscribe(subscription)
+    try:
+        yield f'retry: {settings.FEED_STREAM_RETRY_MS}\n\n'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                name, data = await asyncio.wait_for(subscription.queue.get(), min(keepalive, remaining))
+            except asyncio.TimeoutError:
+                # SSE comment line: keeps proxies from closing an idle connection
+                yield ': keepalive\n\n'
+                continue
+
+            if subscription.overflowed:
+                subscription.overflowed = False
+                yield format_event('resync', {})
+            if name == 'post':
+                if data['id'] in sent_posts:
+                    continue
+                sent_posts.add(data['id'])
+            elif name == 'counts':
+                counts = (data['likes_count'], data['comments_count'])
+                if sent_counts.get(data['id']) == counts:
+                    continue
+                sent_counts[data['id']] = counts
+            yield format_event(name, data)
+    finally:
+        broker.unsubscribe(subscription)
+
+
+async def stream(request):
+    """Server-Sent Events stream of new posts from followed users and count changes."""
+    if request.method != 'GET':
+        return JsonResponse({'detail': f'Method "{request.method}" not allowed.'}, status=405)
+    try:
+        user = await sync_to_async(_authenticate)(request)
+    except AuthenticationFailed as exc:
+        return JsonResponse({'detail': str(exc.detail)}, status=401)
+    if not user.is_authenticated:
+        return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+
+    authors = await sync_to_async(_followed_ids)(user)
+    subscription = Subscription(authors + [user.id], parse_post_ids(request.GET.get('posts')))
+    response = StreamingHttpResponse(event_stream(subscription), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # stop nginx from buffering the stream
+    return response
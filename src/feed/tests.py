@@ -1,3 +1,394 @@
-from django.test import TestCase
+import asyncio
+import json
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import AsyncRequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase, force_authenticate
+
+from posts.async_views import post_detail
+from posts.models import Post, Like, Comment
+from users.blocks import exclusions
+from users.models import Follow
+
+from users.async_views import user_detail
+from users.deletion import schedule_post_deletion
+
+from . import async_views
+
+from .events import Broker, Poller, Subscription
+from .ranking import rank, score
+from .seen import (
+    ARRAY_MAX, BITMAP_BYTES, CHUNK_SIZE, decode, encode, exclude_limit, mark_seen, recent_seen_ids, seen_ids,
+)
+from .sync import SYNC_OVERLAP, make_token
+
+
+@override_settings(FEED_STREAM_COUNT_DEBOUNCE=0, FEED_STREAM_POLL_INTERVAL=0)
+class FeedStreamTest(TestCase):
+    """Test the Server-Sent Events feed stream."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=self.author)
+        self.post = Post.objects.create(content='On screen', author=self.stranger)
+        self.url = reverse('feed-stream')
+
+    def write(self, func):
+        with self.captureOnCommitCallbacks(execute=True):
+            return func()
+
+    async def test_stream_pushes_posts_and_counts(self):
+        """Test followed authors' posts and watched posts' counts arrive as events."""
+        await self.async_client.aforce_login(self.viewer)
+        response = await self.async_client.get(self.url, {'posts': f'{self.post.pk},junk'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        frames = aiter(response.streaming_content)
+        self.assertTrue((await anext(frames)).startswith(b'retry:'))
+
+        await sync_to_async(self.write)(lambda: Post.objects.create(content='Ignored', author=self.stranger))
+        new_post = await sync_to_async(self.write)(lambda: Post.objects.create(content='Hi', author=self.author))
+        frame = await asyncio.wait_for(anext(frames), 2)
+        self.assertEqual(frame, f'event: post\ndata: {{"id": {new_post.pk}, "author": {self.author.pk}}}\n\n'.encode())
+
+        await sync_to_async(self.write)(lambda: Like.objects.create(user=self.author, post=self.post))
+        frame = await asyncio.wait_for(anext(frames), 2)
+        self.assertIn(b'event: counts', frame)
+        self.assertIn(b'"likes_count": 1', frame)
+        await frames.aclose()
+
+    async def test_stream_requires_authentication(self):
+        """Test anonymous clients get a 401 instead of a stream."""
+        response = await self.async_client.get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    def test_poller_picks_up_other_processes_writes(self):
+        """Test the polling fallback publishes new posts and changed counts once."""
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        broker = Broker(debounce=0)
+        subscription = Subscription([self.author.pk], [self.post.pk], loop=loop)
+        broker.subscribe(subscription)
+        poller = Poller(broker, interval=1)
+        poller.poll()
+
+        new_post = Post.objects.create(content='Elsewhere', author=self.author)
+        Like.objects.create(user=self.viewer, post=self.post)
+        poller.poll()
+        poller.poll()
+        loop.run_until_complete(asyncio.sleep(0))
+
+        events = []
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        self.assertEqual(events, [
+            ('post', {'id': new_post.pk, 'author': self.author.pk}),
+            ('counts', {'id': self.post.pk, 'likes_count': 1, 'comments_count': 0}),
+        ])
+        broker.unsubscribe(subscription)
+        self.assertEqual(len(broker), 0)
+
+
+class FeedSyncTest(APITestCase):
+    """Test the /feed/sync/ delta endpoint."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=self.author)
+        self.old_post = Post.objects.create(content='Seen it', author=self.author)
+        self.other_post = Post.objects.create(content='Seen it too', author=self.stranger)
+        self.client.force_authenticate(user=self.viewer)
+        self.url = reverse('feed-sync')
+        # Pretend the client synced a while ago, outside the overlap window
+        self.token = make_token(timezone.now() - SYNC_OVERLAP - timedelta(seconds=1))
+        Post.all_objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        Post.all_objects.update(stats_updated_at=None)
+
+    def test_first_sync_returns_token(self):
+        """Test calling without a token asks for a full load and hands out a token."""
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['reset'])
+        self.assertTrue(response.data['token'])
+
+    def test_sync_returns_only_changes(self):
+        """Test new, deleted and re-counted posts are reported in a few queries."""
+        new_post = Post.objects.create(content='Fresh', author=self.author)
+        Post.objects.create(content='Not followed', author=self.stranger)
+        Like.objects.create(user=self.author, post=self.other_post)
+        schedule_post_deletion(self.old_post)
+        exclusions(self.viewer.pk)  # the block list is cached between requests, as for my_feed
+
+        with self.assertNumQueries(4):
+            response = self.client.get(self.url, {
+                'since': self.token, 'posts': f'{self.old_post.pk},{self.other_post.pk}',
+            })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['reset'])
+        self.assertEqual(response.data['new_posts'], [new_post.pk])
+        self.assertEqual(response.data['deleted_posts'], [self.old_post.pk])
+        self.assertEqual(response.data['counts'], [
+            {'id': self.other_post.pk, 'likes_count': 1, 'comments_count': 0},
+        ])
+
+        # Nothing happened since the fresh token (beyond the overlap window)
+        with mock.patch('feed.sync.SYNC_OVERLAP', timedelta(0)):
+            again = self.client.get(self.url, {'since': response.data['token'], 'posts': str(self.other_post.pk)})
+        self.assertEqual((again.data['new_posts'], again.data['counts']), ([], []))
+
+    def test_sync_skips_muted_and_blocked_authors(self):
+        """Test sync leaves out the same authors my_feed does."""
+        muted = User.objects.create_user(username='muted', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=muted)
+        self.client.post(reverse('user-mute', kwargs={'pk': muted.pk}))
+        self.client.post(reverse('user-block', kwargs={'pk': self.author.pk}))
+        Post.objects.create(content='Quiet', author=muted)
+        Post.objects.create(content='Blocked', author=self.author)
+        own = Post.objects.create(content='Mine', author=self.viewer)
+        response = self.client.get(self.url, {'since': self.token})
+        self.assertEqual(response.data['new_posts'], [own.pk])
+
+    def test_bad_and_expired_tokens(self):
+        """Test tampered tokens are rejected and expired ones force a reset."""
+        response = self.client.get(self.url, {'since': self.token + 'x'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(FEED_SYNC_MAX_AGE=0):
+            response = self.client.get(self.url, {'since': make_token(timezone.now() - timedelta(seconds=5))})
+        self.assertTrue(response.data['reset'])
+
+
+@override_settings(ASYNC_PARALLEL_QUERIES=False)
+class AsyncReadViewTest(APITestCase):
+    """Test the async read endpoints return exactly what the DRF ones do."""
+
+    def setUp(self):
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=self.author)
+        self.posts = [Post.objects.create(content=f'Post {i}', author=self.author) for i in range(3)]
+        Like.objects.create(user=self.viewer, post=self.posts[0])
+        Like.objects.create(user=self.author, post=self.posts[1])
+        Comment.objects.create(author=self.viewer, post=self.posts[0], content='Nice')
+        self.client.force_authenticate(user=self.viewer)
+        self.factory = AsyncRequestFactory()
+
+    async def call_async(self, view, path, data=None, user=None, **kwargs):
+        request = self.factory.get(path, data)
+        force_authenticate(request, user=user or self.viewer)
+        response = await view(request, **kwargs)
+        return response.status_code, json.loads(response.content)
+
+    async def assertSameAsSync(self, view, url_name, data=None, **kwargs):
+        path = reverse(url_name, kwargs=kwargs or None)
+        expected = await sync_to_async(self.client.get)(path, data)
+        status_code, body = await self.call_async(view, path, data, **kwargs)
+        self.assertEqual(status_code, expected.status_code)
+        self.assertEqual(body, expected.json())
+        return body
+
+    async def test_feed_endpoints_match(self):
+        """Test my_feed/discover/trending match the DRF output, pagination included."""
+        body = await self.assertSameAsSync(async_views.my_feed, 'feed-my-feed', {'page_size': 2})
+        self.assertEqual(body['count'], 3)
+        self.assertIsNotNone(body['next'])
+        await self.assertSameAsSync(async_views.my_feed, 'feed-my-feed', {'page_size': 2, 'page': 2})
+        await self.assertSameAsSync(async_views.discover, 'feed-discover', {'search': 'Post 1'})
+        await self.assertSameAsSync(async_views.trending, 'feed-trending')
+
+    async def test_seen_posts_match(self):
+        """Test the async feeds drop seen posts like the DRF ones."""
+        self.addCleanup(cache.clear)
+        await sync_to_async(mark_seen)(self.viewer.pk, [self.posts[1].pk])
+        body = await self.assertSameAsSync(async_views.my_feed, 'feed-my-feed')
+        self.assertEqual(len(body['results']), 2)
+        body = await self.assertSameAsSync(async_views.discover, 'feed-discover', {'include_seen': 1})
+        self.assertEqual(len(body['results']), 3)
+
+    async def test_detail_endpoints_match(self):
+        """Test post and user detail match the DRF output."""
+        body = await self.assertSameAsSync(post_detail, 'post-detail', pk=self.posts[0].pk)
+        self.assertTrue(body['is_liked'])
+        self.assertEqual(len(body['comments']), 1)
+        await self.assertSameAsSync(user_detail, 'user-detail', pk=self.author.pk)
+        status_code, _ = await self.call_async(post_detail, '/api/v1/posts/999/', pk=999)
+        self.assertEqual(status_code, 404)
+
+    async def test_feed_needs_login(self):
+        """Test anonymous feed requests are refused like the DRF view does."""
+        response = await async_views.my_feed(self.factory.get('/api/v1/feed/my_feed/'))
+        self.assertIn(response.status_code, (401, 403))
+
+
+class RankedFeedTest(APITestCase):
+    """Test the ranked For You feed."""
+
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.friend = User.objects.create_user(username='friend', password='testpass123')
+        self.friend_of_friend = User.objects.create_user(username='fof', password='testpass123')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=self.friend)
+        Follow.objects.create(follower=self.friend, followed=self.friend_of_friend)
+        self.client.force_authenticate(user=self.viewer)
+        self.url = reverse('feed-for-you')
+
+    def ids(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.data['results']]
+
+    def test_score(self):
+        """Test newer, more engaged and closer posts score higher."""
+        base = dict(likes=np.zeros(2), comments=np.zeros(2), affinity=np.zeros(2), followed=np.zeros(2),
+                    fof=np.zeros(2), half_life=12)
+        newer, older = score(np.array([1.0, 30.0]), **base)
+        self.assertGreater(newer, older)
+        liked, plain = score(np.array([5.0, 5.0]), **{**base, 'likes': np.array([50.0, 0.0])})
+        self.assertGreater(liked, plain)
+        close, far = score(np.array([5.0, 5.0]), **{**base, 'affinity': np.array([2.0, 0.0])})
+        self.assertGreater(close, far)
+
+    def test_rank_dedupes(self):
+        """Test candidates found by more than one source are ranked once."""
+        now = timezone.now()
+        rows = [(1, 10, now, 0, 0), (2, 11, now - timedelta(hours=5), 0, 0), (1, 10, now, 0, 0)]
+        self.assertEqual(rank(rows, now, {}, set(), {}), [1, 2])
+        self.assertEqual(rank(rows, now, {11: 3.0}, {11}, {}), [2, 1])
+
+    def test_candidates(self):
+        """Test followees, friends of friends and trending posts make it in, but not your own or old ones."""
+        mine = Post.objects.create(content='Mine', author=self.viewer)
+        friends = Post.objects.create(content='Friend', author=self.friend)
+        fofs = Post.objects.create(content='FoF', author=self.friend_of_friend)
+        trending = Post.objects.create(content='Trending', author=self.stranger)
+        Like.objects.create(user=self.friend, post=trending)
+        old = Post.objects.create(content='Old', author=self.friend)
+        Post.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=10))
+
+        ids = self.ids()
+        self.assertEqual(set(ids), {friends.pk, fofs.pk, trending.pk})
+        self.assertNotIn(mine.pk, ids)
+
+    def test_affinity_wins(self):
+        """Test an author you interact with outranks a newer post from someone you don't."""
+        favourite = Post.objects.create(content='Older', author=self.friend_of_friend)
+        Post.objects.filter(pk=favourite.pk).update(created_at=timezone.now() - timedelta(hours=3))
+        newer = Post.objects.create(content='Newer', author=self.friend)
+        self.assertEqual(self.ids(), [newer.pk, favourite.pk])
+
+        earlier = Post.objects.create(content='Earlier', author=self.friend_of_friend)
+        Like.objects.create(user=self.viewer, post=earlier)
+        Comment.objects.create(content='Love it', author=self.viewer, post=earlier)
+        self.assertEqual(self.ids(refresh=1)[:2], [earlier.pk, favourite.pk])
+
+    def test_cached_pages(self):
+        """Test pages come from the cached ranking until ?refresh=1, and deleted posts drop out."""
+        posts = [Post.objects.create(content=f'Post {i}', author=self.friend) for i in range(3)]
+        self.assertEqual(len(self.ids(page_size=2)), 2)
+        late = Post.objects.create(content='Late', author=self.friend)
+        self.assertNotIn(late.pk, self.ids(page_size=10))
+        schedule_post_deletion(posts[0])
+        self.assertNotIn(posts[0].pk, self.ids(page_size=10))
+        self.assertIn(late.pk, self.ids(page_size=10, refresh=1))
+
+
+class SeenPostsTest(APITestCase):
+    """Test reporting seen posts and the feeds leaving them out."""
+
+    def setUp(self):
+        cache.clear()
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        Follow.objects.create(follower=self.viewer, followed=self.author)
+        self.posts = [Post.objects.create(content=f'Post {i}', author=self.author) for i in range(4)]
+        self.client.force_authenticate(user=self.viewer)
+
+    def ids(self, name, **params):
+        response = self.client.get(reverse(f'feed-{name}'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {post['id'] for post in response.data['results']}
+
+    def test_containers(self):
+        """Test small sets stay sorted arrays, big ones become bitmaps, and both answer the same."""
+        small = encode([3, 7, 9])
+        self.assertEqual(len(small), 6)
+        self.assertEqual(decode(small).tolist(), [3, 7, 9])
+        lows = list(range(0, 2 * ARRAY_MAX, 2))
+        big = encode(lows)
+        self.assertEqual(len(big), BITMAP_BYTES)
+        self.assertEqual(decode(big).tolist(), lows)
+
+        user_id = self.viewer.pk
+        ids = [5, CHUNK_SIZE + 5, 3 * CHUNK_SIZE + 1]
+        mark_seen(user_id, ids + [5])
+        self.assertEqual(seen_ids(user_id, ids + [6, CHUNK_SIZE + 6]), set(ids))
+        mark_seen(user_id, range(100, 100 + 2 * ARRAY_MAX))
+        self.assertEqual(seen_ids(user_id, [4, 5, 99, 100, 99 + 2 * ARRAY_MAX, 100 + 2 * ARRAY_MAX]),
+                         {5, 100, 99 + 2 * ARRAY_MAX})
+        self.assertEqual(seen_ids(self.author.pk, ids), set())
+
+    def test_feeds_skip_seen_posts(self):
+        """Test every feed drops seen posts unless ?include_seen=1."""
+        Like.objects.create(user=self.author, post=self.posts[0])
+        seen = {self.posts[0].pk, self.posts[1].pk}
+        response = self.client.post(reverse('feed-seen'), {'post_ids': list(seen) + [self.posts[0].pk]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'seen': 2})
+
+        everything = {post.pk for post in self.posts}
+        for name in ('my-feed', 'discover', 'trending', 'for-you'):
+            self.assertEqual(self.ids(name), everything - seen, name)
+            self.assertEqual(self.ids(name, include_seen=1), everything, name)
+
+    def test_pages_stay_full(self):
+        """Test seen posts are left out before paginating, so page 1 refills from older posts."""
+        for name in ('my-feed', 'discover', 'trending', 'for-you'):
+            cache.clear()
+            first = self.client.get(reverse(f'feed-{name}'), {'page_size': 2}).data
+            self.client.post(reverse('feed-seen'), {'post_ids': [post['id'] for post in first['results']]},
+                             format='json')
+            again = self.client.get(reverse(f'feed-{name}'), {'page_size': 2}).data
+            self.assertEqual(len(again['results']), 2, name)
+            self.assertFalse({post['id'] for post in again['results']} & {post['id'] for post in first['results']})
+            self.assertEqual(again['count'], 2, name)
+
+    def test_exclude_cap(self):
+        """Test only the newest SEEN_POSTS_EXCLUDE_MAX seen ids are excluded in SQL."""
+        ids = [post.pk for post in self.posts]
+        mark_seen(self.viewer.pk, ids + [CHUNK_SIZE + 1])
+        self.assertEqual(recent_seen_ids(self.viewer.pk), [CHUNK_SIZE + 1] + ids[::-1])
+        self.assertEqual(recent_seen_ids(self.viewer.pk, limit=2), [CHUNK_SIZE + 1, ids[-1]])
+        with override_settings(SEEN_POSTS_EXCLUDE_MAX=100), \
+                mock.patch.object(connection.features, 'max_query_params', 10):
+            self.assertEqual(exclude_limit(), 5)
+
+    @override_settings(SEEN_POSTS_EXCLUDE_MAX=2)
+    def test_past_the_cap(self):
+        """Test what comes back once more posts are seen than the feed queries exclude."""
+        Like.objects.create(user=self.author, post=self.posts[0])
+        mark_seen(self.viewer.pk, [post.pk for post in self.posts])
+        # Only the two newest seen posts are excluded; the older two come back, trending included
+        older = {self.posts[0].pk, self.posts[1].pk}
+        for name in ('my-feed', 'discover', 'trending'):
+            self.assertEqual(self.ids(name), older, name)
+        # The ranked feed filters its whole list
+        self.assertEqual(self.ids('for-you'), set())
+
+    def test_validation(self):
+        url = reverse('feed-seen')
+        for body in ({}, {'post_ids': []}, {'post_ids': ['x']}, {'post_ids': list(range(1, 502))}):
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, body)
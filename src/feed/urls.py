@@ -1,10 +1,23 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from .stream import stream
 from .views import FeedViewSet
 
 router = DefaultRouter()
 router.register(r'feed', FeedViewSet, basename='feed')
 
 urlpatterns = [
+    path('feed/stream/', stream, name='feed-stream'),
     path('', include(router.urls)),
 ]
+
+# Async read paths in front of the DRF views when served over ASGI (teacup/async_api.py)
+if settings.ASYNC_READ_VIEWS:
+    from . import async_views
+
+    urlpatterns = [
+        path('feed/my_feed/', async_views.my_feed),
+        path('feed/discover/', async_views.discover),
+        path('feed/trending/', async_views.trending),
+    ] + urlpatterns
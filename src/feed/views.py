@@ -4,11 +4,21 @@ from rest_framework.response import Response
 from rest_framework.pagination import PageNumberPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from django.core import signing
 from django.db.models import Q
+from drf_spectacular.utils import extend_schema
 
-from posts.models import Post
+from posts.models import Like, Post
 from posts.serializers import PostListSerializer
-from users.models import Follow
+from teacup.fieldsets import SparseViewMixin, sparse_queryset, wants_field
+from users.autocomplete import following_ids
+from users.blocks import ExcludedUsersFilter, exclusions
+
+from .ranking import ranked_ids
+from .seen import drop_seen, exclude_seen, mark_seen, wants_unseen
+from .serializers import SeenPostsSerializer
+from .stream import parse_post_ids
+from .sync import ExpiredToken, read_token, reset_response, sync_feed
 
 
 class FeedPagination(PageNumberPagination):
@@ -18,7 +28,7 @@ class FeedPagination(PageNumberPagination):
     max_page_size = 100
 
 
-class FeedViewSet(viewsets.ReadOnlyModelViewSet):
+class FeedViewSet(SparseViewMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for personalized feed functionality.
     
@@ -27,7 +37,8 @@ class FeedViewSet(viewsets.ReadOnlyModelViewSet):
     """
     serializer_class = PostListSerializer
     pagination_class = FeedPagination
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    # Blocked and muted authors go before paginating (users/blocks.py)
+    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter, ExcludedUsersFilter]
     search_fields = ['content', 'author__username']
     ordering_fields = ['created_at']
     ordering = ['-created_at']
@@ -36,22 +47,57 @@ class FeedViewSet(viewsets.ReadOnlyModelViewSet):
     def get_queryset(self):
         """Return posts from users that the current user follows."""
         user = self.request.user
-        
-        # Get users that the current user follows
-        following_users = Follow.objects.filter(follower=user).values_list('followed', flat=True)
-        
+
         # Include the user's own posts in the feed (makes sense, right?)
-        feed_users = list(following_users) + [user.id]
-        
-        # TODO: Maybe add some algorithm to show popular posts from non-followed users?
+        return self.feed_queryset(self.feed_authors(user.id) + [user.id])
+
+    @staticmethod
+    def feed_authors(user_id):
+        """
+        Users whose posts go in the feed: the people the user follows (from the
+        mapped follow graph when there is one), minus anyone muted.
+        """
+        excluded = exclusions(user_id)
+        return [author_id for author_id in following_ids(user_id) if author_id not in excluded]
+
+    @staticmethod
+    def feed_queryset(feed_users):
+        """Posts by the given users (shared with the async path in async_views.py)."""
+        # Popular posts from people you don't follow are in for_you (ranking.py)
         return Post.objects.filter(
             author__in=feed_users
-        ).select_related('author__profile').prefetch_related('likes', 'comments')
+        )
+
+    @staticmethod
+    def trending_queryset():
+        """Posts from the last 7 days by number of likes."""
+        from django.utils import timezone
+        from datetime import timedelta
+        from django.db.models import Count
+
+        # 7 days seems reasonable for "trending"
+        week_ago = timezone.now() - timedelta(days=7)
+
+        # This query might be slow with lots of data - consider caching later
+        return Post.objects.filter(
+            created_at__gte=week_ago
+        ).annotate(
+            likes_count_week=Count('likes')
+        ).order_by('-likes_count_week', '-created_at')
+
+    def exclude_seen(self, queryset):
+        """
+        Leave out posts the viewer has reported seen (see feed/seen.py), unless
+        ?include_seen=1. Done before paginating, so pages stay full.
+        """
+        if not wants_unseen(self.request):
+            return queryset
+        return exclude_seen(self.request.user.id, queryset)
 
     @action(detail=False, methods=['get'])
     def my_feed(self, request):
         """Get the authenticated user's personalized feed."""
-        queryset = self.filter_queryset(self.get_queryset())
+        queryset = self.exclude_seen(self.filter_queryset(self.get_queryset()))
         
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -64,8 +110,8 @@ class FeedViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def discover(self, request):
         """Get posts from all users for discovery."""
-        queryset = Post.objects.all().select_related('author__profile').prefetch_related('likes', 'comments')
-        queryset = self.filter_queryset(queryset)
+        queryset = Post.objects.all()
+        queryset = self.exclude_seen(self.filter_queryset(queryset))
         
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -78,21 +124,7 @@ class FeedViewSet(viewsets.ReadOnlyModelViewSet):
     @action(detail=False, methods=['get'])
     def trending(self, request):
         """Get trending posts (posts with most likes in the last 7 days)."""
-        from django.utils import timezone
-        from datetime import timedelta
-        from django.db.models import Count
-        
-        # 7 days seems reasonable for "trending"
-        week_ago = timezone.now() - timedelta(days=7)
-        
-        # This query might be slow with lots of data - consider caching later
-        queryset = Post.objects.filter(
-            created_at__gte=week_ago
-        ).annotate(
-            likes_count_week=Count('likes')
-        ).order_by('-likes_count_week', '-created_at').select_related('author__profile').prefetch_related('likes', 'comments')
-        
-        queryset = self.filter_queryset(queryset)
+        queryset = self.exclude_seen(self.filter_queryset(self.trending_queryset()))
         
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -101,3 +133,67 @@ class FeedViewSet(viewsets.ReadOnlyModelViewSet):
 
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def for_you(self, request):
+        """
+        Ranked feed: recent posts from people you follow, friends of friends and
+        trending posts, scored by how much you interact with the author,
+        engagement and recency (see feed/ranking.py).
+
+        The ranking is cached for a few minutes so pages line up; ?refresh=1 re-ranks.
+        """
+        refresh = request.query_params.get('refresh') in ('1', 'true')
+        ranked = ranked_ids(request.user.id, refresh=refresh)
+        if wants_unseen(request):
+            # The whole ranked list is at hand, so filter it exactly before paging
+            ranked = drop_seen(request.user.id, ranked)
+        page = self.paginate_queryset(ranked)
+        posts = sparse_queryset(Post.objects.all(), self.get_serializer_class(), request).in_bulk(page)
+        liked = set()
+        if wants_field(request, 'is_liked'):
+            liked = set(Like.objects.filter(user=request.user, post_id__in=page).values_list('post_id', flat=True))
+        serializer = self.get_serializer(
+            [posts[pk] for pk in page if pk in posts],  # deleted since it was ranked
+            many=True,
+            context={**self.get_serializer_context(), 'liked_post_ids': liked},
+        )
+        return self.get_paginated_response(serializer.data)
+
+    @extend_schema(request=SeenPostsSerializer, responses=None)
+    @action(detail=False, methods=['post'])
+    def seen(self, request):
+        """
+        Report posts shown to the user, as {"post_ids": [...]} (up to 500 per call).
+
+        The feeds leave them out from then on (for SEEN_POSTS_TTL); pass
+        ?include_seen=1 to a feed to get them anyway.
+        """
+        serializer = SeenPostsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        count = mark_seen(request.user.id, serializer.validated_data['post_ids'])
+        return Response({'seen': count})
+
+    @action(detail=False, methods=['get'])
+    def sync(self, request):
+        """
+        What changed since a sync token: new feed post ids, deleted post ids
+        and fresh counts for the posts listed in ?posts=1,2,3.
+
+        Call without ?since= (or with an expired token) to get a first token;
+        the response then has reset=true and the client should load the feed
+        normally. Every response carries the token for the next sync.
+        """
+        token = request.query_params.get('since')
+        if not token:
+            return Response(reset_response())
+        try:
+            since = read_token(token)
+        except ExpiredToken:
+            return Response(reset_response())
+        except signing.BadSignature:
+            return Response(
+                {'error': 'Invalid sync token.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(sync_feed(request.user, since, parse_post_ids(request.query_params.get('posts'))))
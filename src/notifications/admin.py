@@ -0,0 +1,21 @@
+from django.contrib import admin
+
+from teacup.paginators import EstimatedCountPaginator
+from .models import Notification, Inbox
+
+
+@admin.register(Notification)
+class NotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipient', 'verb', 'post', 'last_actor', 'actor_count', 'is_read', 'updated_at')
+    list_filter = ('verb', 'is_read')
+    search_fields = ('recipient__username',)
+    raw_id_fields = ('recipient', 'post', 'last_actor')
+    list_select_related = ('recipient', 'post__author', 'last_actor')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Inbox)
+class InboxAdmin(admin.ModelAdmin):
+    list_display = ('user', 'unread_count')
+    raw_id_fields = ('user',)
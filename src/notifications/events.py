@@ -0,0 +1,27 @@
+"""
+Entry points for producing notifications.
+
+Views call notify() on the request path; it only queues a task row; the
+coalescing and inbox updates happen in batches in notifications.tasks.
+"""
+from taskqueue.queue import enqueue, enqueue_many
+
+DELIVER_TASK = 'notifications.deliver'
+
+
+def _event(recipient_id, verb, actor_id, post_id=None):
+    return {'recipient': recipient_id, 'verb': verb, 'actor': actor_id, 'post': post_id}
+
+
+def notify(recipient_id, verb, actor_id, post_id=None):
+    """Queue one notification event. Events on your own stuff are dropped."""
+    if recipient_id == actor_id:
+        return
+    enqueue(DELIVER_TASK, _event(recipient_id, verb, actor_id, post_id))
+
+
+def notify_many(events):
+    """Queue several (recipient_id, verb, actor_id, post_id) events in one INSERT."""
+    payloads = [_event(*event) for event in events if event[0] != event[2]]
+    if payloads:
+        enqueue_many(DELIVER_TASK, payloads)
@@ -0,0 +1,60 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, reset_queries
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from notifications.models import Notification
+from notifications.views import NotificationViewSet
+
+USERNAME = 'bench_inbox_user'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time inbox reads (first page + unread count) as a user accumulates notifications. '
+        'Creates a throwaway user in the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--volumes', default='1000,10000,100000', help='Comma separated inbox sizes')
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        User.objects.filter(username=USERNAME).delete()
+        user = User.objects.create_user(username=USERNAME)
+        factory = APIRequestFactory()
+        views = {
+            'list': NotificationViewSet.as_view({'get': 'list'}),
+            'unread_count': NotificationViewSet.as_view({'get': 'unread_count'}),
+        }
+        try:
+            total = 0
+            for volume in [int(v) for v in options['volumes'].split(',')]:
+                Notification.objects.bulk_create(
+                    [Notification(recipient=user, verb=Notification.FOLLOW, is_read=True)
+                     for _ in range(volume - total)],
+                    batch_size=5000,
+                )
+                total = volume
+                for name, view in views.items():
+                    timings, queries = [], 0
+                    for _ in range(options['repeat']):
+                        request = factory.get('/', HTTP_HOST='localhost')
+                        force_authenticate(request, user=user)
+                        with override_settings(DEBUG=True):
+                            reset_queries()
+                            started = time.perf_counter()
+                            view(request).render()
+                            timings.append(time.perf_counter() - started)
+                            queries = len(connection.queries)
+                    self.stdout.write(
+                        f'{volume:>9,} notifications  {name:<13} '
+                        f'median {statistics.median(timings) * 1000:6.2f} ms  '
+                        f'max {max(timings) * 1000:6.2f} ms  {queries} queries'
+                    )
+        finally:
+            User.objects.filter(username=USERNAME).delete()
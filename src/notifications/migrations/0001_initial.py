@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:18
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('posts', '0002_post_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Inbox',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='inbox', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('like', 'Like'), ('comment', 'Comment'), ('follow', 'Follow')], max_length=10)),
+                ('actor_count', models.PositiveIntegerField(default=1)),
+                ('is_read', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, help_text='Time of the latest coalesced event')),
+                ('last_actor', models.ForeignKey(blank=True, help_text='Most recent user behind this notification', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('post', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='posts.post')),
+                ('recipient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-updated_at', '-id'],
+                'indexes': [models.Index(fields=['recipient', '-updated_at', '-id'], name='notificatio_recipie_d62bbf_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('is_read', False), ('post__isnull', False)), fields=('recipient', 'verb', 'post'), name='notifications_one_unread_per_post'), models.UniqueConstraint(condition=models.Q(('is_read', False), ('post__isnull', True)), fields=('recipient', 'verb'), name='notifications_one_unread_per_verb')],
+            },
+        ),
+    ]
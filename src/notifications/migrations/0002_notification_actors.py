@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:55
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_actors(apps, schema_editor):
+    # Earlier actors weren't recorded; the latest one is all we know
+    Notification = apps.get_model('notifications', 'Notification')
+    NotificationActor = apps.get_model('notifications', 'NotificationActor')
+    rows = Notification.objects.filter(is_read=False, last_actor__isnull=False).values_list('id', 'last_actor_id')
+    NotificationActor.objects.bulk_create(
+        [NotificationActor(notification_id=pk, actor_id=actor_id) for pk, actor_id in rows.iterator()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationActor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('actor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('notification', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='actors', to='notifications.notification')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('notification', 'actor'), name='notifications_actor_once')],
+            },
+        ),
+        migrations.RunPython(backfill_actors, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,88 @@
+from django.db import models
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+from posts.models import Post
+
+
+class Notification(models.Model):
+    """
+    A coalesced notification in a user's inbox.
+
+    Repeated events of the same kind (e.g. likes on the same post) update one
+    unread row - "alice and 41 others liked your post" - instead of adding a row each.
+    """
+    LIKE = 'like'
+    COMMENT = 'comment'
+    FOLLOW = 'follow'
+    VERB_CHOICES = [
+        (LIKE, 'Like'),
+        (COMMENT, 'Comment'),
+        (FOLLOW, 'Follow'),
+    ]
+
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    verb = models.CharField(max_length=10, choices=VERB_CHOICES)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
+    last_actor = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        help_text="Most recent user behind this notification"
+    )
+    actor_count = models.PositiveIntegerField(default=1)
+    is_read = models.BooleanField(default=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(default=timezone.now, help_text="Time of the latest coalesced event")
+
+    class Meta:
+        ordering = ['-updated_at', '-id']
+        indexes = [
+            models.Index(fields=['recipient', '-updated_at', '-id']),
+        ]
+        constraints = [
+            # At most one unread row per (recipient, verb, post) to coalesce into
+            models.UniqueConstraint(
+                fields=['recipient', 'verb', 'post'],
+                condition=models.Q(is_read=False, post__isnull=False),
+                name='notifications_one_unread_per_post'
+            ),
+            models.UniqueConstraint(
+                fields=['recipient', 'verb'],
+                condition=models.Q(is_read=False, post__isnull=True),
+                name='notifications_one_unread_per_verb'
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.recipient.username}: {self.verb} x{self.actor_count}"
+
+
+class NotificationActor(models.Model):
+    """
+    Who is already counted in an unread notification, so the same person
+    liking, unliking and liking again doesn't become "and 2 others".
+
+    Only unread rows need these; marking read drops them.
+    """
+    notification = models.ForeignKey(Notification, on_delete=models.CASCADE, related_name='actors')
+    actor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['notification', 'actor'], name='notifications_actor_once'),
+        ]
+
+    def __str__(self):
+        return f"{self.actor_id} on notification {self.notification_id}"
+
+
+class Inbox(models.Model):
+    """Per-user inbox state, so the unread badge is a primary key lookup instead of a COUNT."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='inbox')
+    unread_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user.username}'s inbox ({self.unread_count} unread)"
@@ -0,0 +1,33 @@
+from rest_framework import serializers
+
+from users.serializers import AuthorCardField, CardListSerializer
+from .models import Notification
+
+VERB_PHRASES = {
+    Notification.LIKE: 'liked your post',
+    Notification.COMMENT: 'commented on your post',
+    Notification.FOLLOW: 'started following you',
+}
+
+
+class NotificationSerializer(serializers.ModelSerializer):
+    """Serializer for Notification model."""
+    actor = AuthorCardField(source='last_actor_id')
+    summary = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Notification
+        fields = ['id', 'verb', 'post', 'actor', 'actor_count', 'summary', 'is_read', 'created_at', 'updated_at']
+        read_only_fields = fields
+        list_serializer_class = CardListSerializer
+
+    def get_summary(self, obj):
+        """Human readable text, e.g. 'alice and 41 others liked your post'."""
+        card = self.fields['actor'].to_representation(obj.last_actor_id) if obj.last_actor_id else None
+        name = card['username'] if card else 'Someone'
+        others = obj.actor_count - 1
+        if others == 1:
+            name = f'{name} and 1 other'
+        elif others > 1:
+            name = f'{name} and {others} others'
+        return f'{name} {VERB_PHRASES[obj.verb]}'
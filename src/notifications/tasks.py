@@ -0,0 +1,92 @@
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from posts.models import Post
+from taskqueue.queue import task
+
+from .models import Notification, NotificationActor, Inbox
+
+
+def _bump_unread(user_id, delta):
+    if not Inbox.objects.filter(user_id=user_id).update(unread_count=F('unread_count') + delta):
+        try:
+            with transaction.atomic():
+                Inbox.objects.create(user_id=user_id, unread_count=delta)
+        except IntegrityError:
+            Inbox.objects.filter(user_id=user_id).update(unread_count=F('unread_count') + delta)
+
+
+def _coalesce(recipient_id, verb, post_id, actor_ids):
+    """
+    Fold a group of events into the recipient's unread row, creating it if needed.
+
+    `actor_ids` are distinct; only the ones not already on the unread row
+    (NotificationActor) raise its count.
+    """
+    now = timezone.now()
+    unread = Notification.objects.filter(recipient_id=recipient_id, verb=verb, post_id=post_id, is_read=False)
+    # Locked so concurrent batches for the same row can't both count one actor
+    notification_id = unread.select_for_update().values_list('pk', flat=True).first()
+    if notification_id is None:
+        try:
+            with transaction.atomic():
+                notification = Notification.objects.create(
+                    recipient_id=recipient_id,
+                    verb=verb,
+                    post_id=post_id,
+                    last_actor_id=actor_ids[-1],
+                    actor_count=len(actor_ids),
+                    updated_at=now,
+                )
+                NotificationActor.objects.bulk_create(
+                    [NotificationActor(notification=notification, actor_id=actor_id) for actor_id in actor_ids]
+                )
+        except IntegrityError:
+            # Someone else created the unread row in the meantime (or the post is gone)
+            notification_id = unread.select_for_update().values_list('pk', flat=True).first()
+            if notification_id is None:
+                return
+        else:
+            _bump_unread(recipient_id, 1)
+            return
+
+    counted = set(
+        NotificationActor.objects.filter(notification_id=notification_id, actor_id__in=actor_ids)
+        .values_list('actor_id', flat=True)
+    )
+    new = [actor_id for actor_id in actor_ids if actor_id not in counted]
+    NotificationActor.objects.bulk_create(
+        [NotificationActor(notification_id=notification_id, actor_id=actor_id) for actor_id in new],
+        ignore_conflicts=True,
+    )
+    Notification.objects.filter(pk=notification_id).update(
+        actor_count=F('actor_count') + len(new), last_actor_id=actor_ids[-1], updated_at=now,
+    )
+
+
+@task('notifications.deliver', batch=True)
+def deliver(events):
+    """Coalesce a batch of events into one write per (recipient, verb, post)."""
+    # Drop events whose post or users were deleted while they sat in the queue
+    post_ids = {e['post'] for e in events if e.get('post')}
+    user_ids = {e['recipient'] for e in events} | {e['actor'] for e in events}
+    live_posts = set(Post.objects.filter(pk__in=post_ids).values_list('pk', flat=True))
+    live_users = set(User.objects.filter(pk__in=user_ids).values_list('pk', flat=True))
+
+    groups = OrderedDict()
+    for event in events:
+        if event.get('post') and event['post'] not in live_posts:
+            continue
+        if event['recipient'] not in live_users or event['actor'] not in live_users:
+            continue
+        key = (event['recipient'], event['verb'], event.get('post'))
+        actors = groups.setdefault(key, OrderedDict())
+        # Each actor once, in order of their latest event (like, unlike, like is one like)
+        actors.pop(event['actor'], None)
+        actors[event['actor']] = None
+    for (recipient_id, verb, post_id), actors in groups.items():
+        _coalesce(recipient_id, verb, post_id, list(actors))
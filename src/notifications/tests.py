@@ -0,0 +1,107 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from posts.models import Post
+from taskqueue.queue import run_pending
+from .models import Notification, NotificationActor, Inbox
+
+
+class NotificationAPITest(APITestCase):
+    """Test notification delivery and the inbox endpoints."""
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.fans = [User.objects.create_user(username=f'fan{i}', password='testpass123') for i in range(3)]
+        self.post = Post.objects.create(content='Look at this', author=self.author)
+
+    def _like_as(self, user):
+        self.client.force_authenticate(user=user)
+        self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+
+    def test_likes_are_coalesced(self):
+        """Test several likes on one post end up as a single notification."""
+        for fan in self.fans:
+            self._like_as(fan)
+        self.assertEqual(Notification.objects.count(), 0)  # nothing until the worker runs
+        run_pending()
+
+        notification = Notification.objects.get()
+        self.assertEqual(notification.actor_count, 3)
+        self.assertEqual(notification.last_actor, self.fans[-1])
+
+        self.client.force_authenticate(user=self.author)
+        response = self.client.get(reverse('notification-list'))
+        self.assertEqual(response.data['results'][0]['summary'], 'fan2 and 2 others liked your post')
+        response = self.client.get(reverse('notification-unread-count'))
+        self.assertEqual(response.data['unread_count'], 1)
+
+    def test_repeat_actors_are_counted_once(self):
+        """Test liking again, in the same batch or a later one, doesn't add to "and N others"."""
+        def relike(user):
+            self._like_as(user)
+            self.client.post(reverse('post-unlike', kwargs={'pk': self.post.pk}))
+            self._like_as(user)
+
+        relike(self.fans[0])
+        run_pending()
+        self.assertEqual(Notification.objects.get().actor_count, 1)
+        relike(self.fans[0])
+        self._like_as(self.fans[1])
+        run_pending()
+        notification = Notification.objects.get()
+        self.assertEqual((notification.actor_count, notification.last_actor), (2, self.fans[1]))
+
+        self.client.force_authenticate(user=self.author)
+        self.client.post(reverse('notification-mark-read'))
+        self.assertFalse(NotificationActor.objects.exists())
+
+    def test_mark_read_starts_a_new_row(self):
+        """Test events after mark_read start a fresh unread notification."""
+        self._like_as(self.fans[0])
+        run_pending()
+        self.client.force_authenticate(user=self.author)
+        self.client.post(reverse('notification-mark-read'))
+        self.assertEqual(Inbox.objects.get(user=self.author).unread_count, 0)
+
+        self._like_as(self.fans[1])
+        run_pending()
+        self.assertEqual(Notification.objects.filter(is_read=False).count(), 1)
+        self.assertEqual(Inbox.objects.get(user=self.author).unread_count, 1)
+
+    def test_follow_notification(self):
+        """Test following someone notifies them and liking your own post doesn't."""
+        self.client.force_authenticate(user=self.fans[0])
+        self.client.post(reverse('user-follow', kwargs={'pk': self.author.pk}))
+        self._like_as(self.author)
+        run_pending()
+        self.assertEqual(list(Notification.objects.values_list('verb', flat=True)), [Notification.FOLLOW])
+
+    def test_inbox_reads_do_not_grow_with_volume(self):
+        """Test inbox list and unread count cost the same queries at 10 and 500 notifications."""
+        self.client.force_authenticate(user=self.author)
+
+        def query_counts():
+            cache.clear()  # cold author cards both times
+            counts = []
+            for url in (reverse('notification-list'), reverse('notification-unread-count')):
+                with CaptureQueriesContext(connection) as ctx:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                counts.append(len(ctx))
+            return counts
+
+        def add_notifications(count):
+            Notification.objects.bulk_create([
+                Notification(recipient=self.author, verb=Notification.LIKE, last_actor=self.fans[0], is_read=True)
+                for _ in range(count)
+            ])
+
+        add_notifications(10)
+        small = query_counts()
+        add_notifications(490)
+        self.assertEqual(query_counts(), small)
@@ -0,0 +1,55 @@
+from rest_framework import viewsets, permissions, status
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from users.blocks import ExcludedUsersFilter
+
+from .models import Notification, NotificationActor, Inbox
+from .serializers import NotificationSerializer
+
+
+class NotificationPagination(CursorPagination):
+    """Cursor pagination so deep pages cost the same as the first one."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-updated_at', '-id')
+
+
+class NotificationViewSet(viewsets.ReadOnlyModelViewSet):
+    """ViewSet for the authenticated user's notification inbox."""
+    serializer_class = NotificationSerializer
+    pagination_class = NotificationPagination
+    filter_backends = [ExcludedUsersFilter]
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return Notification.objects.filter(recipient=self.request.user)
+
+    @action(detail=False, methods=['get'])
+    def unread_count(self, request):
+        """Get the number of unread notifications (from the stored counter)."""
+        count = Inbox.objects.filter(user=request.user).values_list('unread_count', flat=True).first()
+        return Response({'unread_count': count or 0})
+
+    @action(detail=False, methods=['post'])
+    def mark_read(self, request):
+        """Mark notifications as read: the given `ids`, or all of them if none are given."""
+        unread = Notification.objects.filter(recipient=request.user, is_read=False)
+        ids = request.data.get('ids')
+        if ids:
+            if not isinstance(ids, list):
+                return Response({'error': 'ids must be a list.'}, status=status.HTTP_400_BAD_REQUEST)
+            unread = unread.filter(pk__in=ids)
+        # Read rows don't coalesce any more, so they don't need their actor lists
+        NotificationActor.objects.filter(notification__in=unread).delete()
+        if ids:
+            updated = unread.update(is_read=True)
+            Inbox.objects.filter(user=request.user).update(unread_count=Greatest(F('unread_count') - updated, 0))
+        else:
+            updated = unread.update(is_read=True)
+            Inbox.objects.filter(user=request.user).update(unread_count=0)
+        return Response({'marked_read': updated})
@@ -1,19 +1,32 @@
 from django.contrib import admin
+
+from teacup.paginators import EstimatedCountPaginator
 from .models import Post, Like, Comment
 
 
 @admin.register(Post)
 class PostAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'content_preview', 'created_at', 'likes_count', 'comments_count')
-    list_filter = ('created_at', 'updated_at')
+    # Stored counters rather than the likes_count/comments_count properties (two COUNTs per row)
+    list_display = ('id', 'author', 'content_preview', 'created_at', 'likes', 'comments')
+    list_filter = ('created_at',)
     search_fields = ('content', 'author__username')
     raw_id_fields = ('author',)
-    readonly_fields = ('created_at', 'updated_at', 'likes_count', 'comments_count')
+    readonly_fields = ('created_at', 'updated_at', 'likes', 'comments')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def content_preview(self, obj):
         return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
     content_preview.short_description = 'Content Preview'
 
+    @admin.display(description='Likes', ordering='likes_total')
+    def likes(self, obj):
+        return obj.likes_total
+
+    @admin.display(description='Comments', ordering='comments_total')
+    def comments(self, obj):
+        return obj.comments_total
+
 
 @admin.register(Like)
 class LikeAdmin(admin.ModelAdmin):
@@ -21,15 +34,21 @@ class LikeAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('user__username', 'post__content')
     raw_id_fields = ('user', 'post')
+    list_select_related = ('user', 'post__author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Comment)
 class CommentAdmin(admin.ModelAdmin):
-    list_display = ('id', 'author', 'post', 'content_preview', 'created_at')
-    list_filter = ('created_at', 'updated_at')
+    list_display = ('id', 'author', 'post', 'content_preview', 'depth', 'replies_total', 'created_at')
+    list_filter = ('created_at',)
     search_fields = ('content', 'author__username', 'post__content')
-    raw_id_fields = ('author', 'post')
-    readonly_fields = ('created_at', 'updated_at')
+    raw_id_fields = ('author', 'post', 'parent')
+    readonly_fields = ('path', 'depth', 'replies_total', 'created_at', 'updated_at')
+    list_select_related = ('author', 'post__author')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def content_preview(self, obj):
         return obj.content[:30] + '...' if len(obj.content) > 30 else obj.content
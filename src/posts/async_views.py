@@ -0,0 +1,52 @@
+"""Async twin of PostViewSet.retrieve (see teacup/async_api.py)."""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+
+from teacup.async_api import async_reads, authenticate, error, gather_queries
+from teacup.fieldsets import sparse_queryset, wants_field
+from users.cards import card_memo, get_cards
+
+from .models import Post, Like
+from .serializers import PostSerializer
+from .views import PostViewSet
+
+
+async def serialize_posts(request, user, posts, serializer_class, many=True):
+    """
+    Serialize posts after loading their author cards and the viewer's likes side by side.
+
+    Either is skipped when ?fields=/?omit=/?expand= leave it out of the response.
+    """
+    items = posts if many else [posts]
+    memo = card_memo({'request': request})
+    post_ids = [post.pk for post in items]
+    author_ids = {post.author_id for post in items} if wants_field(request, 'author', expanded=True) else set()
+    for post in items:
+        if 'comments' in getattr(post, '_prefetched_objects_cache', {}):
+            author_ids |= {comment.author_id for comment in post.comments.all()}
+
+    jobs = [lambda: get_cards(author_ids, memo)]
+    liked = user.is_authenticated and wants_field(request, 'is_liked')
+    if liked:
+        jobs.append(lambda: set(
+            Like.objects.filter(user_id=user.id, post_id__in=post_ids).values_list('post_id', flat=True)
+        ))
+    results = await gather_queries(*jobs)
+    context = {'request': request, 'liked_post_ids': results[1] if liked else set()}
+    return await sync_to_async(lambda: serializer_class(posts, many=many, context=context).data)()
+
+
+@async_reads(PostViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))
+async def post_detail(request, pk):
+    # Who's asking and which post don't depend on each other
+    (drf_request, user), (post,) = await asyncio.gather(
+        authenticate(request),
+        gather_queries(lambda: sparse_queryset(
+            Post.objects.prefetch_related('comments').filter(pk=pk), PostSerializer, request
+        ).first()),
+    )
+    if post is None:
+        return error('No Post matches the given query.', 404)
+    return JsonResponse(await serialize_posts(drf_request, user, post, PostSerializer, many=False))
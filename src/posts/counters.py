@@ -0,0 +1,73 @@
+"""
+Helpers for the denormalized Post.likes_total / Post.comments_total counters
+(and Comment.replies_total).
+
+The Like/Comment signals keep the counters in step for normal saves, but bulk
+writes (bulk_create, raw deletes) skip signals, so anything doing those should
+call refresh_counts() for the posts it touched afterwards.
+"""
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat, Now
+from django.dispatch import Signal
+
+from .models import Post, Like, Comment
+from .threads import END
+
+# Sent with `post_ids` (None for every post) after refresh_counts() rewrote counters
+counts_refreshed = Signal()
+
+
+def _count_subquery(model):
+    """Correlated COUNT(*) of `model` rows pointing at the outer post."""
+    counts = (
+        model.objects.filter(post=OuterRef('pk'))
+        .order_by()
+        .values('post')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def refresh_counts(post_ids=None, likes=True, comments=True):
+    """
+    Recompute stored counters from the Like/Comment tables.
+
+    Runs as a single UPDATE over the given posts (or every post when
+    post_ids is None), so it's safe to call repeatedly.
+    """
+    values = {}
+    if likes:
+        values['likes_total'] = _count_subquery(Like)
+    if comments:
+        values['comments_total'] = _count_subquery(Comment)
+    if not values:
+        return 0
+    values['stats_updated_at'] = Now()
+
+    queryset = Post.objects.all()
+    if post_ids is not None:
+        post_ids = list(post_ids)
+        if not post_ids:
+            return 0
+        queryset = queryset.filter(pk__in=post_ids)
+    updated = queryset.update(**values)
+    counts_refreshed.send(sender=Post, post_ids=post_ids)
+    return updated
+
+
+def refresh_reply_counts(comment_ids):
+    """Recompute Comment.replies_total for the given comments from their subtrees (one UPDATE)."""
+    comment_ids = list(comment_ids)
+    if not comment_ids:
+        return 0
+    below = (
+        Comment.objects.filter(
+            post_id=OuterRef('post_id'), path__gt=OuterRef('path'), path__lt=Concat(OuterRef('path'), Value(END)),
+        )
+        .order_by()
+        .values('post_id')
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Comment.objects.filter(pk__in=comment_ids).update(replies_total=Coalesce(Subquery(below), Value(0)))
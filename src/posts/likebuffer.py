@@ -0,0 +1,314 @@
+"""
+Write-behind buffering for likes on hot posts.
+
+With LIKE_WRITE_BEHIND enabled, PostViewSet.like/unlike don't touch the Like
+table. Each call is appended (and fsynced) to a per-process journal file and
+kept in an in-memory overlay, and a background timer flushes everything in
+batches: one bulk_create(ignore_conflicts=True), one DELETE for unlikes and
+one counter UPDATE for all the touched posts.
+
+The journal is what makes this crash-safe. A flush rotates the live journal
+first and only deletes the rotated file after the batch commits, and on
+startup any journals left behind by dead processes are picked up and
+replayed. Replaying is idempotent since the last op per (user, post) wins.
+
+The overlay is per process, so with several workers a user only sees their
+own pending like straight away on the worker that took it. Pending entries
+normally live for less than LIKE_BUFFER_FLUSH_INTERVAL seconds.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+
+from notifications.events import notify_many
+from notifications.models import Notification
+
+from .counters import refresh_counts
+from .models import Like, Post
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_PREFIX = 'likes-'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except (ProcessLookupError, OverflowError):
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class LikeBuffer:
+    """Per-process buffer of pending like/unlike operations."""
+
+    def __init__(self, journal_dir, batch_size=500, flush_interval=1.0):
+        self.journal_dir = Path(journal_dir)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # (user_id, post_id) -> True for a pending like, False for a pending unlike.
+        # Entries only exist while they differ from what's in the database.
+        self._pending = OrderedDict()
+        self._inflight = []
+        self._journal = None
+        self._journal_path = None
+        self._timer = None
+        self._recovered = False
+
+    # -- recording --------------------------------------------------------
+
+    def record(self, user_id, post_id, liked, in_db):
+        """
+        Journal a like (liked=True) or unlike (liked=False).
+
+        `in_db` is whether the like currently exists in the Like table, so the
+        overlay can tell a real change from a toggle back to the stored state.
+        """
+        key = (user_id, post_id)
+        with self._lock:
+            self._write_journal([user_id, post_id, int(liked)])
+            if liked == in_db:
+                self._pending.pop(key, None)
+            else:
+                self._pending[key] = liked
+                self._pending.move_to_end(key)
+            full = len(self._pending) >= self.batch_size
+
+        if full:
+            self.flush()
+        else:
+            self._schedule_flush()
+
+    def _write_journal(self, op):
+        if self._journal is None:
+            self.journal_dir.mkdir(parents=True, exist_ok=True)
+            self._journal_path = self.journal_dir / f'{JOURNAL_PREFIX}{os.getpid()}.log'
+            self._journal = open(self._journal_path, 'a', encoding='utf-8')
+        self._journal.write(json.dumps(op) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _schedule_flush(self):
+        if self.flush_interval <= 0:
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.flush_interval, self._timed_flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _timed_flush(self):
+        with self._lock:
+            self._timer = None
+        try:
+            self.flush()
+        except Exception:
+            logger.exception('Like buffer flush failed; will retry from the journal')
+        finally:
+            close_old_connections()
+
+    # -- reads ------------------------------------------------------------
+
+    def pending_state(self, user_id, post_id):
+        """True/False if there's a pending like/unlike for this pair, else None."""
+        key = (user_id, post_id)
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            for batch in reversed(self._inflight):
+                if key in batch:
+                    return batch[key]
+        return None
+
+    def pending_delta(self, post_id):
+        """Net change to a post's like count that hasn't been flushed yet."""
+        return self.pending_deltas([post_id]).get(post_id, 0)
+
+    def pending_deltas(self, post_ids):
+        """Net unflushed like count changes for several posts, as {post_id: delta}."""
+        post_ids = set(post_ids)
+        with self._lock:
+            if not self._pending and not self._inflight:
+                return {}
+            states = {}
+            for batch in self._inflight:
+                states.update(batch)
+            states.update(self._pending)
+        deltas = defaultdict(int)
+        for (user_id, post_id), liked in states.items():
+            if post_id in post_ids:
+                deltas[post_id] += 1 if liked else -1
+        return deltas
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    # -- flushing ---------------------------------------------------------
+
+    def flush(self):
+        """Write everything journaled so far to the database. Returns ops applied."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._recovered:
+                    self._claim_orphans()
+                    self._recovered = True
+                if self._journal is not None:
+                    self._journal.close()
+                    self._journal = None
+                    os.replace(self._journal_path, self._rotated_name())
+                if self._pending:
+                    self._inflight.append(self._pending)
+                    self._pending = OrderedDict()
+                # Rotated journals sort by creation time, including any left
+                # over from an earlier flush that failed.
+                journals = self._rotated_journals()
+
+            # If this raises, the overlay and the journals are kept and the
+            # next flush retries them.
+            applied = apply_ops(read_journals(journals))
+            for path in journals:
+                path.unlink(missing_ok=True)
+            with self._lock:
+                self._inflight.clear()
+            return applied
+
+    def _rotated_name(self):
+        return self.journal_dir / f'{JOURNAL_PREFIX}{os.getpid()}.{time.time_ns()}.flushing'
+
+    def _rotated_journals(self):
+        if not self.journal_dir.exists():
+            return []
+        return sorted(self.journal_dir.glob(f'{JOURNAL_PREFIX}{os.getpid()}.*.flushing'))
+
+    def _claim_orphans(self):
+        """Take over journals left behind by processes that are no longer running."""
+        if not self.journal_dir.exists():
+            return
+        for path in sorted(self.journal_dir.glob(f'{JOURNAL_PREFIX}*')):
+            try:
+                pid = int(path.name[len(JOURNAL_PREFIX):].split('.')[0])
+            except ValueError:
+                continue
+            if pid == os.getpid() or _pid_alive(pid):
+                continue
+            try:
+                os.replace(path, self._rotated_name())
+            except FileNotFoundError:
+                continue  # another process got there first
+
+    def close(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if self._journal is not None or self._pending:
+            self.flush()
+
+
+def read_journals(paths):
+    """Net (user_id, post_id) -> liked state from journal files, in order."""
+    ops = OrderedDict()
+    for path in paths:
+        try:
+            with open(path, encoding='utf-8') as fh:
+                for line in fh:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        user_id, post_id, liked = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write; the request never got a response.
+                        continue
+                    key = (user_id, post_id)
+                    ops.pop(key, None)
+                    ops[key] = bool(liked)
+        except FileNotFoundError:
+            continue
+    return ops
+
+
+def apply_ops(ops):
+    """Apply net like/unlike ops in one transaction and refresh the touched counters."""
+    if not ops:
+        return 0
+
+    likes = [key for key, liked in ops.items() if liked]
+    unlikes = [key for key, liked in ops.items() if not liked]
+    post_ids = {post_id for _, post_id in ops}
+
+    with transaction.atomic():
+        if likes:
+            # Posts may have been deleted while their likes sat in the buffer.
+            authors = dict(Post.objects.filter(pk__in={p for _, p in likes}).values_list('pk', 'author_id'))
+            likes = [(user_id, post_id) for user_id, post_id in likes if post_id in authors]
+            Like.objects.bulk_create(
+                [Like(user_id=user_id, post_id=post_id) for user_id, post_id in likes],
+                ignore_conflicts=True,
+                batch_size=500,
+            )
+            notify_many((authors[post_id], Notification.LIKE, user_id, post_id) for user_id, post_id in likes)
+        if unlikes:
+            by_post = defaultdict(list)
+            for user_id, post_id in unlikes:
+                by_post[post_id].append(user_id)
+            condition = Q()
+            for post_id, user_ids in by_post.items():
+                condition |= Q(post_id=post_id, user_id__in=user_ids)
+            Like.objects.filter(condition).delete()
+        refresh_counts(post_ids, comments=False)
+    return len(ops)
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def write_behind_enabled():
+    return getattr(settings, 'LIKE_WRITE_BEHIND', False)
+
+
+def get_like_buffer():
+    """Return the process-wide LikeBuffer, creating it on first use."""
+    global _buffer
+    journal_dir = Path(settings.LIKE_BUFFER_DIR)
+    with _buffer_lock:
+        if _buffer is None or _buffer.journal_dir != journal_dir:
+            if _buffer is not None:
+                _buffer.close()
+            _buffer = LikeBuffer(
+                journal_dir,
+                batch_size=settings.LIKE_BUFFER_BATCH_SIZE,
+                flush_interval=settings.LIKE_BUFFER_FLUSH_INTERVAL,
+            )
+        return _buffer
+
+
+def peek_like_buffer():
+    """The buffer if this process has one, without creating it."""
+    return _buffer
+
+
+@atexit.register
+def _flush_on_exit():
+    if _buffer is not None:
+        try:
+            _buffer.close()
+        except Exception:
+            logger.exception('Could not flush pending likes on exit; they stay in the journal')
@@ -0,0 +1,89 @@
+import tempfile
+import threading
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from posts.likebuffer import get_like_buffer
+from posts.models import Post
+from posts.views import PostViewSet
+
+USERNAME_PREFIX = 'bench_like_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test concurrent likes on a single hot post, with and without '
+        'write-behind buffering. Creates throwaway users/posts in the configured database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000, help='Number of distinct likers')
+        parser.add_argument('--threads', type=int, default=16, help='Concurrent client threads')
+        parser.add_argument('--keep', action='store_true', help="Don't delete the benchmark data")
+
+    def handle(self, *args, **options):
+        users = self._make_users(options['users'])
+        try:
+            for write_behind in (False, True):
+                self._bench(users, options['threads'], write_behind)
+        finally:
+            if not options['keep']:
+                User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+
+    def _make_users(self, count):
+        User.objects.filter(username__startswith=USERNAME_PREFIX).delete()
+        User.objects.bulk_create(
+            [User(username=f'{USERNAME_PREFIX}{i}', password='!') for i in range(count)],
+            batch_size=1000,
+        )
+        return list(User.objects.filter(username__startswith=USERNAME_PREFIX))
+
+    def _bench(self, users, threads, write_behind):
+        post = Post.objects.create(author=users[0], content='Benchmark post')
+        view = PostViewSet.as_view({'post': 'like'})
+        factory = APIRequestFactory()
+        errors = []
+        chunks = [users[i::threads] for i in range(threads)]
+
+        def worker(chunk):
+            try:
+                for user in chunk:
+                    request = factory.post(f'/api/v1/posts/{post.pk}/like/')
+                    force_authenticate(request, user=user)
+                    try:
+                        response = view(request, pk=post.pk)
+                        if response.status_code != 201:
+                            errors.append(response.status_code)
+                    except Exception as exc:  # e.g. "database is locked" on SQLite
+                        errors.append(type(exc).__name__)
+            finally:
+                connection.close()
+
+        with tempfile.TemporaryDirectory() as journal_dir, override_settings(
+            LIKE_WRITE_BEHIND=write_behind, LIKE_BUFFER_DIR=journal_dir,
+        ):
+            started = time.perf_counter()
+            pool = [threading.Thread(target=worker, args=(chunk,)) for chunk in chunks]
+            for thread in pool:
+                thread.start()
+            for thread in pool:
+                thread.join()
+            accepted = time.perf_counter() - started
+            if write_behind:
+                get_like_buffer().flush()
+            total = time.perf_counter() - started
+
+        post.refresh_from_db()
+        label = 'write-behind' if write_behind else 'direct'
+        self.stdout.write(
+            f'{label:>12}: {len(users)} likes from {threads} threads, '
+            f'{len(users) / accepted:,.0f} likes/s accepted, '
+            f'{len(users) / total:,.0f} likes/s persisted, '
+            f'{len(errors)} errors, stored count {post.likes_total}'
+        )
+        post.delete()
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.likebuffer import get_like_buffer
+
+
+class Command(BaseCommand):
+    help = 'Flush buffered likes, replaying journals left behind by crashed workers.'
+
+    def handle(self, *args, **options):
+        applied = get_like_buffer().flush()
+        self.stdout.write(self.style.SUCCESS(f'Applied {applied} like/unlike operations.'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from posts.tags import reindex
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the #hashtag/@mention index and trending counts for all posts, in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        def progress(indexed, last_id):
+            self.stdout.write(f'Indexed {indexed} posts (up to id {last_id})')
+
+        total = reindex(batch_size=options['batch_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {total} posts.'))
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0002_post_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, help_text="Set when the post is queued for deletion; it's hidden from then on", null=True),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0003_post_deleted_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=151)),
+                ('bucket', models.DateTimeField(help_text='Start of the hour')),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'tag'], name='posts_tagco_bucket_b47d7f_idx')],
+                'unique_together': {('tag', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PostTag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tag', models.CharField(max_length=151)),
+                ('created_at', models.DateTimeField()),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tags', to='posts.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['tag', '-created_at', '-post'], name='posts_postt_tag_d27024_idx')],
+                'unique_together': {('tag', 'post')},
+            },
+        ),
+    ]
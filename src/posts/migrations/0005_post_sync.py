@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0004_post_tags'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PostTombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('post_id', models.BigIntegerField()),
+                ('author_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='stats_updated_at',
+            field=models.DateTimeField(blank=True, help_text='Last time likes_total/comments_total changed (for /feed/sync/)', null=True),
+        ),
+    ]
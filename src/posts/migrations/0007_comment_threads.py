@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:24
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, LPad
+
+
+def backfill_paths(apps, schema_editor):
+    # Every existing comment is top-level
+    Comment = apps.get_model('posts', 'Comment')
+    Comment.objects.update(path=LPad(Cast('id', CharField()), 10, Value('0')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0006_created_at_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comment',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='parent',
+            field=models.ForeignKey(blank=True, help_text='The comment this replies to (empty for top-level comments)', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='replies', to='posts.comment'),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='path',
+            field=models.CharField(default='', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='comment',
+            name='replies_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['post', 'path'], name='posts_comme_post_id_abd11d_idx'),
+        ),
+        migrations.RunPython(backfill_paths, migrations.RunPython.noop),
+    ]
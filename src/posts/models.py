@@ -1,11 +1,26 @@
 from django.db import models
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.core.validators import MinLengthValidator
 
+from teacup.dirty import SaveChangesMixin, snapshot
+
+from .threads import SEGMENT, ancestor_ids, segment
+
 # TODO: Consider adding image upload functionality instead of just URLs
 
 
-class Post(models.Model):
+class VisiblePostManager(models.Manager):
+    """Default manager that hides posts waiting to be deleted in the background."""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class Post(SaveChangesMixin, models.Model):
     """Model for user posts in the social media platform."""
     content = models.TextField(
         max_length=2000,
@@ -23,8 +38,28 @@ class Post(models.Model):
         null=True,
         help_text="Optional URL to media (image, video, etc.)"
     )
+    # Denormalized counters so lists don't need a COUNT per row.
+    # Kept in sync by the Like/Comment signals below and by posts.counters.
+    likes_total = models.PositiveIntegerField(default=0)
+    comments_total = models.PositiveIntegerField(default=0)
+    stats_updated_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Last time likes_total/comments_total changed (for /feed/sync/)"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    deleted_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Set when the post is queued for deletion; it's hidden from then on"
+    )
+
+    objects = VisiblePostManager()
+    all_objects = models.Manager()
+
+    # Written by UPDATE ... F() elsewhere; a save() from a stale instance mustn't overwrite them
+    untracked_fields = frozenset({'likes_total', 'comments_total', 'stats_updated_at'})
 
     class Meta:
         ordering = ['-created_at']  # Most recent posts first
@@ -64,12 +99,15 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['created_at']),  # admin date filter
+        ]
 
     def __str__(self):
         return f"{self.user.username} likes {self.post.id}"
 
 
-class Comment(models.Model):
+class Comment(SaveChangesMixin, models.Model):
     """Model for post comments."""
     content = models.TextField(
         max_length=500,
@@ -85,11 +123,149 @@ class Comment(models.Model):
         on_delete=models.CASCADE,
         related_name='comments'
     )
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='replies',
+        help_text="The comment this replies to (empty for top-level comments)"
+    )
+    # Thread position, see threads.py; set right after the insert
+    path = models.CharField(max_length=255, default='', editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Replies at any depth below this comment
+    replies_total = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Maintained with UPDATEs (the receivers below), never by a plain save()
+    untracked_fields = frozenset({'path', 'depth', 'replies_total'})
+
     class Meta:
         ordering = ['created_at']  # Oldest comments first
+        indexes = [
+            models.Index(fields=['created_at']),  # admin date filter and ordering
+            models.Index(fields=['post', 'path']),  # threads and subtrees are ranges of this
+        ]
 
     def __str__(self):
         return f"{self.author.username} on {self.post.id}: {self.content[:30]}{'...' if len(self.content) > 30 else ''}"
+
+
+class PostTag(models.Model):
+    """
+    Inverted index of #hashtags and @mentions found in post content.
+
+    Tags are stored lowercased with their sigil ('#django', '@alice') along
+    with a copy of the post's created_at, so a tag timeline is a single range
+    scan over (tag, -created_at).
+    """
+    tag = models.CharField(max_length=151)
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='tags')
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('tag', 'post')
+        indexes = [
+            models.Index(fields=['tag', '-created_at', '-post']),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} on {self.post_id}"
+
+
+class TagCount(models.Model):
+    """How many posts used a tag within one hour bucket; feeds the trending view."""
+    tag = models.CharField(max_length=151)
+    bucket = models.DateTimeField(help_text="Start of the hour")
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('tag', 'bucket')
+        indexes = [
+            models.Index(fields=['bucket', 'tag']),
+        ]
+
+    def __str__(self):
+        return f"{self.tag} @ {self.bucket:%Y-%m-%d %H:00}: {self.count}"
+
+
+class PostTombstone(models.Model):
+    """
+    Record of a deleted post, so /feed/sync/ can tell clients to drop it.
+
+    Plain ids rather than foreign keys: the post and possibly its author are
+    gone by the time anyone reads this. Rows older than FEED_SYNC_MAX_AGE are
+    pruned, since tokens that old are refused anyway.
+    """
+    post_id = models.BigIntegerField()
+    author_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"Post {self.post_id} deleted {self.deleted_at:%Y-%m-%d %H:%M}"
+
+
+@receiver(post_save, sender=Post)
+def index_post_tags(sender, instance, update_fields=None, **kwargs):
+    """Keep the #hashtag/@mention index in step with the post content."""
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    from .tags import index_post
+    index_post(instance)
+
+
+@receiver(post_save, sender=Like)
+def increment_likes_total(sender, instance, created, **kwargs):
+    """Bump the post's stored like counter when a like is created."""
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(likes_total=F('likes_total') + 1, stats_updated_at=Now())
+
+
+@receiver(post_delete, sender=Like)
+def decrement_likes_total(sender, instance, **kwargs):
+    """Drop the post's stored like counter when a like is removed."""
+    Post.objects.filter(pk=instance.post_id, likes_total__gt=0).update(
+        likes_total=F('likes_total') - 1, stats_updated_at=Now()
+    )
+
+
+@receiver(post_save, sender=Comment)
+def increment_comments_total(sender, instance, created, **kwargs):
+    """Bump the post's stored comment counter when a comment is created."""
+    if created:
+        Post.objects.filter(pk=instance.post_id).update(
+            comments_total=F('comments_total') + 1, stats_updated_at=Now()
+        )
+
+
+@receiver(post_save, sender=Comment)
+def place_comment(sender, instance, created, **kwargs):
+    """Give a new comment its thread path and count it on every comment above it."""
+    if not created or instance.path:
+        return
+    parent_path = instance.parent.path if instance.parent_id else ''
+    instance.path = parent_path + segment(instance.pk)
+    instance.depth = len(instance.path) // SEGMENT - 1
+    Comment.objects.filter(pk=instance.pk).update(path=instance.path, depth=instance.depth)
+    snapshot(instance, ['path', 'depth'])
+    if parent_path:
+        Comment.objects.filter(pk__in=ancestor_ids(instance.path)).update(replies_total=F('replies_total') + 1)
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_reply(sender, instance, **kwargs):
+    """Drop the reply counters above a removed comment (cascaded replies each drop their own)."""
+    if instance.parent_id:
+        Comment.objects.filter(pk__in=ancestor_ids(instance.path), replies_total__gt=0).update(
+            replies_total=F('replies_total') - 1
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def decrement_comments_total(sender, instance, **kwargs):
+    """Drop the post's stored comment counter when a comment is removed."""
+    Post.objects.filter(pk=instance.post_id, comments_total__gt=0).update(
+        comments_total=F('comments_total') - 1, stats_updated_at=Now()
+    )
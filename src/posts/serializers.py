@@ -1,25 +1,37 @@
 from rest_framework import serializers
-from django.contrib.auth.models import User
+from teacup.fieldsets import SparseFieldsMixin
+from users.serializers import AuthorCardField, CardListSerializer
 from .models import Post, Like, Comment
+from .likebuffer import peek_like_buffer
+from .threads import MAX_DEPTH
 
 
-class PostAuthorSerializer(serializers.ModelSerializer):
-    """Simplified serializer for post authors."""
-    profile_picture = serializers.CharField(source='profile.profile_picture', read_only=True)
-    
-    class Meta:
-        model = User
-        fields = ['id', 'username', 'first_name', 'last_name', 'profile_picture']
-
-
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Comment model."""
-    author = PostAuthorSerializer(read_only=True)
+    author = AuthorCardField(source='author_id')
+    replies_count = serializers.IntegerField(source='replies_total', read_only=True)
     
     class Meta:
         model = Comment
-        fields = ['id', 'content', 'author', 'post', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'created_at', 'updated_at']
+        fields = ['id', 'content', 'author', 'post', 'parent', 'depth', 'replies_count', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'author', 'depth', 'created_at', 'updated_at']
+        list_serializer_class = CardListSerializer
+        expandable = {'author': 'author_id'}
+
+    def validate(self, attrs):
+        if self.instance is not None:
+            # A comment stays where it was posted: its path, counters and block checks belong there
+            attrs.pop('post', None)
+            attrs.pop('parent', None)
+            return attrs
+        parent = attrs.get('parent')
+        post = self.context.get('post') or attrs.get('post')
+        if parent is not None:
+            if post is not None and parent.post_id != post.pk:
+                raise serializers.ValidationError({'parent': 'You can only reply to a comment on the same post.'})
+            if parent.depth >= MAX_DEPTH:
+                raise serializers.ValidationError({'parent': 'This thread is too deep to reply to.'})
+        return attrs
 
     def create(self, validated_data):
         """Create comment with authenticated user as author."""
@@ -27,21 +39,66 @@ class CommentSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class LikeSerializer(serializers.ModelSerializer):
+class ThreadPreviewSerializer(CommentSerializer):
+    """A top-level comment with the first few replies of its thread (see threads.thread_previews)."""
+    replies = CommentSerializer(source='preview', many=True, read_only=True)
+
+    class Meta(CommentSerializer.Meta):
+        fields = CommentSerializer.Meta.fields + ['replies']
+        expandable = {**CommentSerializer.Meta.expandable, 'replies': None}
+
+
+class LikeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Like model."""
-    user = PostAuthorSerializer(read_only=True)
+    user = AuthorCardField(source='user_id')
     
     class Meta:
         model = Like
         fields = ['id', 'user', 'post', 'created_at']
         read_only_fields = ['id', 'user', 'created_at']
+        list_serializer_class = CardListSerializer
+        expandable = {'user': 'user_id'}
+
 
+class LikeStateMixin:
+    """
+    Shared likes_count / is_liked handling for post serializers.
 
-class PostSerializer(serializers.ModelSerializer):
+    Counts come from the stored counters, with likes still sitting in the
+    write-behind buffer (see likebuffer.py) overlaid on top.
+    """
+    # Columns the method fields read, for sparse_queryset (teacup/fieldsets.py)
+    method_columns = {'likes_count': ('likes_total',), 'is_liked': ()}
+
+    def get_likes_count(self, obj):
+        count = obj.likes_total
+        buffer = peek_like_buffer()
+        if buffer is not None:
+            count += buffer.pending_delta(obj.pk)
+        return max(count, 0)
+
+    def get_is_liked(self, obj):
+        """Check if the current user has liked this post."""
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            buffer = peek_like_buffer()
+            if buffer is not None:
+                pending = buffer.pending_state(request.user.id, obj.pk)
+                if pending is not None:
+                    return pending
+            # Views that already loaded the viewer's likes for the page pass them in
+            liked = self.context.get('liked_post_ids')
+            if liked is not None:
+                return obj.pk in liked
+            return Like.objects.filter(user=request.user, post=obj).exists()
+        return False
+
+
+class PostSerializer(LikeStateMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Post model."""
-    author = PostAuthorSerializer(read_only=True)
-    likes_count = serializers.ReadOnlyField()
-    comments_count = serializers.ReadOnlyField()
+    author = AuthorCardField(source='author_id')
+    likes_count = serializers.SerializerMethodField()
+    comments_count = serializers.IntegerField(source='comments_total', read_only=True)
     is_liked = serializers.SerializerMethodField()
     comments = CommentSerializer(many=True, read_only=True)
     
@@ -52,14 +109,10 @@ class PostSerializer(serializers.ModelSerializer):
             'likes_count', 'comments_count', 'is_liked', 'comments'
         ]
         read_only_fields = ['id', 'author', 'created_at', 'updated_at']
-
-    def get_is_liked(self, obj):
-        """Check if the current user has liked this post."""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            # Could optimize this with a prefetch_related but it's fine for now
-            return Like.objects.filter(user=request.user, post=obj).exists()
-        return False
+        list_serializer_class = CardListSerializer
+        expandable = {'author': 'author_id', 'comments': None}
+        relations = {'comments': ('prefetch', 'comments')}
+        method_columns = LikeStateMixin.method_columns
 
     def create(self, validated_data):
         """Create post with authenticated user as author."""
@@ -67,11 +120,11 @@ class PostSerializer(serializers.ModelSerializer):
         return super().create(validated_data)
 
 
-class PostListSerializer(serializers.ModelSerializer):
+class PostListSerializer(LikeStateMixin, SparseFieldsMixin, serializers.ModelSerializer):
     """Simplified serializer for post lists."""
-    author = PostAuthorSerializer(read_only=True)
-    likes_count = serializers.ReadOnlyField()
-    comments_count = serializers.ReadOnlyField()
+    author = AuthorCardField(source='author_id')
+    likes_count = serializers.SerializerMethodField()
+    comments_count = serializers.IntegerField(source='comments_total', read_only=True)
     is_liked = serializers.SerializerMethodField()
     
     class Meta:
@@ -80,13 +133,9 @@ class PostListSerializer(serializers.ModelSerializer):
             'id', 'content', 'author', 'media_url', 'created_at',
             'likes_count', 'comments_count', 'is_liked'
         ]
-
-    def get_is_liked(self, obj):
-        """Check if the current user has liked this post."""
-        request = self.context.get('request')
-        if request and request.user.is_authenticated:
-            return Like.objects.filter(user=request.user, post=obj).exists()
-        return False
+        list_serializer_class = CardListSerializer
+        expandable = {'author': 'author_id'}
+        method_columns = LikeStateMixin.method_columns
 
 
 class PostCreateUpdateSerializer(serializers.ModelSerializer):
@@ -0,0 +1,157 @@
+"""
+#hashtag and @mention extraction and the PostTag inverted index.
+
+index_post() runs from Post's post_save signal and only writes the
+difference between the tags already indexed and the ones in the new content.
+TagCount keeps per-hour counts per tag for the trending view.
+"""
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Greatest, TruncHour
+from django.utils import timezone
+
+from .models import Post, PostTag, TagCount
+
+HASHTAG_RE = re.compile(r'(?<![\w#])#(\w{1,100})')
+MENTION_RE = re.compile(r'(?<![\w@])@([\w.+-]{1,150})')
+TAG_LOOKUP_RE = r'@?[\w.+-]{1,150}'
+
+
+def extract_tags(content):
+    """Return the set of normalized tags in `content`, e.g. {'#django', '@alice'}."""
+    tags = {f'#{match.lower()}' for match in HASHTAG_RE.findall(content)}
+    # Trailing dots are almost always punctuation ("thanks @alice.")
+    tags |= {f'@{match.rstrip(".").lower()}' for match in MENTION_RE.findall(content) if match.rstrip('.')}
+    return tags
+
+
+def normalize_tag(value):
+    """Turn user input ('Django', '#Django', '@Alice') into the stored form."""
+    value = value.strip().lower()
+    if value.startswith('@') or value.startswith('#'):
+        return value
+    return f'#{value}'
+
+
+def bucket_for(moment):
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+def _bump_count(tag, bucket, delta):
+    updated = TagCount.objects.filter(tag=tag, bucket=bucket).update(count=F('count') + delta)
+    if updated or delta < 0:
+        return
+    try:
+        with transaction.atomic():
+            TagCount.objects.create(tag=tag, bucket=bucket, count=delta)
+    except IntegrityError:
+        TagCount.objects.filter(tag=tag, bucket=bucket).update(count=F('count') + delta)
+
+
+def index_post(post):
+    """Sync the PostTag rows for a post with its current content."""
+    wanted = extract_tags(post.content)
+    existing = set(PostTag.objects.filter(post=post).values_list('tag', flat=True))
+    added, removed = wanted - existing, existing - wanted
+    if not added and not removed:
+        return
+
+    bucket = bucket_for(post.created_at)
+    if removed:
+        PostTag.objects.filter(post=post, tag__in=removed).delete()
+        TagCount.objects.filter(tag__in=removed, bucket=bucket, count__gt=0).update(count=F('count') - 1)
+    if added:
+        PostTag.objects.bulk_create(
+            [PostTag(tag=tag, post=post, created_at=post.created_at) for tag in added],
+            ignore_conflicts=True,
+        )
+        for tag in added:
+            _bump_count(tag, bucket, 1)
+
+
+def add_counts(counts, batch_size=1000):
+    """Add a {(tag, bucket): n} mapping onto TagCount, e.g. after bulk-inserting posts and their PostTags."""
+    items = list(counts.items())
+    for start in range(0, len(items), batch_size):
+        chunk = dict(items[start:start + batch_size])
+        existing = TagCount.objects.filter(
+            tag__in={tag for tag, _ in chunk}, bucket__in={bucket for _, bucket in chunk}
+        ).values_list('pk', 'tag', 'bucket')
+        for pk, tag, bucket in existing:
+            delta = chunk.pop((tag, bucket), None)
+            if delta:
+                TagCount.objects.filter(pk=pk).update(count=F('count') + delta)
+        try:
+            with transaction.atomic():
+                TagCount.objects.bulk_create(
+                    [TagCount(tag=tag, bucket=bucket, count=n) for (tag, bucket), n in chunk.items()]
+                )
+        except IntegrityError:
+            # Someone else created one of the rows meanwhile
+            for (tag, bucket), n in chunk.items():
+                _bump_count(tag, bucket, n)
+
+
+def subtract_counts(counts):
+    """Take a {(tag, bucket): n} mapping off TagCount, e.g. after raw-deleting PostTags."""
+    for (tag, bucket), n in counts.items():
+        TagCount.objects.filter(tag=tag, bucket=bucket).update(count=Greatest(F('count') - n, 0))
+
+
+def trending_tags(hours=None, limit=20, kind='#'):
+    """Most used tags over the last `hours` hourly buckets, cached briefly."""
+    hours = hours or settings.TAG_TRENDING_HOURS
+    cache_key = f'trending-tags:{kind}:{hours}:{limit}'
+    result = cache.get(cache_key)
+    if result is None:
+        since = bucket_for(timezone.now() - timedelta(hours=hours - 1))
+        rows = (
+            TagCount.objects.filter(bucket__gte=since, tag__startswith=kind)
+            .values('tag')
+            .annotate(total=Sum('count'))
+            .filter(total__gt=0)
+            .order_by('-total', 'tag')[:limit]
+        )
+        result = [{'tag': row['tag'], 'count': row['total']} for row in rows]
+        cache.set(cache_key, result, settings.TAG_TRENDING_CACHE_SECONDS)
+    return result
+
+
+def reindex(batch_size=1000, progress=None):
+    """Rebuild PostTag and TagCount for every post, walking posts in id order."""
+    last_id = 0
+    indexed = 0
+    while True:
+        posts = list(
+            Post.all_objects.filter(pk__gt=last_id).order_by('pk').only('id', 'content', 'created_at')[:batch_size]
+        )
+        if not posts:
+            break
+        rows = [PostTag(tag=tag, post=post, created_at=post.created_at)
+                for post in posts for tag in extract_tags(post.content)]
+        with transaction.atomic():
+            PostTag.objects.filter(post__in=posts).delete()
+            PostTag.objects.bulk_create(rows, batch_size=batch_size)
+        last_id = posts[-1].pk
+        indexed += len(posts)
+        if progress:
+            progress(indexed, last_id)
+
+    counts = (
+        PostTag.objects.annotate(hour=TruncHour('created_at'))
+        .values('tag', 'hour')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    with transaction.atomic():
+        TagCount.objects.all().delete()
+        TagCount.objects.bulk_create(
+            (TagCount(tag=row['tag'], bucket=row['hour'], count=row['total']) for row in counts.iterator()),
+            batch_size=batch_size,
+        )
+    return indexed
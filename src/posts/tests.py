@@ -1,9 +1,22 @@
-from django.test import TestCase
+import json
+import tempfile
+from pathlib import Path
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth.models import User
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import Post, Like, Comment
+from . import likebuffer
+from django.core.cache import cache
+from django.core.management import call_command
+from io import StringIO
+from unittest import mock
+
+from .models import Post, PostTag, TagCount, Like, Comment
+from .tags import extract_tags
 
 
 class PostModelTest(TestCase):
@@ -111,3 +124,356 @@ class PostAPITest(APITestCase):
         response = self.client.post(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(Like.objects.count(), 0)
+
+    def test_counters_follow_likes_and_comments(self):
+        """Test stored counters track likes and comments made through the API."""
+        self.client.force_authenticate(user=self.other_user)
+        self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+        self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}), {'content': 'Nice', 'post': self.post.pk})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.likes_total, self.post.comments_total), (1, 1))
+
+        self.client.post(reverse('post-unlike', kwargs={'pk': self.post.pk}))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.likes_total, 0)
+
+
+class LikeWriteBehindTest(APITestCase):
+    """Test buffered likes with LIKE_WRITE_BEHIND on."""
+
+    def setUp(self):
+        self.journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.journal_dir.cleanup)
+        settings_override = override_settings(
+            LIKE_WRITE_BEHIND=True,
+            LIKE_BUFFER_DIR=Path(self.journal_dir.name),
+            LIKE_BUFFER_FLUSH_INTERVAL=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(setattr, likebuffer, '_buffer', None)
+
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.post = Post.objects.create(content='Hot post', author=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def test_like_is_visible_before_flush(self):
+        """Test a buffered like shows up for the liker before it's written."""
+        response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Like.objects.count(), 0)
+
+        response = self.client.get(reverse('post-detail', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.data['likes_count'], 1)
+        self.assertTrue(response.data['is_liked'])
+
+        response = self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_flush_writes_likes_and_counters(self):
+        """Test flushing bulk-inserts likes and updates the counter once."""
+        other = User.objects.create_user(username='otheruser', password='testpass123')
+        self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+        self.client.force_authenticate(user=other)
+        self.client.post(reverse('post-like', kwargs={'pk': self.post.pk}))
+        self.client.post(reverse('post-unlike', kwargs={'pk': self.post.pk}))
+
+        likebuffer.get_like_buffer().flush()
+        self.post.refresh_from_db()
+        self.assertEqual(list(Like.objects.values_list('user', flat=True)), [self.user.pk])
+        self.assertEqual(self.post.likes_total, 1)
+        self.assertEqual(list(Path(self.journal_dir.name).iterdir()), [])
+
+    def test_replays_journal_from_dead_process(self):
+        """Test journals left behind by a crashed worker are applied."""
+        journal = Path(self.journal_dir.name) / 'likes-4999999.log'
+        journal.write_text(json.dumps([self.user.pk, self.post.pk, 1]) + '\n')
+
+        likebuffer.get_like_buffer().flush()
+        self.post.refresh_from_db()
+        self.assertTrue(Like.objects.filter(user=self.user, post=self.post).exists())
+        self.assertEqual(self.post.likes_total, 1)
+        self.assertFalse(journal.exists())
+
+
+class TagIndexTest(APITestCase):
+    """Test the #hashtag/@mention index and tag timelines."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='testuser', password='testpass123')
+        self.client.force_authenticate(user=self.user)
+
+    def test_extract_tags(self):
+        """Test hashtags and mentions are normalized."""
+        self.assertEqual(
+            extract_tags('Loving #Django and #django_rest, thanks @Alice. email me a@b.com'),
+            {'#django', '#django_rest', '@alice'},
+        )
+
+    def test_index_follows_edits(self):
+        """Test editing a post swaps its index rows."""
+        self.client.post(reverse('post-list'), {'content': 'Hello #django @alice'})
+        post = Post.objects.get()
+        self.assertEqual(set(PostTag.objects.values_list('tag', flat=True)), {'#django', '@alice'})
+
+        self.client.patch(reverse('post-detail', kwargs={'pk': post.pk}), {'content': 'Now #python'})
+        self.assertEqual(list(PostTag.objects.values_list('tag', flat=True)), ['#python'])
+        self.assertEqual(TagCount.objects.get(tag='#django').count, 0)
+
+    def test_edit_without_content_change(self):
+        """Test a save that doesn't touch content skips the index and leaves counters alone."""
+        post = Post.objects.create(content='Hello #django', author=self.user)
+        stale = Post.objects.get(pk=post.pk)
+        Like.objects.create(user=self.user, post=post)
+        stale.media_url = 'https://example.com/a.png'
+        with CaptureQueriesContext(connection) as ctx:
+            stale.save()
+        self.assertEqual(len(ctx), 1)
+        self.assertNotIn('posttag', ctx.captured_queries[0]['sql'])
+        self.assertEqual(Post.objects.get(pk=post.pk).likes_total, 1)
+        with self.assertNumQueries(0):
+            stale.save()
+
+    def test_tag_timelines(self):
+        """Test /tags/{tag}/ and ?tag= return tagged posts, newest first."""
+        first = Post.objects.create(content='#teacup is out', author=self.user)
+        Post.objects.create(content='unrelated', author=self.user)
+        second = Post.objects.create(content='More #Teacup, cc @testuser', author=self.user)
+
+        response = self.client.get(reverse('tag-detail', kwargs={'tag': 'teacup'}))
+        self.assertEqual([p['id'] for p in response.data['results']], [second.pk, first.pk])
+        response = self.client.get(reverse('tag-detail', kwargs={'tag': '@testuser'}))
+        self.assertEqual([p['id'] for p in response.data['results']], [second.pk])
+        response = self.client.get(reverse('post-list'), {'tag': '#teacup'})
+        self.assertEqual({p['id'] for p in response.data}, {first.pk, second.pk})
+
+    def test_trending_tags(self):
+        """Test trending tags are ranked by recent use."""
+        Post.objects.create(content='#one #two', author=self.user)
+        Post.objects.create(content='#two', author=self.user)
+        response = self.client.get(reverse('tag-trending'))
+        self.assertEqual(response.data, [{'tag': '#two', 'count': 2}, {'tag': '#one', 'count': 1}])
+
+    def test_reindex_command(self):
+        """Test the backfill command rebuilds the index from post content."""
+        post = Post.objects.create(content='#backfill me', author=self.user)
+        PostTag.objects.all().delete()
+        TagCount.objects.all().delete()
+        call_command('reindex_tags', batch_size=1, stdout=StringIO())
+        self.assertEqual(list(post.tags.values_list('tag', flat=True)), ['#backfill'])
+        self.assertEqual(TagCount.objects.get().count, 1)
+
+
+class CommentThreadTest(APITestCase):
+    """Test threaded replies stored as materialized paths."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='poster', password='testpass123')
+        self.post = Post.objects.create(content='Thread me', author=self.user)
+        self.client.force_authenticate(user=self.user)
+
+    def reply(self, parent=None, content='Reply'):
+        data = {'content': content, 'post': self.post.pk}
+        if parent is not None:
+            data['parent'] = parent.pk
+        response = self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}), data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return Comment.objects.get(pk=response.data['id'])
+
+    def test_paths_and_counters(self):
+        """Test replies get paths under their parent and bump every counter above them."""
+        first, second = self.reply(content='First'), self.reply(content='Second')
+        child = self.reply(first)
+        grandchild = self.reply(child)
+        self.assertEqual((first.depth, child.depth, grandchild.depth), (0, 1, 2))
+        self.assertTrue(grandchild.path.startswith(child.path) and child.path.startswith(first.path))
+        first.refresh_from_db()
+        child.refresh_from_db()
+        self.assertEqual((first.replies_total, child.replies_total), (2, 1))
+
+        response = self.client.get(reverse('post-comments', kwargs={'pk': self.post.pk}))
+        self.assertEqual([item['id'] for item in response.data], [first.pk, child.pk, grandchild.pk, second.pk])
+        self.assertEqual(response.data[0]['replies_count'], 2)
+
+        child.delete()
+        first.refresh_from_db()
+        self.post.refresh_from_db()
+        self.assertEqual((first.replies_total, self.post.comments_total), (0, 2))
+
+    def test_thread_and_previews_cost_constant_queries(self):
+        """Test a subtree and the per-thread previews take the same queries however deep they go."""
+        def queries(url, **params):
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            return len(captured), response.data
+
+        top = self.reply(content='Top')
+        chain = [top]
+        for _ in range(3):
+            chain.append(self.reply(chain[-1]))
+        other = self.reply(content='Other')
+        self.reply(other)
+
+        shallow, _ = queries(reverse('comment-thread', kwargs={'pk': chain[2].pk}))
+        deep, data = queries(reverse('comment-thread', kwargs={'pk': top.pk}))
+        self.assertEqual(shallow, deep)
+        self.assertEqual([item['id'] for item in data], [comment.pk for comment in chain])
+        _, data = queries(reverse('comment-thread', kwargs={'pk': top.pk}), depth=1)
+        self.assertEqual([item['id'] for item in data], [top.pk, chain[1].pk])
+
+        url = reverse('post-comments', kwargs={'pk': self.post.pk})
+        before, data = queries(url, replies=2)
+        self.assertEqual([(root['id'], [reply['id'] for reply in root['replies']]) for root in data],
+                         [(top.pk, [chain[1].pk, chain[2].pk]), (other.pk, [other.pk + 1])])
+        for _ in range(5):
+            chain.append(self.reply(chain[-1]))
+        after, _ = queries(url, replies=2)
+        self.assertEqual(before, after)
+        self.assertEqual(self.client.get(url, {'replies': 'x'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reply_validation(self):
+        """Test replies stay on the parent's post, under the depth limit, and away from blockers."""
+        other_post = Post.objects.create(content='Elsewhere', author=self.user)
+        elsewhere = Comment.objects.create(content='Hi', author=self.user, post=other_post)
+        response = self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}),
+                                    {'content': 'Hi', 'post': self.post.pk, 'parent': elsewhere.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('comment-list'),
+                                    {'content': 'Hi', 'post': self.post.pk, 'parent': elsewhere.pk})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with mock.patch('posts.serializers.MAX_DEPTH', 1):
+            child = self.reply(self.reply())
+            response = self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}),
+                                        {'content': 'Hi', 'post': self.post.pk, 'parent': child.pk})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        # Moving a comment by editing it is ignored
+        response = self.client.patch(reverse('comment-detail', kwargs={'pk': child.pk}), {'parent': ''})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['parent'], child.parent_id)
+        path = Comment.objects.get(pk=child.pk).path
+        response = self.client.patch(reverse('comment-detail', kwargs={'pk': child.pk}),
+                                     {'post': other_post.pk, 'content': 'Moved?'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['post'], self.post.pk)
+        moved = Comment.objects.get(pk=child.pk)
+        self.assertEqual((moved.post_id, moved.path, moved.content), (self.post.pk, path, 'Moved?'))
+        other_post.refresh_from_db()
+        self.assertEqual(other_post.comments_total, 1)
+
+        from users.blocks import block
+        stranger = User.objects.create_user(username='stranger')
+        theirs = Comment.objects.create(content='Go away', author=stranger, post=self.post)
+        block(stranger, self.user)
+        response = self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}),
+                                    {'content': 'Hi', 'post': self.post.pk, 'parent': theirs.pk})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class SparseFieldsTest(APITestCase):
+    """Test ?fields=, ?omit= and ?expand= on the post endpoints."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='sparse', password='testpass123')
+        self.post = Post.objects.create(content='Trim me', author=self.user)
+        Comment.objects.create(content='Hi', author=self.user, post=self.post)
+        self.url = reverse('post-detail', kwargs={'pk': self.post.pk})
+        self.client.force_authenticate(user=self.user)
+
+    def get(self, url, **params):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, captured
+
+    def test_fields_omit_and_expand(self):
+        """Test pruning, and nested objects collapsing to ids unless expanded."""
+        data, _ = self.get(self.url, fields='id,content')
+        self.assertEqual(data, {'id': self.post.pk, 'content': 'Trim me'})
+        data, _ = self.get(self.url, omit='comments,is_liked')
+        self.assertNotIn('comments', data)
+        self.assertIn('likes_count', data)
+        data, _ = self.get(self.url, expand='')
+        self.assertEqual(data['author'], self.user.pk)
+        self.assertNotIn('comments', data)
+        data, _ = self.get(self.url, expand='author')
+        self.assertEqual(data['author']['username'], 'sparse')
+        data, _ = self.get(self.url)
+        self.assertEqual(len(data['comments']), 1)
+        data, _ = self.get(reverse('post-list'), fields='id,author', expand='')
+        self.assertEqual(data, [{'id': self.post.pk, 'author': self.user.pk}])
+
+    def test_slim_requests_do_less_work(self):
+        """Test leaving fields out skips their prefetches, lookups and columns."""
+        _, full = self.get(self.url)
+        _, without_comments = self.get(self.url, omit='comments')
+        self.assertLess(len(without_comments), len(full))
+        _, slim = self.get(self.url, fields='id,content')
+        self.assertEqual(len(slim), 1)  # just the post; no likes or cards
+        self.assertNotIn('media_url', slim[0]['sql'])
+
+    def test_writes_are_not_trimmed(self):
+        """Test ?fields= doesn't apply to writes."""
+        response = self.client.post(reverse('post-add-comment', kwargs={'pk': self.post.pk}) + '?fields=id',
+                                    {'content': 'Another', 'post': self.post.pk})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertIn('content', response.data)
+
+
+class PostAdminTest(TestCase):
+    """Test the admin changelists stay cheap as tables grow."""
+
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpass123')
+        self.client.force_login(self.admin)
+        self.fans = [User.objects.create_user(username=f'fan{i}') for i in range(3)]
+
+    def add_posts(self, count):
+        for i in range(count):
+            post = Post.objects.create(content=f'Post {i}', author=self.admin)
+            for fan in self.fans:
+                Like.objects.create(user=fan, post=post)
+                Comment.objects.create(content='Nice', author=fan, post=post)
+
+    def changelist_queries(self, model):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(f'admin:posts_{model}_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_query_count_does_not_grow_with_rows(self):
+        """Test post, like and comment changelists don't query per row."""
+        self.add_posts(2)
+        before = {model: self.changelist_queries(model) for model in ('post', 'like', 'comment')}
+        self.add_posts(5)
+        after = {model: self.changelist_queries(model) for model in ('post', 'like', 'comment')}
+        self.assertEqual(before, after)
+
+    def test_counters_shown(self):
+        """Test the changelist shows the stored like/comment counters."""
+        self.add_posts(1)
+        response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertContains(response, '<td class="field-likes">3</td>', html=True)
+
+    @override_settings(ADMIN_EXACT_COUNT_LIMIT=5)
+    def test_estimated_counts(self):
+        """Test big tables are estimated and filtered counts stop at the limit."""
+        from teacup.paginators import EstimatedCountPaginator, estimated_count
+
+        self.add_posts(3)
+        Like.objects.order_by('pk')[3].delete()
+        self.assertEqual(Like.objects.count(), 8)
+        self.assertEqual(estimated_count(Like), 9)  # the primary key range, deleted row included
+        self.assertEqual(EstimatedCountPaginator(Like.objects.all(), 10).count, 9)
+        self.assertEqual(EstimatedCountPaginator(Like.objects.filter(user=self.fans[1]), 10).count, 3)
+        self.assertEqual(EstimatedCountPaginator(Like.objects.filter(post__author=self.admin), 10).count, 5)
+        # Small tables are counted exactly
+        self.assertEqual(EstimatedCountPaginator(Post.objects.all(), 10).count, 3)
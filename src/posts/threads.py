@@ -0,0 +1,83 @@
+"""
+Comment threads stored as materialized paths.
+
+Each comment keeps its path from the top of its thread: the ids of its
+ancestors and its own, each zero-padded to SEGMENT digits and run together
+(comment 7 replying to 3 is "0000000003" + "0000000007"). Ids only grow, so
+sorting by path gives depth-first thread order with siblings oldest first,
+and a subtree is the range [path, path + ':') (':' sorts right after '9'),
+one scan of the (post, path) index however deep it goes. A new reply only
+writes its own row (plus the ancestors' reply counters); nothing is
+renumbered.
+
+The path needs the comment's id, so it's filled in by an UPDATE right after
+the INSERT (the post_save receiver in models.py). Bulk inserts that skip
+signals call fill_paths() afterwards.
+"""
+from django.db.models import CharField, Exists, F, OuterRef, Value, Window
+from django.db.models.functions import Cast, Length, LPad, RowNumber, Substr
+
+SEGMENT = 10
+# Deep enough for any real conversation, and keeps paths under 255 characters
+MAX_DEPTH = 24
+# First character after the digits, for range ends
+END = ':'
+
+
+def segment(comment_id):
+    return f'{comment_id:0{SEGMENT}d}'
+
+
+def ancestor_ids(path):
+    """Ids of the comments above the one at `path`, top first."""
+    return [int(path[i:i + SEGMENT]) for i in range(0, len(path) - SEGMENT, SEGMENT)]
+
+
+def subtree(queryset, comment, max_depth=None):
+    """The comment and its replies at any depth, in thread order."""
+    queryset = queryset.filter(post_id=comment.post_id, path__gte=comment.path, path__lt=comment.path + END)
+    if max_depth is not None:
+        queryset = queryset.filter(depth__lte=comment.depth + max_depth)
+    return queryset.order_by('path')
+
+
+def thread_previews(queryset, post_id, replies):
+    """
+    Top-level comments of a post, each with its first `replies` replies in thread order.
+
+    One query: the post's comments numbered within each thread (the first
+    path segment) by path, keeping the first replies + 1 of every thread.
+    Returns the top-level Comment instances with the replies on `.preview`.
+    """
+    rows = (
+        queryset.filter(post_id=post_id)
+        .annotate(position=Window(RowNumber(), partition_by=[Substr('path', 1, SEGMENT)], order_by=F('path').asc()))
+        .filter(position__lte=replies + 1)
+        .order_by('path')
+    )
+    roots = []
+    for comment in rows:
+        if comment.depth == 0:
+            comment.preview = []
+            roots.append(comment)
+        elif roots and comment.path.startswith(roots[-1].path):
+            roots[-1].preview.append(comment)
+    return roots
+
+
+def with_replies(queryset):
+    """The comments in `queryset` plus every reply below them (by anyone)."""
+    from .models import Comment
+
+    # The comment's path starts with the ancestor's path
+    above = queryset.filter(
+        post_id=OuterRef('post_id'), depth__lte=OuterRef('depth'), path=Substr(OuterRef('path'), 1, Length('path')),
+    )
+    return Comment.objects.filter(post_id__in=queryset.values('post_id')).filter(Exists(above))
+
+
+def fill_paths(queryset):
+    """Give comments inserted without signals (so top-level) their paths."""
+    return queryset.filter(path='').update(
+        path=LPad(Cast('id', CharField()), SEGMENT, Value('0')), depth=0,
+    )
@@ -1,11 +1,21 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet
+from .views import PostViewSet, CommentViewSet, TagViewSet
 
 router = DefaultRouter()
 router.register(r'posts', PostViewSet)
 router.register(r'comments', CommentViewSet)
+router.register(r'tags', TagViewSet, basename='tag')
 
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+# Async read paths in front of the DRF views when served over ASGI (teacup/async_api.py)
+if settings.ASYNC_READ_VIEWS:
+    from . import async_views
+
+    urlpatterns = [
+        path('posts/<int:pk>/', async_views.post_detail),
+    ] + urlpatterns
@@ -1,25 +1,48 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.pagination import CursorPagination
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
 from django.db.models import Q
 
-from .models import Post, Like, Comment
+from notifications.events import notify
+from teacup.fieldsets import SparseViewMixin
+from users.blocks import exclude_users, is_blocked
+from users.cards import card_memo, get_cards
+from users.deletion import schedule_post_deletion
+from notifications.models import Notification
+
+from .models import Post, PostTag, Like, Comment
+from .tags import TAG_LOOKUP_RE, normalize_tag, trending_tags
+from .threads import subtree, thread_previews
+from .likebuffer import get_like_buffer, write_behind_enabled
 from .serializers import (
     PostSerializer, PostListSerializer, PostCreateUpdateSerializer,
-    CommentSerializer, LikeSerializer
+    CommentSerializer, LikeSerializer, ThreadPreviewSerializer
 )
 
+# Most replies ?replies= shows under each top-level comment
+MAX_PREVIEW_REPLIES = 20
+
+
+def _blocked_reply(user, parent):
+    """Whether `parent` (None for a top-level comment) is by someone blocking the user, or blocked by them."""
+    return parent is not None and is_blocked(user.id, parent.author_id)
 
-class PostViewSet(viewsets.ModelViewSet):
+
+class PostViewSet(SparseViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for Post CRUD operations.
     
-    Note: Using select_related and prefetch_related for performance
-    because we had some N+1 query issues in testing
+    Note: Using prefetch_related for performance because we had some N+1
+    query issues in testing. Authors come from the author card cache
+    (users/cards.py) so there's no need to join users/profiles here.
+    ?fields=/?omit=/?expand= trim what's loaded as well as what's shown
+    (teacup/fieldsets.py).
     """
-    queryset = Post.objects.all().select_related('author__profile').prefetch_related('likes', 'comments__author')
+    queryset = Post.objects.all().prefetch_related('comments')
     serializer_class = PostSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     search_fields = ['content', 'author__username']
@@ -46,6 +69,19 @@ class PostViewSet(viewsets.ModelViewSet):
         
         return [permission() for permission in permission_classes]
 
+    def get_queryset(self):
+        """Skip the joins and prefetches for actions that only need the post row."""
+        if self.action in ['like', 'unlike', 'add_comment']:
+            return Post.objects.all()
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            # The list serializer has no comments
+            queryset = queryset.prefetch_related(None)
+        tag = self.request.query_params.get('tag')
+        if tag and self.action == 'list':
+            queryset = queryset.filter(tags__tag=normalize_tag(tag))
+        return queryset
+
     def update(self, request, *args, **kwargs):
         """Only allow post authors to update their posts."""
         post = self.get_object()
@@ -57,19 +93,38 @@ class PostViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
-        """Only allow post authors to delete their posts."""
+        """
+        Only allow post authors to delete their posts.
+
+        The post is hidden right away; its likes and comments are removed in the background.
+        """
         post = self.get_object()
         if request.user != post.author:
             return Response(
                 {'error': 'You can only delete your own posts.'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().destroy(request, *args, **kwargs)
+        job = schedule_post_deletion(post)
+        return Response(
+            {'message': 'Post deleted.', 'deletion_job': job.id},
+            status=status.HTTP_202_ACCEPTED
+        )
 
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def like(self, request, pk=None):
         """Like a post."""
         post = self.get_object()
+
+        if write_behind_enabled():
+            if not self._buffer_like(request.user, post, liked=True):
+                return Response(
+                    {'error': 'You have already liked this post.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(
+                {'message': 'Post liked successfully.'},
+                status=status.HTTP_201_CREATED
+            )
         
         # Using get_or_create to avoid race conditions
         like, created = Like.objects.get_or_create(
@@ -83,7 +138,7 @@ class PostViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # TODO: Maybe add notification system here later?
+        notify(post.author_id, Notification.LIKE, request.user.id, post.id)
         return Response(
             {'message': 'Post liked successfully.'},
             status=status.HTTP_201_CREATED
@@ -93,6 +148,17 @@ class PostViewSet(viewsets.ModelViewSet):
     def unlike(self, request, pk=None):
         """Unlike a post."""
         post = self.get_object()
+
+        if write_behind_enabled():
+            if not self._buffer_like(request.user, post, liked=False):
+                return Response(
+                    {'error': 'You have not liked this post.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            return Response(
+                {'message': 'Post unliked successfully.'},
+                status=status.HTTP_200_OK
+            )
         
         try:
             like = Like.objects.get(user=request.user, post=post)
@@ -107,37 +173,78 @@ class PostViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+    def _buffer_like(self, user, post, liked):
+        """
+        Record a like/unlike in the write-behind buffer.
+
+        Returns False if it wouldn't change anything (already liked / not liked).
+        """
+        buffer = get_like_buffer()
+        in_db = Like.objects.filter(user=user, post=post).exists()
+        pending = buffer.pending_state(user.id, post.id)
+        current = in_db if pending is None else pending
+        if current == liked:
+            return False
+        buffer.record(user.id, post.id, liked, in_db)
+        return True
+
     @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def add_comment(self, request, pk=None):
         """Add a comment to a post."""
         post = self.get_object()
+        if is_blocked(request.user.id, post.author_id):
+            return Response(
+                {'error': 'You cannot comment on this post.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
-        serializer = CommentSerializer(data=request.data, context={'request': request})
+        serializer = CommentSerializer(data=request.data, context={'request': request, 'post': post})
         if serializer.is_valid():
+            if _blocked_reply(request.user, serializer.validated_data.get('parent')):
+                return Response(
+                    {'error': 'You cannot reply to this comment.'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
             serializer.save(post=post)
+            notify(post.author_id, Notification.COMMENT, request.user.id, post.id)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
     @action(detail=True, methods=['get'])
     def comments(self, request, pk=None):
-        """Get all comments for a post."""
+        """
+        Get all comments for a post, in thread order (replies right after what they reply to).
+
+        With ?replies=N only the top-level comments come back, each with the
+        first N replies of its thread (in thread order) under `replies`.
+        """
         post = self.get_object()
-        comments = Comment.objects.filter(post=post).select_related('author__profile')
-        serializer = CommentSerializer(comments, many=True)
+        if 'replies' in request.query_params:
+            try:
+                replies = min(max(int(request.query_params['replies']), 0), MAX_PREVIEW_REPLIES)
+            except ValueError:
+                return Response({'error': 'replies must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+            roots = thread_previews(Comment.objects.all(), post.pk, replies)
+            # Every card up front, rather than a lookup per nested list
+            memo = card_memo({'request': request})
+            get_cards({comment.author_id for root in roots for comment in [root, *root.preview]}, memo)
+            return Response(ThreadPreviewSerializer(roots, many=True, context={'request': request}).data)
+        comments = Comment.objects.filter(post=post).order_by('path')
+        serializer = CommentSerializer(comments, many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def likes(self, request, pk=None):
         """Get all likes for a post."""
         post = self.get_object()
-        likes = Like.objects.filter(post=post).select_related('user__profile')
-        serializer = LikeSerializer(likes, many=True)
+        likes = Like.objects.filter(post=post)
+        serializer = LikeSerializer(likes, many=True, context={'request': request})
         return Response(serializer.data)
 
 
-class CommentViewSet(viewsets.ModelViewSet):
+class CommentViewSet(SparseViewMixin, viewsets.ModelViewSet):
     """ViewSet for Comment CRUD operations."""
-    queryset = Comment.objects.all().select_related('author__profile', 'post')
+    queryset = Comment.objects.all()
     serializer_class = CommentSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     search_fields = ['content', 'author__username']
@@ -156,6 +263,32 @@ class CommentViewSet(viewsets.ModelViewSet):
         
         return [permission() for permission in permission_classes]
 
+    def perform_create(self, serializer):
+        post = serializer.validated_data['post']
+        if is_blocked(self.request.user.id, post.author_id):
+            raise PermissionDenied('You cannot comment on this post.')
+        if _blocked_reply(self.request.user, serializer.validated_data.get('parent')):
+            raise PermissionDenied('You cannot reply to this comment.')
+        comment = serializer.save()
+        notify(comment.post.author_id, Notification.COMMENT, comment.author_id, comment.post_id)
+
+    @action(detail=True, methods=['get'])
+    def thread(self, request, pk=None):
+        """
+        A comment and every reply below it, in thread order.
+
+        ?depth=N stops N levels below the comment. One range query on the
+        (post, path) index however deep the thread goes.
+        """
+        comment = self.get_object()
+        try:
+            depth = int(request.query_params['depth']) if 'depth' in request.query_params else None
+        except ValueError:
+            return Response({'error': 'depth must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        comments = subtree(Comment.objects.all(), comment, max_depth=depth)
+        serializer = CommentSerializer(comments, many=True, context={'request': request})
+        return Response(serializer.data)
+
     def update(self, request, *args, **kwargs):
         """Only allow comment authors to update their comments."""
         comment = self.get_object()
@@ -175,3 +308,43 @@ class CommentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         return super().destroy(request, *args, **kwargs)
+
+
+class TagTimelinePagination(CursorPagination):
+    """Cursor pagination over the (tag, -created_at) index."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-post')
+
+
+class TagViewSet(viewsets.ViewSet):
+    """
+    Timelines for #hashtags and @mentions.
+
+    /tags/django/ is the #django timeline and /tags/@alice/ lists posts mentioning alice.
+    """
+    lookup_field = 'tag'
+    lookup_value_regex = TAG_LOOKUP_RE
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+
+    def retrieve(self, request, tag=None):
+        """Get posts with a tag, newest first."""
+        entries = PostTag.objects.filter(tag=normalize_tag(tag), post__deleted_at__isnull=True)
+        entries = exclude_users(entries, request.user.id, ['post__author_id'])
+        paginator = TagTimelinePagination()
+        page = paginator.paginate_queryset(entries, request, view=self)
+        posts = Post.objects.in_bulk([entry.post_id for entry in page])
+        ordered = [posts[entry.post_id] for entry in page if entry.post_id in posts]
+        serializer = PostListSerializer(ordered, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'])
+    def trending(self, request):
+        """Get the most used tags over recent hours (?hours=24&kind=mentions)."""
+        try:
+            hours = min(max(int(request.query_params.get('hours', 24)), 1), 24 * 7)
+        except ValueError:
+            return Response({'error': 'hours must be a number.'}, status=status.HTTP_400_BAD_REQUEST)
+        kind = '@' if request.query_params.get('kind') == 'mentions' else '#'
+        return Response(trending_tags(hours=hours, kind=kind))
@@ -0,0 +1,103 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from taskqueue.queue import Worker, WorkerMetrics, queue_stats, release_stale
+
+
+def _release_stale(prefix, stdout):
+    released = release_stale()
+    if released:
+        stdout.write(json.dumps({'worker': prefix, 'released_stale': released}))
+        stdout.flush()
+
+
+def _run_threads(options, prefix, stdout):
+    """Run `--threads` workers in this process until SIGINT/SIGTERM (or drained with --once)."""
+    stop = threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *args: stop.set())
+
+    # Tasks left running by a worker that died before this one started
+    if options['stale_interval']:
+        _release_stale(prefix, stdout)
+    metrics = WorkerMetrics()
+    workers = [
+        Worker(
+            f'{prefix}-{i}',
+            batch_size=options['batch_size'],
+            poll_interval=options['poll_interval'],
+            metrics=metrics,
+            stop_event=stop,
+        )
+        for i in range(options['threads'])
+    ]
+    threads = [threading.Thread(target=w.run, kwargs={'drain': options['once']}, daemon=True) for w in workers]
+    for thread in threads:
+        thread.start()
+
+    last_report = last_release = time.monotonic()
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=1)
+        if options['stale_interval'] and time.monotonic() - last_release >= options['stale_interval']:
+            _release_stale(prefix, stdout)
+            last_release = time.monotonic()
+        if options['metrics_interval'] and time.monotonic() - last_report >= options['metrics_interval']:
+            stdout.write(json.dumps({'worker': prefix, 'tasks': metrics.summary()}))
+            stdout.flush()
+            last_report = time.monotonic()
+    stdout.write(json.dumps({'worker': prefix, 'tasks': metrics.summary()}))
+    stdout.flush()
+
+
+class Command(BaseCommand):
+    help = 'Run background task workers for the database task queue.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4, help='Worker threads per process')
+        parser.add_argument('--processes', type=int, default=1, help='Worker processes to fork')
+        parser.add_argument('--batch-size', type=int, default=10, help='Max same-type tasks claimed at once')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to sleep when idle')
+        parser.add_argument('--metrics-interval', type=float, default=60.0, help='Seconds between metric reports (0 = off)')
+        parser.add_argument(
+            '--stale-interval', type=float, default=60.0,
+            help='Seconds between releasing tasks whose worker died (0 = off)'
+        )
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is drained')
+        parser.add_argument('--stats', action='store_true', help='Print queue depth and exit')
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(json.dumps(queue_stats(), indent=2))
+            return
+
+        prefix = f'{socket.gethostname()}-{os.getpid()}'
+        if options['processes'] <= 1:
+            _run_threads(options, prefix, self.stdout)
+            return
+
+        # Forked children must not share the parent's database connection
+        connections.close_all()
+        ctx = multiprocessing.get_context('fork')
+        children = [
+            ctx.Process(target=_run_threads, args=(options, f'{prefix}-p{i}', self.stdout))
+            for i in range(options['processes'])
+        ]
+        for child in children:
+            child.start()
+        try:
+            for child in children:
+                child.join()
+        except KeyboardInterrupt:
+            for child in children:
+                child.terminate()
+                child.join()
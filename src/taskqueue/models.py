@@ -0,0 +1,37 @@
+from django.db import models
+from django.utils import timezone
+
+
+class Task(models.Model):
+    """A unit of background work, picked up by `manage.py run_worker`."""
+    PENDING = 'pending'
+    RUNNING = 'running'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (FAILED, 'Failed'),
+    ]
+
+    name = models.CharField(max_length=100, help_text="Registered handler name, e.g. 'notifications.deliver'")
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now, help_text="Don't run before this time")
+    locked_by = models.CharField(max_length=100, blank=True, help_text="Claim token of the worker running it")
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at', 'id']
+        indexes = [
+            models.Index(fields=['status', 'run_at']),
+            models.Index(fields=['status', 'name', 'run_at']),
+            models.Index(fields=['locked_by']),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
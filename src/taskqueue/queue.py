@@ -0,0 +1,288 @@
+"""
+A small database-backed task queue.
+
+Handlers are registered with @task in an app's tasks.py and queued with
+enqueue(). Because a task is just a row, enqueueing inside a request's
+transaction means it only becomes visible to workers if the request commits.
+
+Workers claim tasks with SELECT ... FOR UPDATE SKIP LOCKED where the database
+supports it (Postgres). On SQLite they fall back to a compare-and-set UPDATE
+(status still pending -> running with our claim token), which is safe across
+processes because SQLite serializes writers anyway.
+
+Handlers registered with batch=True receive a list of payloads, so a worker
+can claim up to `batch_size` queued tasks with the same name and run them in
+one call (e.g. coalescing notifications or counter updates).
+"""
+import logging
+import random
+import threading
+import time
+import traceback
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import Count, F
+from django.utils import timezone
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+_registry = {}
+_claim_lock = threading.Lock()
+
+
+class UnknownTask(Exception):
+    """Raised when a task name has no registered handler."""
+
+
+@dataclass
+class TaskHandler:
+    name: str
+    func: object
+    batch: bool = False
+    max_attempts: int = 5
+
+
+def task(name=None, batch=False, max_attempts=5):
+    """
+    Register a function as a task handler.
+
+        @task('notifications.deliver', batch=True)
+        def deliver(payloads): ...
+
+    The decorated function gets an `enqueue(payload=None, **kwargs)` helper.
+    """
+    def decorator(func):
+        task_name = name or f'{func.__module__}.{func.__name__}'
+        _registry[task_name] = TaskHandler(task_name, func, batch=batch, max_attempts=max_attempts)
+        func.task_name = task_name
+        func.enqueue = lambda payload=None, **kwargs: enqueue(task_name, payload, **kwargs)
+        return func
+    return decorator
+
+
+def get_handler(name):
+    try:
+        return _registry[name]
+    except KeyError:
+        raise UnknownTask(name) from None
+
+
+def enqueue(name, payload=None, delay=None, run_at=None):
+    """Queue a task. With TASKS_EAGER on it runs inline instead (handy for dev and tests)."""
+    handler = get_handler(name)
+    payload = payload or {}
+    if getattr(settings, 'TASKS_EAGER', False):
+        _call(handler, [payload])
+        return None
+    if run_at is None:
+        run_at = timezone.now() + (delay or timedelta(0))
+    return Task.objects.create(name=name, payload=payload, run_at=run_at, max_attempts=handler.max_attempts)
+
+
+def enqueue_many(name, payloads):
+    """Queue several tasks of the same type in one INSERT."""
+    handler = get_handler(name)
+    payloads = list(payloads)
+    if getattr(settings, 'TASKS_EAGER', False):
+        if payloads:
+            _call(handler, payloads)
+        return []
+    now = timezone.now()
+    return Task.objects.bulk_create(
+        [Task(name=name, payload=payload, run_at=now, max_attempts=handler.max_attempts) for payload in payloads]
+    )
+
+
+def _call(handler, payloads):
+    if handler.batch:
+        handler.func(payloads)
+    else:
+        for payload in payloads:
+            handler.func(**payload)
+
+
+def backoff_delay(attempts):
+    """Exponential backoff with jitter: ~base, 2*base, 4*base... capped."""
+    base = getattr(settings, 'TASKS_BACKOFF_BASE', 5)
+    cap = getattr(settings, 'TASKS_BACKOFF_MAX', 3600)
+    delay = min(cap, base * (2 ** max(attempts - 1, 0)))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim(worker_id, batch_size=10):
+    """
+    Claim up to `batch_size` due tasks sharing the same name.
+
+    Returns a (possibly empty) list of Task rows now marked running.
+    """
+    now = timezone.now()
+    due = Task.objects.filter(status=Task.PENDING, run_at__lte=now).order_by('run_at', 'id')
+    token = f'{worker_id}:{uuid.uuid4().hex[:12]}'
+
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            head = due.select_for_update(skip_locked=True).values_list('name', flat=True).first()
+            if head is None:
+                return []
+            ids = list(
+                due.filter(name=head).select_for_update(skip_locked=True).values_list('pk', flat=True)[:batch_size]
+            )
+            Task.objects.filter(pk__in=ids).update(
+                status=Task.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+            )
+    else:
+        with _claim_lock:
+            head = due.values_list('name', flat=True).first()
+            if head is None:
+                return []
+            ids = list(due.filter(name=head).values_list('pk', flat=True)[:batch_size])
+            # Another process may have grabbed some of these; only rows still pending are ours.
+            Task.objects.filter(pk__in=ids, status=Task.PENDING).update(
+                status=Task.RUNNING, locked_by=token, locked_at=now, attempts=F('attempts') + 1,
+            )
+    return list(Task.objects.filter(locked_by=token, status=Task.RUNNING).order_by('id'))
+
+
+def execute(tasks, metrics=None):
+    """Run a claimed batch. Successful tasks are deleted, failures retried with backoff."""
+    if not tasks:
+        return 0
+    name = tasks[0].name
+    ids = [t.pk for t in tasks]
+    started = time.perf_counter()
+    try:
+        handler = get_handler(name)
+        with transaction.atomic():
+            _call(handler, [t.payload for t in tasks])
+    except Exception as exc:
+        error = ''.join(traceback.format_exception(exc))[-4000:]
+        logger.warning('Task %s failed for ids %s: %s', name, ids, exc)
+        retried = failed = 0
+        for t in tasks:
+            if t.attempts >= t.max_attempts or isinstance(exc, UnknownTask):
+                Task.objects.filter(pk=t.pk).update(status=Task.FAILED, last_error=error, locked_by='')
+                failed += 1
+            else:
+                Task.objects.filter(pk=t.pk).update(
+                    status=Task.PENDING, last_error=error, locked_by='',
+                    run_at=timezone.now() + backoff_delay(t.attempts),
+                )
+                retried += 1
+        if metrics:
+            metrics.record(name, 0, retried, failed, time.perf_counter() - started)
+        return 0
+
+    Task.objects.filter(pk__in=ids).delete()
+    if metrics:
+        metrics.record(name, len(tasks), 0, 0, time.perf_counter() - started)
+    return len(tasks)
+
+
+def release_stale(timeout=None):
+    """
+    Put tasks back in the queue if their worker died mid-run. Returns how many were released.
+
+    Tasks that have used up their attempts are marked failed instead, so one
+    that kills its worker every time doesn't go round forever.
+    """
+    timeout = timeout or getattr(settings, 'TASKS_VISIBILITY_TIMEOUT', 600)
+    cutoff = timezone.now() - timedelta(seconds=timeout)
+    stale = Task.objects.filter(status=Task.RUNNING, locked_at__lt=cutoff)
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Task.FAILED, locked_by='', last_error='Worker timed out on the last attempt',
+    )
+    if failed:
+        logger.warning('Marked %s timed-out tasks failed after their last attempt', failed)
+    return stale.update(status=Task.PENDING, locked_by='', last_error='Released after worker timeout') + failed
+
+
+def run_pending(limit=None, batch_size=10, worker_id='inline'):
+    """Drain due tasks in the current thread. Returns how many succeeded."""
+    done = 0
+    claimed = 0
+    while limit is None or claimed < limit:
+        tasks = claim(worker_id, batch_size)
+        if not tasks:
+            break
+        claimed += len(tasks)
+        done += execute(tasks)
+    return done
+
+
+def queue_stats():
+    """Queue depth by name and status, e.g. {'notifications.deliver': {'pending': 3}}."""
+    stats = defaultdict(dict)
+    rows = Task.objects.order_by().values('name', 'status').annotate(total=Count('id'))
+    for row in rows:
+        stats[row['name']][row['status']] = row['total']
+    return dict(stats)
+
+
+@dataclass
+class WorkerMetrics:
+    """Per-process counters, reported periodically by run_worker."""
+    processed: dict = field(default_factory=lambda: defaultdict(int))
+    retried: dict = field(default_factory=lambda: defaultdict(int))
+    failed: dict = field(default_factory=lambda: defaultdict(int))
+    seconds: dict = field(default_factory=lambda: defaultdict(float))
+    batches: dict = field(default_factory=lambda: defaultdict(int))
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def record(self, name, processed, retried, failed, seconds):
+        with self.lock:
+            self.processed[name] += processed
+            self.retried[name] += retried
+            self.failed[name] += failed
+            self.seconds[name] += seconds
+            self.batches[name] += 1
+
+    def summary(self):
+        with self.lock:
+            return {
+                name: {
+                    'processed': self.processed[name],
+                    'retried': self.retried[name],
+                    'failed': self.failed[name],
+                    'batches': self.batches[name],
+                    'avg_batch_ms': round(1000 * self.seconds[name] / self.batches[name], 2),
+                }
+                for name in self.batches
+            }
+
+
+class Worker:
+    """Polls the queue and runs claimed batches until stopped."""
+
+    def __init__(self, worker_id, batch_size=10, poll_interval=1.0, metrics=None, stop_event=None):
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.metrics = metrics or WorkerMetrics()
+        self.stop_event = stop_event or threading.Event()
+
+    def run_once(self):
+        """Claim and run one batch. Returns the number of tasks claimed."""
+        close_old_connections()
+        tasks = claim(self.worker_id, self.batch_size)
+        execute(tasks, self.metrics)
+        return len(tasks)
+
+    def run(self, drain=False):
+        while not self.stop_event.is_set():
+            try:
+                claimed = self.run_once()
+            except Exception:
+                logger.exception('Worker %s hit an error while polling', self.worker_id)
+                claimed = 0
+            if not claimed:
+                if drain:
+                    break
+                self.stop_event.wait(self.poll_interval)
+        connection.close()
@@ -0,0 +1,100 @@
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import Task
+from .queue import claim, enqueue, enqueue_many, execute, release_stale, run_pending, task
+
+calls = []
+
+
+@task('tests.record')
+def record(value):
+    calls.append(value)
+
+
+@task('tests.record_batch', batch=True)
+def record_batch(payloads):
+    calls.append(sorted(p['value'] for p in payloads))
+
+
+@task('tests.flaky', max_attempts=2)
+def flaky(value):
+    raise RuntimeError('boom')
+
+
+class TaskQueueTest(TestCase):
+    """Test enqueueing, claiming and running tasks."""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a queued task runs once and is removed."""
+        enqueue('tests.record', {'value': 1})
+        self.assertEqual(Task.objects.count(), 1)
+        self.assertEqual(run_pending(), 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(Task.objects.count(), 0)
+
+    def test_same_type_tasks_are_batched(self):
+        """Test batch handlers get all claimed payloads in one call."""
+        enqueue_many('tests.record_batch', [{'value': i} for i in range(3)])
+        enqueue('tests.record', {'value': 'single'})
+        run_pending(batch_size=10)
+        self.assertIn([0, 1, 2], calls)
+        self.assertIn('single', calls)
+
+    def test_claimed_tasks_are_not_claimed_twice(self):
+        """Test a second worker can't claim tasks that are already running."""
+        enqueue('tests.record', {'value': 1})
+        first = claim('worker-a')
+        second = claim('worker-b')
+        self.assertEqual(len(first), 1)
+        self.assertEqual(second, [])
+        self.assertEqual(first[0].status, Task.RUNNING)
+
+    def test_failures_back_off_then_fail(self):
+        """Test failing tasks are retried later and marked failed after max_attempts."""
+        enqueue('tests.flaky', {'value': 1})
+        execute(claim('worker'))
+        queued = Task.objects.get()
+        self.assertEqual(queued.status, Task.PENDING)
+        self.assertGreater(queued.run_at, timezone.now())
+        self.assertIn('boom', queued.last_error)
+
+        Task.objects.update(run_at=timezone.now())
+        execute(claim('worker'))
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_stale_tasks_released_until_out_of_attempts(self):
+        """Test tasks whose worker died go back in the queue, and fail once their attempts are used up."""
+        enqueue('tests.flaky', {'value': 1})
+        claim('worker')
+        self.assertEqual(release_stale(timeout=-1), 1)
+        self.assertEqual(Task.objects.get().status, Task.PENDING)
+
+        claim('worker')
+        self.assertEqual(release_stale(timeout=-1), 1)
+        self.assertEqual(Task.objects.get().status, Task.FAILED)
+
+    def test_worker_releases_stale_tasks_without_metrics(self):
+        """Test run_worker releases stale tasks on its own timer, with metric reports off."""
+        with mock.patch('taskqueue.management.commands.run_worker.release_stale', return_value=2) as release:
+            out = StringIO()
+            call_command('run_worker', '--once', '--threads', '0', '--metrics-interval', '0', stdout=out)
+            release.assert_called_once_with()
+            self.assertIn('"released_stale": 2', out.getvalue())
+
+            call_command('run_worker', '--once', '--threads', '0', '--stale-interval', '0', stdout=StringIO())
+            release.assert_called_once_with()
+
+    @override_settings(TASKS_EAGER=True)
+    def test_eager_mode_runs_inline(self):
+        """Test TASKS_EAGER runs handlers without touching the queue."""
+        enqueue('tests.record', {'value': 'now'})
+        self.assertEqual(calls, ['now'])
+        self.assertEqual(Task.objects.count(), 0)
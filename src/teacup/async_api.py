@@ -0,0 +1,128 @@
+"""
+Shared plumbing for the async read endpoints (feed/async_views.py etc.).
+
+DRF views are sync-only, so under ASGI every DRF request is handed to a
+single worker thread. The hot read endpoints have plain async twins instead:
+they authenticate with the API's own authentication classes, run their
+independent queries at the same time and only serialize once everything is
+loaded. Writes and anything else on the same URL still go to the DRF view.
+
+The async twins are routed in front of the DRF ones when ASYNC_READ_VIEWS is
+on, which teacup/asgi.py does by default.
+"""
+import asyncio
+import functools
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from .throttling import callback_scope, client_ident, take, throttled_response
+
+
+def drf_request(request):
+    """Wrap a Django request the same way a DRF view would (no DB access yet)."""
+    return Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+
+
+async def authenticate(request):
+    """Return (drf_request, user); raises AuthenticationFailed for bad credentials."""
+    wrapped = drf_request(request)
+    user = await sync_to_async(lambda: wrapped.user)()
+    return wrapped, user
+
+
+async def gather_queries(*funcs):
+    """
+    Run sync ORM callables at the same time and return their results in order.
+
+    Each runs in a worker thread from the loop's (bounded) executor, which
+    keeps its own database connection between requests. With
+    ASYNC_PARALLEL_QUERIES off (tests, where data only exists inside the test
+    transaction) they run one after another on the request's thread instead.
+    """
+    if not settings.ASYNC_PARALLEL_QUERIES:
+        return [await sync_to_async(func)() for func in funcs]
+    return await asyncio.gather(*(sync_to_async(func, thread_sensitive=False)() for func in funcs))
+
+
+def error(detail, status):
+    return JsonResponse({'detail': detail}, status=status)
+
+
+def not_authenticated(request):
+    """The same 401/403 DRF's IsAuthenticated gives for an anonymous request."""
+    response = error('Authentication credentials were not provided.', 403)
+    header = request.authenticators[0].authenticate_header(request) if request.authenticators else None
+    if header:
+        response.status_code = 401
+        response['WWW-Authenticate'] = header
+    return response
+
+
+def async_reads(sync_view):
+    """
+    Decorate an async GET handler so other methods (and ?format=) fall through to `sync_view`.
+
+    GETs draw from the same throttle bucket the DRF view would use.
+
+        @async_reads(PostViewSet.as_view({...}))
+        async def post_detail(request, pk): ...
+    """
+    sync_handler = sync_to_async(sync_view)
+
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def view(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD') or 'format' in request.GET:
+                return await sync_handler(request, *args, **kwargs)
+            scope = callback_scope(request, sync_view)
+            if scope is not None:
+                wait = await sync_to_async(take)(scope, client_ident(request))
+                if wait:
+                    return throttled_response(wait)
+            try:
+                return await handler(request, *args, **kwargs)
+            except AuthenticationFailed as exc:
+                return error(str(exc.detail), 401)
+        view.csrf_exempt = getattr(sync_view, 'csrf_exempt', False)
+        view.throttled_view = sync_view
+        return view
+    return decorator
+
+
+async def paginate(request, queryset, pagination_class):
+    """
+    Page-number pagination matching `pagination_class`'s response shape.
+
+    The COUNT and the page itself are fetched concurrently. Returns
+    (page_items, envelope) where envelope still needs its 'results'.
+    """
+    paginator = pagination_class()
+    try:
+        page_size = int(request.query_params.get(paginator.page_size_query_param, paginator.page_size))
+        page_size = max(1, min(page_size, paginator.max_page_size))
+    except (TypeError, ValueError):
+        page_size = paginator.page_size
+    try:
+        number = max(1, int(request.query_params.get(paginator.page_query_param, 1)))
+    except ValueError:
+        number = 1
+    offset = (number - 1) * page_size
+    count, items = await gather_queries(queryset.count, lambda: list(queryset[offset:offset + page_size]))
+    if not items and number > 1:
+        return None, None
+
+    url = request.build_absolute_uri()
+    next_url = replace_query_param(url, paginator.page_query_param, number + 1) if offset + page_size < count else None
+    if number == 1:
+        previous_url = None
+    elif number == 2:
+        previous_url = remove_query_param(url, paginator.page_query_param)
+    else:
+        previous_url = replace_query_param(url, paginator.page_query_param, number - 1)
+    return items, {'count': count, 'next': next_url, 'previous': previous_url}
@@ -0,0 +1,196 @@
+"""
+POST /api/v1/batch/: several API calls in one round trip.
+
+    {"requests": [
+        {"method": "GET", "path": "/api/v1/feed/my_feed/?page=2"},
+        {"method": "POST", "path": "/api/v1/posts/12/like/"},
+        {"id": "author", "path": "/api/v1/users/7/"}
+    ], "parallel": true}
+
+Each sub-request is built from the batch request (same headers, cookies and
+session), resolved through the normal URLconf and handed to the view it
+resolves to, exactly as if it had come in on its own, with the same
+permissions, validation and throttling: every sub-request draws from its own
+scope's bucket, and the envelope itself isn't charged. Authentication runs
+once, for the batch; sub-requests are handed the resulting user. They also
+share the per-request memos, so author cards and the viewer's block list are
+looked up once for the whole batch.
+
+Responses come back in order as {"id", "status", "headers", "body"}. A
+sub-request failing doesn't stop the others, and the batch isn't a
+transaction: writes that succeeded stay.
+
+Sub-requests run one after another. With "parallel": true (and
+BATCH_PARALLEL on) each run of consecutive GETs goes to a small thread pool
+at once, which helps when they're waiting on the database; writes always
+wait for what came before them.
+"""
+import io
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import close_old_connections
+from django.urls import Resolver404, resolve
+from rest_framework import permissions, serializers, status
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+logger = logging.getLogger(__name__)
+
+PREFIX = '/api/v1/'
+METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE')
+# Per-request memos (users/cards.py, users/blocks.py) handed from one sub-request to the next
+SHARED_ATTRS = ('_author_cards', '_exclusions')
+# Response headers worth passing back
+HEADERS = ('Location', 'Retry-After', 'WWW-Authenticate')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class SubRequestSerializer(serializers.Serializer):
+    id = serializers.CharField(required=False, max_length=100)
+    method = serializers.ChoiceField(choices=METHODS, default='GET')
+    path = serializers.CharField(max_length=2000)
+    body = serializers.JSONField(required=False)
+
+    def validate_path(self, value):
+        if not value.startswith(PREFIX):
+            raise serializers.ValidationError(f'Paths must start with {PREFIX}.')
+        return value
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = SubRequestSerializer(many=True, allow_empty=False)
+    parallel = serializers.BooleanField(default=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f'At most {settings.BATCH_MAX_REQUESTS} requests per batch.')
+        return value
+
+
+def _executor_for_batches():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(settings.BATCH_MAX_WORKERS, thread_name_prefix='batch')
+        return _executor
+
+
+def build_request(outer, spec, user):
+    """A Django request for one sub-request, carrying the batch request's headers, session and user."""
+    url = urlsplit(spec['path'])
+    body = b'' if spec.get('body') is None else json.dumps(spec['body']).encode()
+    environ = {
+        key: value for key, value in outer.META.items()
+        if not key.startswith('wsgi.') and key not in ('CONTENT_TYPE', 'CONTENT_LENGTH')
+    }
+    environ.update({
+        'REQUEST_METHOD': spec['method'],
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        # The envelope is JSON, so its parts are too (not the browsable API)
+        'HTTP_ACCEPT': 'application/json',
+        'wsgi.input': io.BytesIO(body),
+    })
+    request = WSGIRequest(environ)
+    request.session = getattr(outer, 'session', None)
+    request.user = user
+    return request
+
+
+def run_one(request, user, auth, shared):
+    """Dispatch one sub-request; returns its entry for the envelope."""
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return status.HTTP_404_NOT_FOUND, {}, {'detail': 'Not found.'}
+    # Async twins (teacup/async_api.py) know their DRF view; run that here
+    view = getattr(match.func, 'throttled_view', match.func)
+    if getattr(view, 'view_class', None) is BatchView:
+        return status.HTTP_400_BAD_REQUEST, {}, {'detail': 'Batches cannot be nested.'}
+
+    if user.is_authenticated:
+        # DRF's Request skips the authenticators when these are set (the same hook its test client uses).
+        # Anonymous requests still go through them, for the same 401s as outside a batch.
+        request._force_auth_user = user
+        request._force_auth_token = auth
+    for name, value in shared.items():
+        setattr(request, name, value)
+    try:
+        response = view(request, *match.args, **match.kwargs)
+        if hasattr(response, 'render'):
+            response.render()
+    except Exception:
+        logger.exception('Batched %s %s failed', request.method, request.get_full_path())
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {}, {'detail': 'Server error.'}
+    for name in SHARED_ATTRS:
+        if name not in shared and hasattr(request, name):
+            shared[name] = getattr(request, name)
+
+    headers = {name: response[name] for name in HEADERS if response.has_header(name)}
+    if response.streaming:
+        response.close()
+        return response.status_code, headers, {'detail': 'Streaming responses are not returned in batches.'}
+    body = response.content.decode(response.charset or 'utf-8')
+    if response.get('Content-Type', '').startswith('application/json') and body:
+        body = json.loads(body)
+    return response.status_code, headers, body
+
+
+def _run_in_thread(request, user, auth, shared):
+    try:
+        return run_one(request, user, auth, shared)
+    finally:
+        close_old_connections()
+
+
+def groups(specs, parallel):
+    """Split sub-requests into runs that may go at once: consecutive GETs if parallel, else one each."""
+    runs = []
+    for index, spec in enumerate(specs):
+        if parallel and spec['method'] == 'GET' and runs and specs[runs[-1][-1]]['method'] == 'GET':
+            runs[-1].append(index)
+        else:
+            runs.append([index])
+    return runs
+
+
+class BatchView(APIView):
+    """Several API calls in one request (see module docstring)."""
+    permission_classes = [permissions.AllowAny]
+    # Only the sub-requests count against the rate limits
+    throttle_classes = []
+
+    def post(self, request):
+        serializer = BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        specs = serializer.validated_data['requests']
+        parallel = serializer.validated_data['parallel'] and settings.BATCH_PARALLEL
+        # Authenticate once; every sub-request gets the result
+        user, auth = request.user, request.auth
+        shared = {'_author_cards': {}}
+
+        results = [None] * len(specs)
+        for run in groups(specs, parallel):
+            built = [build_request(request._request, specs[index], user) for index in run]
+            if len(run) == 1:
+                results[run[0]] = run_one(built[0], user, auth, shared)
+                continue
+            executor = _executor_for_batches()
+            futures = [executor.submit(_run_in_thread, sub, user, auth, shared) for sub in built]
+            for index, future in zip(run, futures):
+                results[index] = future.result()
+
+        return Response({'responses': [
+            {'id': spec.get('id', str(index)), 'status': code, 'headers': headers, 'body': body}
+            for index, (spec, (code, headers, body)) in enumerate(zip(specs, results))
+        ]})
@@ -0,0 +1,103 @@
+"""
+Dirty-field tracking: remember the values a model instance was loaded with,
+so a save only writes the columns that actually changed.
+
+Our own models mix in SaveChangesMixin: a plain save() on a loaded instance
+becomes save(update_fields=<changed fields>), plus any auto_now fields so
+updated_at still moves, and a save with nothing changed is skipped entirely
+(no query, no post_save). Models we don't own (User) are registered with
+track_changes() and saved through save_changes().
+
+post_save receivers see the narrowed update_fields, so the ones that only
+care about some columns (card invalidation, tag indexing) can return early.
+"""
+from django.db.models.signals import post_init, post_save
+
+LOADED_ATTR = '_loaded_values'
+
+
+def snapshot(instance, fields=None):
+    """Record the current values as the saved state (all loaded fields, or just `fields`)."""
+    values = instance.__dict__
+    saved = instance.__dict__.setdefault(LOADED_ATTR, {})
+    for field in instance._meta.concrete_fields:
+        if fields is not None and field.name not in fields and field.attname not in fields:
+            continue
+        if field.attname in values:
+            saved[field.attname] = values[field.attname]
+
+
+def changed_fields(instance):
+    """Names of the fields whose value differs from when the instance was loaded or last saved."""
+    values = instance.__dict__
+    saved = values.get(LOADED_ATTR, {})
+    changed = set()
+    for field in instance._meta.concrete_fields:
+        if field.primary_key or field.attname not in values:
+            continue  # deferred and never touched
+        if field.attname not in saved or values[field.attname] != saved[field.attname]:
+            changed.add(field.name)
+    return changed
+
+
+def auto_now_fields(instance):
+    return {field.name for field in instance._meta.concrete_fields if getattr(field, 'auto_now', False)}
+
+
+def save_changes(instance, exclude=(), **kwargs):
+    """
+    save() just the changed fields of a loaded instance; returns False (no query) when nothing changed.
+
+    New instances are saved normally. `exclude` names fields never written
+    this way.
+    """
+    if instance._state.adding:
+        instance.save(**kwargs)
+        return True
+    changed = changed_fields(instance) - set(exclude)
+    if not changed:
+        return False
+    instance.save(update_fields=changed | auto_now_fields(instance), **kwargs)
+    return True
+
+
+class SaveChangesMixin:
+    """Model mixin: plain save() calls only write changed fields, and no-op saves are skipped."""
+    # Fields a plain save() never writes back, e.g. counters maintained with UPDATE ... F()
+    untracked_fields = frozenset()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        snapshot(instance)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+        snapshot(self, fields)
+
+    def save(self, *args, **kwargs):
+        if self._state.adding or args or kwargs.get('update_fields') is not None or kwargs.get('force_insert'):
+            super().save(*args, **kwargs)
+        else:
+            changed = changed_fields(self) - self.untracked_fields
+            if not changed:
+                return
+            kwargs['update_fields'] = changed | auto_now_fields(self)
+            super().save(*args, **kwargs)
+        snapshot(self, kwargs.get('update_fields'))
+
+
+def _snapshot_on_init(sender, instance, **kwargs):
+    snapshot(instance)
+
+
+def _snapshot_on_save(sender, instance, update_fields=None, **kwargs):
+    snapshot(instance, update_fields)
+
+
+def track_changes(*models):
+    """Track loaded values for models we can't add SaveChangesMixin to (e.g. auth.User)."""
+    for model in models:
+        post_init.connect(_snapshot_on_init, sender=model, weak=False)
+        post_save.connect(_snapshot_on_save, sender=model, weak=False)
@@ -0,0 +1,158 @@
+"""
+Sparse fieldsets: ?fields=, ?omit= and ?expand= on read endpoints.
+
+    ?fields=id,content,author   only these top-level fields
+    ?omit=comments,is_liked     everything but these
+    ?expand=author              nested objects to keep as objects; the others
+                                collapse to their id (or disappear when they
+                                have none, like a post's comments)
+
+Without ?expand every nested object stays expanded, so responses only change
+for clients that ask. Only the top-level object (or each item of a list) is
+pruned; nested objects keep their own fields.
+
+Serializers opt in with SparseFieldsMixin and say in Meta which fields are
+nested objects (`expandable`, field -> id attribute or None) and which
+select_related/prefetch_related lookups feed them (`relations`). Viewsets
+with SparseViewMixin pass their querysets through sparse_queryset(), which
+drops the lookups of fields that won't be shown and loads only the columns
+that will be, so a slim request does less work rather than just returning
+less. Method fields
+say which columns they read in Meta `method_columns`. Foreign key columns are
+always loaded (they're small, and block filtering and permission checks use
+them), and so are the model's default ordering fields.
+
+Only GETs are pruned; writes validate and answer with the full serializer.
+"""
+from django.core.exceptions import FieldDoesNotExist
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+
+def _names(value):
+    return {name.strip() for name in value.split(',') if name.strip()}
+
+
+class FieldSelection:
+    """What a request's ?fields=, ?omit= and ?expand= ask for."""
+
+    def __init__(self, fields=None, omit=(), expand=None):
+        self.fields = fields
+        self.omit = set(omit)
+        self.expand = expand
+
+    @classmethod
+    def from_request(cls, request):
+        """The request's selection, or None when it takes the full representation."""
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        params = getattr(request, 'query_params', request.GET)
+        fields, omit, expand = (params.get(name) for name in ('fields', 'omit', 'expand'))
+        if not fields and not omit and expand is None:
+            return None
+        return cls(_names(fields) if fields else None, _names(omit or ''), None if expand is None else _names(expand))
+
+    def keeps(self, name):
+        return (self.fields is None or name in self.fields) and name not in self.omit
+
+    def expands(self, name):
+        return self.expand is None or name in self.expand
+
+
+def wants_field(request, name, expanded=False):
+    """Whether responses to `request` show the top-level field `name` (as a nested object, if `expanded`)."""
+    selection = FieldSelection.from_request(request)
+    if selection is None:
+        return True
+    return selection.keeps(name) and (not expanded or selection.expands(name))
+
+
+def _meta(serializer_class, name):
+    return getattr(getattr(serializer_class, 'Meta', None), name, {})
+
+
+class SparseFieldsMixin:
+    """Serializer mixin: prune the top-level fields to the request's FieldSelection."""
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if not self._is_top_level():
+            return fields
+        selection = FieldSelection.from_request(self.context.get('request'))
+        if selection is None:
+            return fields
+        expandable = _meta(type(self), 'expandable')
+        for name, field in list(fields.items()):
+            if field.write_only:
+                continue
+            if not selection.keeps(name):
+                del fields[name]
+            elif name in expandable and not selection.expands(name):
+                if expandable[name] is None:
+                    del fields[name]
+                else:
+                    fields[name] = serializers.ReadOnlyField(source=expandable[name])
+        return fields
+
+    def _is_top_level(self):
+        parent = self.parent
+        return parent is None or (isinstance(parent, serializers.ListSerializer) and parent.parent is None)
+
+
+def shown_fields(serializer_class, selection):
+    """(kept field names, the kept ones shown expanded, all the serializer's fields) for a selection."""
+    declared = serializer_class().fields
+    kept = {name for name, field in declared.items() if not field.write_only and selection.keeps(name)}
+    expandable = _meta(serializer_class, 'expandable')
+    expanded = {name for name in kept if name not in expandable or selection.expands(name)}
+    return kept, expanded, declared
+
+
+def sparse_queryset(queryset, serializer_class, request):
+    """
+    `queryset` trimmed to what the request's fields need: no joins or prefetches
+    for fields that aren't shown expanded, and only the columns that are read.
+    """
+    selection = FieldSelection.from_request(request)
+    if selection is None or not issubclass(serializer_class, SparseFieldsMixin):
+        return queryset
+    kept, expanded, declared = shown_fields(serializer_class, selection)
+    relations = _meta(serializer_class, 'relations')
+    select, prefetch = [], []
+    for name, (kind, lookup) in relations.items():
+        if name in expanded:
+            (select if kind == 'select' else prefetch).append(lookup)
+    if relations:
+        queryset = queryset.select_related(None).prefetch_related(None)
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+    if select:
+        return queryset  # only() can't defer a joined relation's columns by name; keep them all
+
+    model = queryset.model
+    columns = {model._meta.pk.attname}
+    columns |= {field.attname for field in model._meta.concrete_fields if field.is_relation}
+    columns |= {name.lstrip('-') for name in model._meta.ordering}
+    method_columns = _meta(serializer_class, 'method_columns')
+    expandable = _meta(serializer_class, 'expandable')
+    for name in kept:
+        if name in method_columns:
+            columns.update(method_columns[name])
+            continue
+        source = expandable.get(name) if name not in expanded else declared[name].source
+        try:
+            field = model._meta.get_field((source or '').split('.')[0])
+        except FieldDoesNotExist:
+            continue  # computed, or a reverse relation
+        if field.concrete:
+            columns.add(field.attname)
+    return queryset.only(*columns)
+
+
+class SparseViewMixin:
+    """Viewset mixin: trim filter_queryset()'s result (so lists and get_object()) with sparse_queryset()."""
+
+    def filter_queryset(self, queryset):
+        return sparse_queryset(super().filter_queryset(queryset), self.get_serializer_class(), self.request)
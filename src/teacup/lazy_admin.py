@@ -0,0 +1,44 @@
+"""
+The Django admin without its import-time autodiscover.
+
+The stock admin app imports every app's admin.py (and with it the admin's
+forms, widgets and auth admin) while the worker boots, although almost no
+request ever goes near /admin/. Here the admin.py modules are only imported
+the first time the admin URLs are resolved or reversed, or when the system
+checks run.
+"""
+from django.contrib.admin import autodiscover, site
+from django.contrib.admin.apps import SimpleAdminConfig
+from django.contrib.admin.checks import check_admin_app, check_dependencies
+from django.core import checks
+from django.utils.functional import cached_property
+
+
+def check_admin(app_configs, **kwargs):
+    autodiscover()
+    return check_admin_app(app_configs, **kwargs)
+
+
+class LazyAdminConfig(SimpleAdminConfig):
+    """Use in INSTALLED_APPS instead of 'django.contrib.admin', together with admin_urls()."""
+
+    def ready(self):
+        checks.register(check_dependencies, checks.Tags.admin)
+        checks.register(check_admin, checks.Tags.admin)
+
+
+class AdminURLConf:
+    """Stands in for the admin's URLconf module; autodiscovers when its patterns are first needed."""
+
+    def __init__(self, admin_site):
+        self.admin_site = admin_site
+
+    @cached_property
+    def urlpatterns(self):
+        autodiscover()
+        return self.admin_site.get_urls()
+
+
+def admin_urls(admin_site=site):
+    """Lazy drop-in for `admin.site.urls`: path('admin/', admin_urls())."""
+    return AdminURLConf(admin_site), 'admin', admin_site.name
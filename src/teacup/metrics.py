@@ -0,0 +1,132 @@
+"""
+Per-process request metrics: latency and database time of recent requests.
+
+RequestMetricsMiddleware times every request, and a query wrapper installed
+on each database connection adds up the time spent in SQL for the request
+it runs in (a context variable, so it follows the request into
+sync_to_async threads). The last REQUEST_METRICS_WINDOW seconds are kept in
+memory; the adaptive throttles (teacup/throttling.py) read their p95.
+"""
+import contextvars
+import threading
+import time
+from collections import deque
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+# Too few samples make for a meaningless p95
+MIN_SAMPLES = 20
+MAX_SAMPLES = 10_000
+
+_db_time = contextvars.ContextVar('request_db_time', default=None)
+
+
+class RequestMetrics:
+    """A time-bounded window of (latency, db time) samples, in seconds."""
+
+    def __init__(self, window=None):
+        self.window = window
+        self._samples = deque(maxlen=MAX_SAMPLES)
+        self._lock = threading.Lock()
+
+    def record(self, latency, db_time, now=None):
+        with self._lock:
+            self._samples.append((now or time.monotonic(), latency, db_time))
+
+    def _recent(self):
+        window = settings.REQUEST_METRICS_WINDOW if self.window is None else self.window
+        cutoff = time.monotonic() - window
+        with self._lock:
+            while self._samples and self._samples[0][0] < cutoff:
+                self._samples.popleft()
+            return list(self._samples)
+
+    def percentiles(self, p=95):
+        """(latency, db time) at the p-th percentile, or None without enough recent samples."""
+        samples = self._recent()
+        if len(samples) < MIN_SAMPLES:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * p / 100))
+        return (sorted(s[1] for s in samples)[index], sorted(s[2] for s in samples)[index])
+
+    def summary(self):
+        samples = self._recent()
+        p95 = self.percentiles(95)
+        return {
+            'requests': len(samples),
+            'p95_ms': round(p95[0] * 1000, 1) if p95 else None,
+            'db_p95_ms': round(p95[1] * 1000, 1) if p95 else None,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._samples.clear()
+
+
+request_metrics = RequestMetrics()
+
+
+def _time_query(execute, sql, params, many, context):
+    total = _db_time.get()
+    if total is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        total[0] += time.perf_counter() - started
+
+
+def _install(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+connection_created.connect(_install)
+for _connection in connections.all(initialized_only=True):
+    _install(_connection)
+
+
+class RequestMetricsMiddleware:
+    """Record every request's latency and database time (throttled 429s excepted)."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        total, token, started = self._start()
+        try:
+            response = self.get_response(request)
+        finally:
+            _db_time.reset(token)
+        self._finish(response, total, started)
+        return response
+
+    async def __acall__(self, request):
+        total, token, started = self._start()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _db_time.reset(token)
+        self._finish(response, total, started)
+        return response
+
+    def _start(self):
+        total = [0.0]
+        return total, _db_time.set(total), time.perf_counter()
+
+    def _finish(self, response, total, started):
+        # Shed requests are cheap by design; counting them would hide the load they shed
+        if response.status_code != 429:
+            request_metrics.record(time.perf_counter() - started, total[0])
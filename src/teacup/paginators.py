@@ -0,0 +1,60 @@
+"""
+Admin pagination that doesn't COUNT(*) big tables.
+
+The stock admin paginator counts every row of the changelist on every page
+view. EstimatedCountPaginator instead
+
+- takes the planner's row estimate (pg_class.reltuples) on PostgreSQL, or
+  the primary key range elsewhere (two index lookups on SQLite), when the
+  changelist isn't filtered, and only counts exactly below
+  ADMIN_EXACT_COUNT_LIMIT rows;
+- counts filtered/searched changelists up to ADMIN_EXACT_COUNT_LIMIT rows
+  and no further, so a broad filter costs a bounded scan at worst.
+
+Use it with `show_full_result_count = False`, otherwise the changelist runs
+an unfiltered COUNT(*) of its own for the "N total" link.
+"""
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Max, Min
+from django.utils.functional import cached_property
+
+
+def estimated_count(model, using='default'):
+    """Roughly how many rows `model`'s table has, without scanning it. None if unknown."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+            row = cursor.fetchone()
+        # -1 (or 0 on older servers) until the table has been vacuumed/analyzed
+        return row[0] if row and row[0] > 0 else None
+    bounds = model._base_manager.using(using).aggregate(low=Min('pk'), high=Max('pk'))
+    if bounds['high'] is None:
+        return 0
+    if not isinstance(bounds['high'], int):
+        return None
+    return bounds['high'] - bounds['low'] + 1
+
+
+def is_unfiltered(queryset):
+    """True if `queryset` has no filters beyond its model's default manager's own."""
+    base = queryset.model._default_manager.all()
+    return queryset.query.where == base.query.where and not queryset.query.distinct
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator for big admin changelists (see module docstring)."""
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        limit = settings.ADMIN_EXACT_COUNT_LIMIT
+        if is_unfiltered(queryset):
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > limit:
+                return estimate
+            return queryset.count()
+        # COUNT over a LIMITed subquery stops after `limit` matching rows
+        return queryset.order_by()[:limit].count()
@@ -40,7 +40,8 @@ ALLOWED_HOSTS = ['localhost', '127.0.0.1', '.herokuapp.com', '.railway.app', 'we
 # Application definition
 
 INSTALLED_APPS = [
-    'django.contrib.admin',
+    # The admin, minus importing every admin.py at boot (see teacup/lazy_admin.py)
+    'teacup.lazy_admin.LazyAdminConfig',
     'django.contrib.auth',
     'django.contrib.contenttypes',
     'django.contrib.sessions',
@@ -56,11 +57,18 @@ INSTALLED_APPS = [
     'users',
     'posts',
     'feed',
+    'taskqueue',
+    'notifications',
+    'apidocs',
+    'bulk',
 ]
 
 MIDDLEWARE = [
+    'teacup.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    # Before sessions/auth so an over-budget client costs no database work (teacup/throttling.py)
+    'teacup.throttling.ThrottleMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -101,6 +109,35 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared through Redis when REDIS_URL is set (needs the `redis` package),
+# otherwise a per-process memory cache which is fine for development.
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# How long pre-serialized author cards stay cached (see users/cards.py)
+AUTHOR_CARD_TIMEOUT = int(os.getenv('AUTHOR_CARD_TIMEOUT', '3600'))
+
+
+# Bearer token lifetimes and the per-process caches behind them (see users/tokens.py)
+AUTH_TOKEN_TTL = int(os.getenv('AUTH_TOKEN_TTL', '3600'))
+AUTH_REFRESH_TOKEN_TTL = int(os.getenv('AUTH_REFRESH_TOKEN_TTL', str(30 * 24 * 3600)))
+AUTH_PRINCIPAL_CACHE_SECONDS = int(os.getenv('AUTH_PRINCIPAL_CACHE_SECONDS', '60'))
+AUTH_REVOCATION_CACHE_SECONDS = int(os.getenv('AUTH_REVOCATION_CACHE_SECONDS', '30'))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -151,6 +188,22 @@ REST_FRAMEWORK = {
     'DEFAULT_SCHEMA_CLASS': 'drf_spectacular.openapi.AutoSchema',
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticatedOrReadOnly'],
+    # Bearer tokens first (stateless, see users/tokens.py); sessions stay for the browsable API and admin
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'users.tokens.BearerTokenAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+        'rest_framework.authentication.BasicAuthentication',
+    ],
+    # Token buckets per client and endpoint class (see teacup/throttling.py)
+    'DEFAULT_THROTTLE_CLASSES': ['teacup.throttling.BucketThrottle'],
+    'DEFAULT_THROTTLE_RATES': {
+        'read': os.getenv('THROTTLE_READ_RATE', '600/min'),
+        'write': os.getenv('THROTTLE_WRITE_RATE', '120/min'),
+        'search': os.getenv('THROTTLE_SEARCH_RATE', '120/min'),
+        'bulk': os.getenv('THROTTLE_BULK_RATE', '10/min'),
+    },
+    # Proxy hops in front of the app; X-Forwarded-For is client-supplied, so it's ignored unless set
+    'NUM_PROXIES': int(os.getenv('THROTTLE_NUM_PROXIES', '0')),
     # TODO: Add pagination settings here
 }
 
@@ -159,3 +212,98 @@ SPECTACULAR_SETTINGS = {
     'DESCRIPTION': 'Teacup – a minimal social media API built with Django REST Framework',
     'VERSION': '1.0.0',
 }
+
+# Write-behind buffering for likes on hot posts (see posts/likebuffer.py).
+# Off by default; likes go straight to the database.
+LIKE_WRITE_BEHIND = os.getenv('LIKE_WRITE_BEHIND', 'False').lower() == 'true'
+LIKE_BUFFER_DIR = Path(os.getenv('LIKE_BUFFER_DIR', BASE_DIR / 'var' / 'likes'))
+LIKE_BUFFER_BATCH_SIZE = int(os.getenv('LIKE_BUFFER_BATCH_SIZE', '500'))
+LIKE_BUFFER_FLUSH_INTERVAL = float(os.getenv('LIKE_BUFFER_FLUSH_INTERVAL', '1.0'))
+
+# Background task queue (see taskqueue/queue.py, run with `manage.py run_worker`).
+# TASKS_EAGER runs handlers inline at enqueue time instead of queueing them.
+TASKS_EAGER = os.getenv('TASKS_EAGER', 'False').lower() == 'true'
+TASKS_BACKOFF_BASE = int(os.getenv('TASKS_BACKOFF_BASE', '5'))
+TASKS_BACKOFF_MAX = int(os.getenv('TASKS_BACKOFF_MAX', '3600'))
+TASKS_VISIBILITY_TIMEOUT = int(os.getenv('TASKS_VISIBILITY_TIMEOUT', '600'))
+
+# Trending #hashtags window and how long the computed list is cached
+TAG_TRENDING_HOURS = int(os.getenv('TAG_TRENDING_HOURS', '24'))
+TAG_TRENDING_CACHE_SECONDS = int(os.getenv('TAG_TRENDING_CACHE_SECONDS', '60'))
+
+# Background deletion of accounts/posts (see users/deletion.py)
+DELETION_CHUNK_SIZE = int(os.getenv('DELETION_CHUNK_SIZE', '500'))
+DELETION_CHUNKS_PER_TASK = int(os.getenv('DELETION_CHUNKS_PER_TASK', '20'))
+
+# Username autocomplete index (see users/autocomplete.py)
+AUTOCOMPLETE_REFRESH_SECONDS = int(os.getenv('AUTOCOMPLETE_REFRESH_SECONDS', '300'))
+AUTOCOMPLETE_BACKGROUND_REFRESH = os.getenv('AUTOCOMPLETE_BACKGROUND_REFRESH', 'True').lower() == 'true'
+AUTOCOMPLETE_FOLLOWING_TIMEOUT = int(os.getenv('AUTOCOMPLETE_FOLLOWING_TIMEOUT', '300'))
+
+# How long a user's block/mute exclusion set stays cached (changes drop it straight away)
+BLOCKS_CACHE_SECONDS = int(os.getenv('BLOCKS_CACHE_SECONDS', '3600'))
+
+# Who-to-follow lists built by `manage.py build_suggestions` (see users/suggestions.py):
+# how many are stored per user, and how many of a user's follows are expanded
+FOLLOW_SUGGESTIONS_TOP_K = int(os.getenv('FOLLOW_SUGGESTIONS_TOP_K', '50'))
+FOLLOW_SUGGESTIONS_SEED_FOLLOWS = int(os.getenv('FOLLOW_SUGGESTIONS_SEED_FOLLOWS', '500'))
+
+# Memory-mapped follow graph snapshot written by `manage.py build_follow_graph` (see
+# users/graph.py); unset means follow lookups go to the database. Processes look for a
+# newer file every FOLLOW_GRAPH_CHECK_SECONDS and replay follows made since from the cache.
+FOLLOW_GRAPH_PATH = os.getenv('FOLLOW_GRAPH_PATH', '')
+if FOLLOW_GRAPH_PATH:
+    FOLLOW_GRAPH_PATH = str(BASE_DIR / FOLLOW_GRAPH_PATH)
+FOLLOW_GRAPH_CHECK_SECONDS = float(os.getenv('FOLLOW_GRAPH_CHECK_SECONDS', '10'))
+FOLLOW_GRAPH_MAX_DELTA = int(os.getenv('FOLLOW_GRAPH_MAX_DELTA', '100000'))
+FOLLOW_GRAPH_DELTA_TIMEOUT = int(os.getenv('FOLLOW_GRAPH_DELTA_TIMEOUT', str(24 * 3600)))
+
+# Live feed stream over SSE (see feed/events.py). Set a poll interval when running
+# more than one server process so streams see writes made by the others.
+FEED_STREAM_POLL_INTERVAL = float(os.getenv('FEED_STREAM_POLL_INTERVAL', '0'))
+FEED_STREAM_COUNT_DEBOUNCE = float(os.getenv('FEED_STREAM_COUNT_DEBOUNCE', '0.5'))
+FEED_STREAM_KEEPALIVE = int(os.getenv('FEED_STREAM_KEEPALIVE', '15'))
+FEED_STREAM_MAX_SECONDS = int(os.getenv('FEED_STREAM_MAX_SECONDS', '300'))
+FEED_STREAM_RETRY_MS = int(os.getenv('FEED_STREAM_RETRY_MS', '3000'))
+
+# How long a /feed/sync/ token stays usable (and deleted-post tombstones are kept)
+FEED_SYNC_MAX_AGE = int(os.getenv('FEED_SYNC_MAX_AGE', str(7 * 24 * 3600)))
+
+# Ranked /feed/for_you/ (see feed/ranking.py): candidates per ranking, how far back
+# they go, how fast recency decays, and how long a viewer's ranking is cached
+FEED_RANKED_MAX_CANDIDATES = int(os.getenv('FEED_RANKED_MAX_CANDIDATES', '3000'))
+FEED_RANKED_WINDOW_HOURS = int(os.getenv('FEED_RANKED_WINDOW_HOURS', '72'))
+FEED_RANKED_HALF_LIFE_HOURS = float(os.getenv('FEED_RANKED_HALF_LIFE_HOURS', '12'))
+FEED_RANKED_CACHE_SECONDS = int(os.getenv('FEED_RANKED_CACHE_SECONDS', '300'))
+
+# How long posts reported through /feed/seen/ stay hidden from the feeds (see feed/seen.py)
+SEEN_POSTS_TTL = int(os.getenv('SEEN_POSTS_TTL', str(14 * 24 * 3600)))
+# At most this many of a user's newest seen posts are excluded from the feed queries, as
+# literal ids sent with each query and its COUNT (older ones can come back, see feed/seen.py)
+SEEN_POSTS_EXCLUDE_MAX = int(os.getenv('SEEN_POSTS_EXCLUDE_MAX', '300'))
+
+# Async twins of the hot read endpoints (teacup/async_api.py). teacup/asgi.py turns
+# them on; under WSGI they'd only add an event loop per request.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False').lower() == 'true'
+ASYNC_PARALLEL_QUERIES = os.getenv('ASYNC_PARALLEL_QUERIES', 'True').lower() == 'true'
+
+# Where `manage.py build_schema` writes the prebuilt OpenAPI schema served at /api/schema/
+API_SCHEMA_DIR = Path(os.getenv('API_SCHEMA_DIR', BASE_DIR / 'var' / 'schema'))
+
+# Request latency/DB time kept for the last N seconds (teacup/metrics.py). With
+# THROTTLE_ADAPTIVE the throttle budgets shrink while the p95s are over these limits.
+REQUEST_METRICS_WINDOW = int(os.getenv('REQUEST_METRICS_WINDOW', '60'))
+THROTTLE_ADAPTIVE = os.getenv('THROTTLE_ADAPTIVE', 'False').lower() == 'true'
+THROTTLE_ADAPTIVE_P95_MS = float(os.getenv('THROTTLE_ADAPTIVE_P95_MS', '500'))
+THROTTLE_ADAPTIVE_DB_P95_MS = float(os.getenv('THROTTLE_ADAPTIVE_DB_P95_MS', '200'))
+THROTTLE_ADAPTIVE_MIN_FACTOR = float(os.getenv('THROTTLE_ADAPTIVE_MIN_FACTOR', '0.25'))
+THROTTLE_ADAPTIVE_INTERVAL = float(os.getenv('THROTTLE_ADAPTIVE_INTERVAL', '5'))
+
+# POST /api/v1/batch/ (teacup/batch.py): sub-requests per batch, and whether runs of
+# GETs may go to a thread pool of BATCH_MAX_WORKERS at once
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+BATCH_PARALLEL = os.getenv('BATCH_PARALLEL', 'True').lower() == 'true'
+BATCH_MAX_WORKERS = int(os.getenv('BATCH_MAX_WORKERS', '4'))
+
+# Admin changelists count rows exactly up to this many, and estimate beyond (teacup/paginators.py)
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', '100000'))
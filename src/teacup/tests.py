@@ -0,0 +1,217 @@
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from posts.models import Post
+from users.tokens import BearerTokenAuthentication, issue_tokens
+
+from . import batch, throttling
+from .metrics import request_metrics
+
+
+def rates(**overrides):
+    return {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_RATES': {
+        **settings.REST_FRAMEWORK['DEFAULT_THROTTLE_RATES'], **overrides,
+    }}
+
+
+@override_settings(REST_FRAMEWORK=rates(write='3/min', search='1/min'))
+class ThrottleTest(APITestCase):
+    """Test the token bucket throttles and the fast-fail middleware."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='hammer', password='testpass123')
+        self.post = Post.objects.create(content='Target', author=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_tokens(self.user)["access"]}')
+        self.like = reverse('post-like', kwargs={'pk': self.post.pk})
+        self.unlike = reverse('post-unlike', kwargs={'pk': self.post.pk})
+
+    def test_write_budget(self):
+        """Test writes past the budget get a 429 with Retry-After, while reads still pass."""
+        for url in (self.like, self.unlike, self.like):
+            self.assertNotEqual(self.client.post(url).status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        response = self.client.post(self.unlike)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        self.assertEqual(self.client.get(reverse('post-list')).status_code, status.HTTP_200_OK)
+
+    def test_fast_fail_skips_the_database(self):
+        """Test an over-budget client is turned away before any query runs."""
+        for url in (self.like, self.unlike, self.like):
+            self.client.post(url)
+        with self.assertNumQueries(0):
+            response = self.client.post(self.unlike)
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_buckets_are_per_client(self):
+        """Test one client's empty bucket doesn't affect another."""
+        for url in (self.like, self.unlike, self.like, self.unlike):
+            self.client.post(url)
+        other = User.objects.create_user(username='bystander', password='testpass123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_tokens(other)["access"]}')
+        self.assertEqual(self.client.post(self.like).status_code, status.HTTP_201_CREATED)
+
+    @override_settings(REST_FRAMEWORK=rates(read='2/min'))
+    def test_made_up_session_cookies_share_the_ip_bucket(self):
+        """Test a fresh random session cookie per request doesn't get a fresh bucket."""
+        self.client.credentials()
+        codes = []
+        for i in range(3):
+            self.client.cookies[settings.SESSION_COOKIE_NAME] = f'made-up-{i}'
+            codes.append(self.client.get(reverse('post-list')).status_code)
+        self.assertEqual(codes, [status.HTTP_200_OK] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    @override_settings(REST_FRAMEWORK=rates(read='2/min'))
+    def test_forwarded_for_doesnt_reset_the_bucket(self):
+        """Test a made-up X-Forwarded-For per request doesn't get a fresh bucket."""
+        self.client.credentials()
+        codes = [
+            self.client.get(reverse('post-list'), HTTP_X_FORWARDED_FOR=f'10.0.0.{i}').status_code
+            for i in range(3)
+        ]
+        self.assertEqual(codes, [status.HTTP_200_OK] * 2 + [status.HTTP_429_TOO_MANY_REQUESTS])
+
+    def test_search_scope(self):
+        """Test ?search= and autocomplete draw from the search budget."""
+        self.assertEqual(self.client.get(reverse('user-list'), {'search': 'ham'}).status_code, status.HTTP_200_OK)
+        response = self.client.get(reverse('user-autocomplete'), {'q': 'ham'})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.client.get(reverse('user-list')).status_code, status.HTTP_200_OK)
+
+    def test_bucket_refills(self):
+        """Test a refused request doesn't use a token and the bucket refills over time."""
+        for _ in range(3):
+            self.assertEqual(throttling.take('write', 'ip:test'), 0)
+        wait = throttling.take('write', 'ip:test')
+        self.assertTrue(0 < wait <= 20)
+        self.assertAlmostEqual(throttling.take('write', 'ip:test'), wait, delta=0.5)  # nothing was taken
+        cache.decr('throttle:write:ip:test', 20_000)  # pretend 20 seconds passed
+        self.assertEqual(throttling.take('write', 'ip:test'), 0)
+
+
+class AdaptiveThrottleTest(TestCase):
+    """Test budgets tighten while the request metrics look overloaded."""
+
+    def setUp(self):
+        request_metrics.clear()
+        throttling.reset_load_factor()
+        self.addCleanup(request_metrics.clear)
+        self.addCleanup(throttling.reset_load_factor)
+
+    def test_next_factor(self):
+        """Test multiplicative decrease under load and additive increase after."""
+        slow, fast = (2.0, 0.01), (0.05, 0.01)
+        with override_settings(THROTTLE_ADAPTIVE_P95_MS=500, THROTTLE_ADAPTIVE_MIN_FACTOR=0.25):
+            self.assertEqual(throttling.next_factor(1.0, slow), 0.5)
+            self.assertEqual(throttling.next_factor(0.25, slow), 0.25)
+            self.assertAlmostEqual(throttling.next_factor(0.5, fast), 0.6)
+            self.assertEqual(throttling.next_factor(1.0, fast), 1.0)
+            self.assertEqual(throttling.next_factor(0.5, (0.05, 0.3)), 0.25)  # DB time alone counts
+
+    @override_settings(THROTTLE_ADAPTIVE=True, THROTTLE_ADAPTIVE_INTERVAL=0, THROTTLE_ADAPTIVE_DB_P95_MS=1000)
+    def test_budgets_shrink_under_load(self):
+        """Test a slow p95 halves the bucket size."""
+        full, _ = throttling.limits('read')
+        for _ in range(50):
+            request_metrics.record(2.0, 0.1)
+        self.assertEqual(throttling.limits('read')[0], full // 2)
+
+    def test_metrics_middleware_records_db_time(self):
+        """Test requests are timed along with the SQL they run."""
+        user = User.objects.create_user(username='timed', password='testpass123')
+        for _ in range(20):
+            self.client.get(reverse('user-detail', kwargs={'pk': user.pk}))
+        latency, db_time = request_metrics.percentiles(95)
+        self.assertGreater(db_time, 0)
+        self.assertGreaterEqual(latency, db_time)
+
+
+@override_settings(BATCH_PARALLEL=False)
+class BatchTest(APITestCase):
+    """Test POST /batch/ runs several API calls in one request."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user(username='mobile', password='testpass123')
+        self.author = User.objects.create_user(username='author', password='testpass123')
+        self.post = Post.objects.create(content='Hello', author=self.author)
+        Post.objects.create(content='Me too', author=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {issue_tokens(self.user)["access"]}')
+        self.url = reverse('batch')
+
+    def batch(self, *requests, **extra):
+        response = self.client.post(self.url, {'requests': list(requests), **extra}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.data)
+        return response.data['responses']
+
+    def test_runs_in_order(self):
+        """Test sub-requests are dispatched in order, writes included, with one envelope back."""
+        with mock.patch('users.tokens.BearerTokenAuthentication.authenticate', autospec=True,
+                        side_effect=BearerTokenAuthentication.authenticate) as authenticate:
+            responses = self.batch(
+                {'path': '/api/v1/users/me/'},
+                {'id': 'like', 'method': 'POST', 'path': f'/api/v1/posts/{self.post.pk}/like/'},
+                {'path': f'/api/v1/posts/{self.post.pk}/'},
+                {'method': 'POST', 'path': f'/api/v1/posts/{self.post.pk}/add_comment/',
+                 'body': {'content': 'Batched', 'post': self.post.pk}},
+                {'path': '/api/v1/feed/discover/?page_size=1'},
+                {'path': '/api/v1/nowhere/'},
+            )
+        # Once for the batch, not per sub-request
+        self.assertEqual(authenticate.call_count, 1)
+        self.assertEqual([entry['id'] for entry in responses], ['0', 'like', '2', '3', '4', '5'])
+        self.assertEqual([entry['status'] for entry in responses], [200, 201, 200, 201, 200, 404])
+        self.assertEqual(responses[0]['body']['username'], 'mobile')
+        self.assertTrue(responses[2]['body']['is_liked'])
+        self.assertEqual(responses[3]['body']['content'], 'Batched')
+        self.assertEqual(len(responses[4]['body']['results']), 1)
+
+    def test_anonymous_and_errors(self):
+        """Test permissions still apply per sub-request and one failure doesn't stop the rest."""
+        self.client.credentials()
+        responses = self.batch(
+            {'path': '/api/v1/users/me/'},
+            {'method': 'POST', 'path': f'/api/v1/posts/{self.post.pk}/like/'},
+            {'path': f'/api/v1/posts/{self.post.pk}/'},
+            {'method': 'POST', 'path': '/api/v1/batch/', 'body': {'requests': []}},
+        )
+        self.assertEqual([entry['status'] for entry in responses], [401, 401, 200, 400])
+
+        for bad in ({'requests': []}, {'requests': [{'path': '/admin/'}]},
+                    {'requests': [{'path': '/api/v1/posts/', 'method': 'TRACE'}]}):
+            response = self.client.post(self.url, bad, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            response = self.client.post(self.url, {'requests': [{'path': '/api/v1/posts/'}] * 3}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(REST_FRAMEWORK=rates(write='2/min'))
+    def test_sub_requests_are_throttled(self):
+        """Test each sub-request draws from its own scope's bucket."""
+        like = {'method': 'POST', 'path': f'/api/v1/posts/{self.post.pk}/like/'}
+        unlike = {'method': 'POST', 'path': f'/api/v1/posts/{self.post.pk}/unlike/'}
+        responses = self.batch(like, unlike, like, {'path': '/api/v1/posts/'})
+        self.assertEqual([entry['status'] for entry in responses], [201, 200, 429, 200])
+        self.assertIn('Retry-After', responses[2]['headers'])
+
+    def test_shared_memo(self):
+        """Test author cards loaded by one sub-request are reused by the next."""
+        with mock.patch('users.cards.cache', wraps=cache) as card_cache:
+            self.batch({'path': '/api/v1/posts/'}, {'path': '/api/v1/feed/discover/'},
+                       {'path': f'/api/v1/posts/{self.post.pk}/comments/'})
+        self.assertEqual(card_cache.get_many.call_count, 1)
+
+    def test_groups(self):
+        """Test only runs of consecutive GETs are grouped, and only when asked to."""
+        specs = [{'method': method} for method in ('GET', 'GET', 'POST', 'GET', 'DELETE', 'GET', 'GET', 'GET')]
+        self.assertEqual(batch.groups(specs, True), [[0, 1], [2], [3], [4], [5, 6, 7]])
+        self.assertEqual(batch.groups(specs, False), [[index] for index in range(8)])
@@ -0,0 +1,248 @@
+"""
+Token bucket throttles shared through the cache.
+
+Every endpoint belongs to a throttle scope with its own budget in
+REST_FRAMEWORK['DEFAULT_THROTTLE_RATES']:
+
+    read    GETs                              (default)
+    write   everything else                   (default)
+    search  ?search= lists, autocomplete      throttle_scope = 'search'
+    bulk    exports, imports                  throttle_scope = 'bulk'
+
+A view or @action opts into another scope with `throttle_scope`. A rate of
+'600/min' means a bucket of 600 tokens refilling at 10 a second. The calls
+inside a /batch/ request (teacup/batch.py) each count in their own scope;
+the batch itself doesn't.
+
+Each (scope, client) bucket is one integer in the cache, its "theoretical
+arrival time" (GCRA): every request adds one refill interval to it with an
+atomic incr, and the request is refused while that runs more than a full
+bucket ahead of the clock. Refused requests give their token back. So a
+check is one incr and works across processes with Redis.
+
+Clients are told apart by the user id in a bearer token, else the user
+their session resolved to, else the IP address. A session cookie alone
+counts for nothing: anyone can make up a new one per request. The bearer
+token and the IP need no database, which lets ThrottleMiddleware turn away a
+client whose bucket is empty with a 429 and Retry-After before sessions,
+authentication or views run (session users aren't resolved yet there, so it
+only sees their IP's bucket); the DRF throttle class does the actual token
+accounting, after authentication.
+
+With THROTTLE_ADAPTIVE on, every budget shrinks while this process's p95
+latency or p95 database time (teacup/metrics.py) is above
+THROTTLE_ADAPTIVE_P95_MS / THROTTLE_ADAPTIVE_DB_P95_MS, halving each
+THROTTLE_ADAPTIVE_INTERVAL seconds down to THROTTLE_ADAPTIVE_MIN_FACTOR, and
+grows back by a tenth per interval once things are healthy again.
+"""
+import math
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import JsonResponse
+from django.urls import Resolver404, resolve
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import request_metrics
+
+KEY_PREFIX = 'throttle'
+# Buckets left alone this long are dropped; by then they've long refilled
+MIN_KEY_TIMEOUT = 3600
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """'100/min' -> (100, 60), like DRF's SimpleRateThrottle."""
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def limits(scope):
+    """(capacity, refill interval in ms) for a scope, after the adaptive factor."""
+    num, duration = parse_rate(api_settings.DEFAULT_THROTTLE_RATES[scope])
+    capacity = max(1, int(num * load_factor()))
+    return capacity, max(1, math.ceil(duration * 1000 / capacity))
+
+
+def _now_ms():
+    return int(time.time() * 1000)
+
+
+def _key(scope, ident):
+    return f'{KEY_PREFIX}:{scope}:{ident}'
+
+
+def take(scope, ident):
+    """Take a token from the client's bucket: 0 if allowed, else seconds until one is available."""
+    capacity, interval = limits(scope)
+    key = _key(scope, ident)
+    timeout = max(MIN_KEY_TIMEOUT, 2 * capacity * interval // 1000)
+    now = _now_ms()
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        if cache.add(key, now + interval, timeout):
+            return 0
+        tat = cache.incr(key, interval)
+    if tat - interval < now:
+        # The bucket had been full for a while; restart its clock. Two requests
+        # racing here can let one extra request through, which is fine.
+        cache.set(key, now + interval, timeout)
+        return 0
+    wait = tat - now - capacity * interval
+    if wait <= 0:
+        return 0
+    cache.decr(key, interval)
+    return wait / 1000
+
+
+def peek(scope, ident):
+    """Like take() but read-only: seconds until the client's next request in `scope` would pass."""
+    capacity, interval = limits(scope)
+    tat = cache.get(_key(scope, ident))
+    if tat is None:
+        return 0
+    return max(0, tat + interval - _now_ms() - capacity * interval) / 1000
+
+
+def client_ident(request):
+    """
+    Who's asking: a verified bearer token's user, else an already authenticated user, else the IP.
+
+    The IP only comes from X-Forwarded-For past NUM_PROXIES trusted hops (REMOTE_ADDR when 0).
+    """
+    from users.tokens import KEYWORD, read_token
+
+    header = request.META.get('HTTP_AUTHORIZATION', '').split()
+    if len(header) == 2 and header[0].lower() == KEYWORD.lower():
+        try:
+            return f'user:{read_token(header[1])["u"]}'
+        except AuthenticationFailed:
+            pass
+    # Only once authentication has run (DRF throttles); never looked up from here
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return 'ip:' + BaseThrottle().get_ident(request)
+
+
+def scope_for(request, view_scope=None):
+    """The scope a request falls in, given the view's (or action's) throttle_scope if any."""
+    if view_scope:
+        return view_scope
+    if request.method in SAFE_METHODS:
+        return 'search' if request.GET.get(api_settings.SEARCH_PARAM) else 'read'
+    return 'write'
+
+
+def callback_scope(request, callback):
+    """Scope for a URL's view function, or None if it isn't throttled by BucketThrottle."""
+    callback = getattr(callback, 'throttled_view', callback)
+    cls = getattr(callback, 'cls', None)
+    if cls is None or not any(issubclass(throttle, BucketThrottle) for throttle in cls.throttle_classes):
+        return None
+    initkwargs = getattr(callback, 'initkwargs', {})
+    return scope_for(request, initkwargs.get('throttle_scope') or getattr(cls, 'throttle_scope', None))
+
+
+def throttled_response(wait):
+    seconds = math.ceil(wait)
+    response = JsonResponse(
+        {'detail': f'Request was throttled. Expected available in {seconds} second{"s" if seconds != 1 else ""}.'},
+        status=429,
+    )
+    response['Retry-After'] = str(seconds)
+    return response
+
+
+class BucketThrottle(BaseThrottle):
+    """DRF throttle drawing from the request's scope bucket."""
+
+    def allow_request(self, request, view):
+        self.scope = scope_for(request, getattr(view, 'throttle_scope', None))
+        self.wait_seconds = take(self.scope, client_ident(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ThrottleMiddleware:
+    """Turn away clients with an empty bucket before any session, auth or ORM work."""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        wait = self.check(request)
+        if wait:
+            return throttled_response(wait)
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        # A resolve and one cache read: cheaper inline than a hop to a worker thread
+        wait = self.check(request)
+        if wait:
+            return throttled_response(wait)
+        return await self.get_response(request)
+
+    @staticmethod
+    def check(request):
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return 0
+        scope = callback_scope(request, match.func)
+        if scope is None:
+            return 0
+        return peek(scope, client_ident(request))
+
+
+_factor = 1.0
+_checked_at = 0.0
+_factor_lock = threading.Lock()
+
+
+def load_factor():
+    """How much of each budget is available right now (1.0 unless adaptive throttling kicked in)."""
+    global _factor, _checked_at
+    if not settings.THROTTLE_ADAPTIVE:
+        return 1.0
+    now = time.monotonic()
+    if now - _checked_at < settings.THROTTLE_ADAPTIVE_INTERVAL:
+        return _factor
+    with _factor_lock:
+        if now - _checked_at >= settings.THROTTLE_ADAPTIVE_INTERVAL:
+            _checked_at = now
+            _factor = next_factor(_factor, request_metrics.percentiles(95))
+    return _factor
+
+
+def next_factor(factor, p95):
+    """Multiplicative decrease while overloaded, additive increase after."""
+    if p95 is None:
+        return min(1.0, factor + 0.1)
+    latency, db_time = p95
+    if (latency * 1000 > settings.THROTTLE_ADAPTIVE_P95_MS
+            or db_time * 1000 > settings.THROTTLE_ADAPTIVE_DB_P95_MS):
+        return max(settings.THROTTLE_ADAPTIVE_MIN_FACTOR, factor / 2)
+    return min(1.0, factor + 0.1)
+
+
+def reset_load_factor():
+    global _factor, _checked_at
+    _factor, _checked_at = 1.0, 0.0
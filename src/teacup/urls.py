@@ -14,10 +14,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from django.contrib import admin
 from django.urls import path, include
 from django.http import JsonResponse
-from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
+
+from .batch import BatchView
+from .lazy_admin import admin_urls
 
 def api_root(request):
     """API root endpoint showing available endpoints"""
@@ -29,6 +30,9 @@ def api_root(request):
             'posts': '/api/v1/posts/',
             'feed': '/api/v1/feed/',
             'comments': '/api/v1/comments/',
+            'notifications': '/api/v1/notifications/',
+            'export': '/api/v1/export/',
+            'batch': '/api/v1/batch/',
             'admin': '/admin/',
             'api_docs': '/api/docs/',
             'api_schema': '/api/schema/',
@@ -38,18 +42,19 @@ def api_root(request):
 
 urlpatterns = [
     path('', api_root, name='api-root'),
-    path('admin/', admin.site.urls),
+    path('admin/', admin_urls()),
     
     # API endpoints
+    path('api/v1/batch/', BatchView.as_view(), name='batch'),
     path('api/v1/', include('users.urls')),
     path('api/v1/', include('posts.urls')),
     path('api/v1/', include('feed.urls')),
+    path('api/v1/', include('notifications.urls')),
+    path('api/v1/', include('bulk.urls')),
     
     # Authentication endpoints
     path('api/v1/auth/', include('rest_framework.urls')),
     
-    # API documentation
-    path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
-    path('api/docs/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
-    path('api/redoc/', SpectacularRedocView.as_view(url_name='schema'), name='redoc'),
+    # API documentation (prebuilt schema, docs pages loaded on first use)
+    path('api/', include('apidocs.urls')),
 ]
@@ -1,7 +1,9 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
-from .models import UserProfile, Follow
+
+from teacup.paginators import EstimatedCountPaginator
+from .models import UserProfile, Follow, Block, Mute, DeletionJob
 
 
 class UserProfileInline(admin.StackedInline):
@@ -14,6 +16,8 @@ class UserAdmin(BaseUserAdmin):
     inlines = (UserProfileInline,)
     list_display = ('username', 'email', 'first_name', 'last_name', 'is_staff', 'date_joined')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'date_joined')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Follow)
@@ -22,6 +26,33 @@ class FollowAdmin(admin.ModelAdmin):
     list_filter = ('created_at',)
     search_fields = ('follower__username', 'followed__username')
     raw_id_fields = ('follower', 'followed')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Block)
+class BlockAdmin(admin.ModelAdmin):
+    list_display = ('blocker', 'blocked', 'created_at')
+    search_fields = ('blocker__username', 'blocked__username')
+    raw_id_fields = ('blocker', 'blocked')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(Mute)
+class MuteAdmin(admin.ModelAdmin):
+    list_display = ('muter', 'muted', 'created_at')
+    search_fields = ('muter__username', 'muted__username')
+    raw_id_fields = ('muter', 'muted')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+@admin.register(DeletionJob)
+class DeletionJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'object_id', 'status', 'step', 'rows_processed', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'updated_at', 'finished_at')
 
 
 # Re-register UserAdmin
@@ -0,0 +1,26 @@
+"""Async twin of UserViewSet.retrieve (see teacup/async_api.py)."""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import User
+from django.http import JsonResponse
+
+from teacup.async_api import async_reads, authenticate, error, gather_queries
+from teacup.fieldsets import sparse_queryset
+
+from .serializers import UserSerializer
+from .views import UserViewSet
+
+
+@async_reads(UserViewSet.as_view({'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}))
+async def user_detail(request, pk):
+    (drf_request, _), (user,) = await asyncio.gather(
+        authenticate(request),
+        gather_queries(lambda: sparse_queryset(
+            User.objects.filter(is_active=True, pk=pk).select_related('profile'), UserSerializer, request
+        ).first()),
+    )
+    if user is None:
+        return error('No User matches the given query.', 404)
+    data = await sync_to_async(lambda: UserSerializer(user, context={'request': drf_request}).data)()
+    return JsonResponse(data)
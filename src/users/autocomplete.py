@@ -0,0 +1,317 @@
+"""
+Username/name prefix search for the autocomplete endpoint.
+
+Each process keeps a PrefixIndex: every active user's lowercased username,
+first name and last name in one sorted list, so a prefix lookup is a pair of
+bisects. Matches are ranked by stored follower count. Very short prefixes
+match a big slice of the table, so their top results are precomputed when the
+index is built (and memoized the first time for longer busy prefixes), which
+keeps every lookup bounded no matter how many users match.
+
+User sign-ups, renames and deactivations bump a version number in the shared
+cache and record which user changed under that version. Processes notice it
+on their next lookup, reload just those users and patch their index in
+place, so a busy sign-up page doesn't have every process rescanning the
+users table. Follower counts drift a little in between, so the index is
+also rebuilt every AUTOCOMPLETE_REFRESH_SECONDS (or when the change log has
+gaps), in a background thread while the old index keeps serving
+(AUTOCOMPLETE_BACKGROUND_REFRESH=False rebuilds inline instead, which the
+tests use).
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import close_old_connections
+
+from .graph import get_graph
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'autocomplete:version'
+CHANGE_PREFIX = 'autocomplete:change:'
+# More changes than this behind and a full rebuild is cheaper than patching
+MAX_PATCHED_CHANGES = 1000
+# Logged instead of a user id when everything changed
+REBUILD = 'all'
+FOLLOWING_PREFIX = 'autocomplete:following:'
+# Prefixes up to this long get their top results precomputed at build time
+PRECOMPUTED_PREFIX_LENGTH = 2
+# Ranges wider than this are never scanned per request
+SCAN_LIMIT = 2000
+TOP_K = 100
+# Bounds the time and memory of one build; more than this and a real search service is due
+MAX_INDEXED_USERS = 2_000_000
+
+
+def normalize(value):
+    return (value or '').strip().lower()
+
+
+class PrefixIndex:
+    """Sorted (key, user_id) arrays plus follower counts for one snapshot of the users table."""
+
+    def __init__(self, rows):
+        """`rows` are (user_id, username, first_name, last_name, followers) tuples."""
+        entries = []
+        self.followers = {}
+        self.keys_by_user = {}
+        for user_id, username, first_name, last_name, followers in rows:
+            keys = {normalize(username), normalize(first_name), normalize(last_name)} - {''}
+            self.followers[user_id] = followers or 0
+            self.keys_by_user[user_id] = keys
+            entries.extend((key, user_id) for key in keys)
+        entries.sort()
+        self.keys = [key for key, _ in entries]
+        self.ids = [user_id for _, user_id in entries]
+        self.top = self._precompute()
+        self.built_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.followers)
+
+    def _rank_key(self, user_id):
+        return (self.followers[user_id], -user_id)
+
+    def _precompute(self):
+        by_prefix = {}
+        for key, user_id in zip(self.keys, self.ids):
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX_LENGTH) + 1):
+                by_prefix.setdefault(key[:length], set()).add(user_id)
+        return {
+            prefix: heapq.nlargest(TOP_K, user_ids, key=self._rank_key)
+            for prefix, user_ids in by_prefix.items()
+        }
+
+    def _range(self, prefix):
+        return bisect_left(self.keys, prefix), bisect_left(self.keys, prefix + '\uffff')
+
+    def top_matches(self, prefix):
+        """User ids whose username or name starts with `prefix`, best first (at most TOP_K)."""
+        if prefix in self.top:
+            return self.top[prefix]
+        lo, hi = self._range(prefix)
+        if lo == hi:
+            return []
+        result = heapq.nlargest(TOP_K, set(self.ids[lo:hi]), key=self._rank_key)
+        if hi - lo > SCAN_LIMIT:
+            with self._lock:
+                self.top[prefix] = result
+        return result
+
+    def _position(self, key, user_id):
+        lo, hi = bisect_left(self.keys, key), bisect_right(self.keys, key)
+        return bisect_left(self.ids, user_id, lo, hi)
+
+    def update(self, user_id, row=None):
+        """
+        Patch one user in place: `row` is their current load_rows() tuple, or
+        None if they're gone or deactivated.
+        """
+        with self._lock:
+            old = self.keys_by_user.pop(user_id, set())
+            for key in old:
+                position = self._position(key, user_id)
+                del self.keys[position]
+                del self.ids[position]
+            new = set()
+            if row is not None:
+                _, username, first_name, last_name, followers = row
+                new = {normalize(username), normalize(first_name), normalize(last_name)} - {''}
+                self.followers[user_id] = followers or 0
+                self.keys_by_user[user_id] = new
+                for key in new:
+                    position = self._position(key, user_id)
+                    self.keys.insert(position, key)
+                    self.ids.insert(position, user_id)
+
+            for prefix in [prefix for prefix in self.top if any(key.startswith(prefix) for key in old | new)]:
+                ranked = self.top[prefix]
+                if user_id in ranked and len(ranked) == TOP_K:
+                    # Whoever was 101st moves up; only a scan knows who that is
+                    if len(prefix) > PRECOMPUTED_PREFIX_LENGTH:
+                        del self.top[prefix]  # memoized; recomputed on the next lookup
+                        continue
+                    lo, hi = self._range(prefix)
+                    self.top[prefix] = heapq.nlargest(TOP_K, set(self.ids[lo:hi]), key=self._rank_key)
+                    continue
+                ranked = [other for other in ranked if other != user_id]
+                if any(key.startswith(prefix) for key in new):
+                    ranked = heapq.nlargest(TOP_K, ranked + [user_id], key=self._rank_key)
+                self.top[prefix] = ranked
+            for prefix in {key[:length] for key in new for length in range(1, PRECOMPUTED_PREFIX_LENGTH + 1)}:
+                self.top.setdefault(prefix, [user_id])
+            if row is None:
+                self.followers.pop(user_id, None)
+
+    def matches(self, user_id, prefix):
+        return any(key.startswith(prefix) for key in self.keys_by_user.get(user_id, ()))
+
+    def search(self, prefix, limit=10, following=()):
+        """
+        Best `limit` matches for `prefix`.
+
+        Users in `following` (the viewer's followees) come first, then everyone
+        else, both by follower count.
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        followed = [user_id for user_id in following if self.matches(user_id, prefix)]
+        followed = heapq.nlargest(limit, followed, key=self._rank_key)
+        seen = set(followed)
+        rest = [user_id for user_id in self.top_matches(prefix) if user_id not in seen]
+        return followed + rest[:limit - len(followed)]
+
+
+def load_rows(user_ids=None):
+    users = User.objects.filter(is_active=True)
+    if user_ids is not None:
+        users = users.filter(pk__in=user_ids)
+    return (
+        users.order_by()
+        .values_list('id', 'username', 'first_name', 'last_name', 'profile__followers_total')
+        [:MAX_INDEXED_USERS]
+        .iterator(chunk_size=5000)
+    )
+
+
+_index = None
+_index_version = None
+_rebuilding = False
+_state_lock = threading.Lock()
+
+
+def current_version():
+    return cache.get_or_set(VERSION_KEY, 1, None)
+
+
+def mark_stale(user_id=None):
+    """
+    Tell every process a user appeared, changed or went away (called on user
+    changes). Without a user id (e.g. after a bulk import) they all rebuild.
+    """
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        version = 2
+        cache.set(VERSION_KEY, version, None)
+    # Indexes older than AUTOCOMPLETE_REFRESH_SECONDS rebuild anyway, so they never need older entries
+    cache.set(f'{CHANGE_PREFIX}{version}', user_id or REBUILD, 2 * settings.AUTOCOMPLETE_REFRESH_SECONDS)
+
+
+def _patch(index, index_version, version):
+    """
+    Apply the logged changes after `index_version` to `index`; returns the
+    version it got up to, or None when it should be rebuilt instead.
+    """
+    if version - index_version > MAX_PATCHED_CHANGES:
+        return None
+    keys = [f'{CHANGE_PREFIX}{v}' for v in range(index_version + 1, version + 1)]
+    logged = cache.get_many(keys)
+    user_ids = []
+    for key in keys:
+        if key not in logged:
+            break  # bumped but not written yet; picked up on a later lookup
+        if logged[key] == REBUILD:
+            return None
+        user_ids.append(logged[key])
+    if user_ids:
+        rows = {row[0]: row for row in load_rows(set(user_ids))}
+        for user_id in set(user_ids):
+            index.update(user_id, rows.get(user_id))
+    return index_version + len(user_ids)
+
+
+def _build(version):
+    global _index, _index_version, _rebuilding
+    try:
+        index = PrefixIndex(load_rows())
+        with _state_lock:
+            _index, _index_version = index, version
+    finally:
+        with _state_lock:
+            _rebuilding = False
+
+
+def _rebuild_in_background(version):
+    try:
+        _build(version)
+    except Exception:
+        logger.exception('Autocomplete index rebuild failed; keeping the old one')
+    finally:
+        close_old_connections()
+
+
+def get_index():
+    """The process-wide index, building it on first use and refreshing it in the background."""
+    global _index_version, _rebuilding
+    version = current_version()
+    with _state_lock:
+        index, index_version = _index, _index_version
+        if index is not None:
+            expired = time.monotonic() - index.built_at > settings.AUTOCOMPLETE_REFRESH_SECONDS
+            if (index_version == version and not expired) or _rebuilding:
+                return index
+            if not expired:
+                patched = _patch(index, index_version, version)
+                if patched is not None:
+                    _index_version = patched
+                    return index
+        _rebuilding = True
+
+    if index is None or not settings.AUTOCOMPLETE_BACKGROUND_REFRESH:
+        _build(version)
+        return _index
+    threading.Thread(target=_rebuild_in_background, args=(version,), daemon=True).start()
+    return index
+
+
+def reset_index():
+    """Drop this process's index (tests, or after bulk imports)."""
+    global _index, _index_version
+    with _state_lock:
+        _index = _index_version = None
+
+
+def following_ids(user_id):
+    """
+    Ids the user follows: from the mapped follow graph (users/graph.py) when
+    there is one, else cached briefly; follow/unfollow drops the entry.
+    """
+    from .models import Follow
+
+    graph = get_graph()
+    if graph is not None:
+        return graph.following(user_id)
+
+    key = f'{FOLLOWING_PREFIX}{user_id}'
+    ids = cache.get(key)
+    if ids is None:
+        ids = list(Follow.objects.filter(follower_id=user_id).values_list('followed_id', flat=True))
+        cache.set(key, ids, settings.AUTOCOMPLETE_FOLLOWING_TIMEOUT)
+    return ids
+
+
+def forget_following(user_id):
+    cache.delete(f'{FOLLOWING_PREFIX}{user_id}')
+
+
+def search_users(prefix, limit=10, viewer_id=None):
+    """
+    Ranked matches for a prefix as seen by `viewer_id` (None for anonymous).
+
+    Returns (user_id, followers, is_following) tuples.
+    """
+    following = set(following_ids(viewer_id)) if viewer_id else set()
+    index = get_index()
+    return [
+        (user_id, index.followers[user_id], user_id in following)
+        for user_id in index.search(prefix, limit, following)
+    ]
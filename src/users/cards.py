@@ -0,0 +1,72 @@
+"""
+Pre-serialized "author cards" (id, username, names, profile_picture).
+
+The same handful of authors show up all over a response: on posts, comments,
+likes, follow lists and notifications. Cards are looked up in a per-request
+memo first, then the shared cache, and only the misses hit the database
+(one query, joined to the profile). The User/UserProfile signals in
+users/models.py drop a card whenever its data changes.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+CACHE_PREFIX = 'author-card:'
+CARD_USER_FIELDS = {'username', 'first_name', 'last_name'}
+
+
+def _key(user_id):
+    return f'{CACHE_PREFIX}{user_id}'
+
+
+def build_card(user):
+    """Card for a User with its profile loaded."""
+    profile = getattr(user, 'profile', None)
+    return {
+        'id': user.id,
+        'username': user.username,
+        'first_name': user.first_name,
+        'last_name': user.last_name,
+        'profile_picture': profile.profile_picture if profile else None,
+    }
+
+
+def card_memo(context):
+    """
+    The memo dict for a serializer context.
+
+    Lives on the request when there is one, so every serializer in the request
+    shares it; otherwise on the (root) context itself.
+    """
+    request = context.get('request')
+    holder = getattr(request, '_request', request)
+    if holder is None:
+        return context.setdefault('_author_cards', {})
+    memo = getattr(holder, '_author_cards', None)
+    if memo is None:
+        memo = holder._author_cards = {}
+    return memo
+
+
+def get_cards(user_ids, memo=None):
+    """Return {user_id: card} for the given ids, filling the memo and cache on the way."""
+    memo = {} if memo is None else memo
+    wanted = {user_id for user_id in user_ids if user_id is not None}
+    missing = wanted - memo.keys()
+    if missing:
+        cached = cache.get_many([_key(user_id) for user_id in missing])
+        for card in cached.values():
+            memo[card['id']] = card
+        missing -= memo.keys()
+    if missing:
+        users = User.objects.filter(pk__in=missing).select_related('profile').only(
+            'id', 'username', 'first_name', 'last_name', 'profile__profile_picture',
+        )
+        loaded = {user.id: build_card(user) for user in users}
+        memo.update(loaded)
+        cache.set_many({_key(user_id): card for user_id, card in loaded.items()}, settings.AUTHOR_CARD_TIMEOUT)
+    return {user_id: memo[user_id] for user_id in wanted if user_id in memo}
+
+
+def invalidate_card(user_id):
+    cache.delete(_key(user_id))
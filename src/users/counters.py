@@ -0,0 +1,35 @@
+"""
+Helpers for the denormalized UserProfile.followers_total / following_total counters.
+
+Like posts.counters: the Follow signals handle normal saves, anything that
+writes follows in bulk or with raw SQL should call refresh_follow_counts().
+"""
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+from .models import UserProfile, Follow
+
+
+def _count_subquery(field):
+    counts = (
+        Follow.objects.filter(**{field: OuterRef('user_id')})
+        .order_by()
+        .values(field)
+        .annotate(total=Count('*'))
+        .values('total')
+    )
+    return Coalesce(Subquery(counts), Value(0))
+
+
+def refresh_follow_counts(user_ids=None):
+    """Recompute stored follow counters for the given users (or everyone) in one UPDATE."""
+    queryset = UserProfile.objects.all()
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0
+        queryset = queryset.filter(user_id__in=user_ids)
+    return queryset.update(
+        followers_total=_count_subquery('followed'),
+        following_total=_count_subquery('follower'),
+    )
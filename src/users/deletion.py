@@ -0,0 +1,217 @@
+"""
+Chunked background deletion of accounts and posts.
+
+Letting Django's collector cascade a heavy account loads every Post, Like,
+Comment and Follow row into memory and deletes them in one long transaction.
+Instead, deleting hides the account/post straight away and queues a
+DeletionJob. The job walks a fixed list of steps; each step repeatedly picks
+up to DELETION_CHUNK_SIZE ids and removes them with a raw
+`DELETE ... WHERE id IN (...)` in its own short transaction, recording
+progress on the job so it can resume after a crash or restart.
+
+Raw deletes skip signals, so steps that remove likes/comments on other
+people's posts (or follows of other people) refresh those counters afterwards,
+and deleted unread notifications come off their recipients' unread badges.
+A user's comments go with the replies under them, as they would in a cascade.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from notifications.models import Inbox, Notification, NotificationActor
+from posts.counters import refresh_counts, refresh_reply_counts
+from posts.models import Post, PostTag, PostTombstone, Like, Comment
+from posts.tags import bucket_for, subtract_counts
+from posts.threads import ancestor_ids, with_replies
+from taskqueue.queue import enqueue
+
+from .counters import refresh_follow_counts
+from .models import Block, DeletionJob, Follow, Mute
+
+DELETION_TASK = 'users.run_deletion'
+# Raw deletes don't cascade, so a reply has to go before the comment it answers
+REPLIES_FIRST = ('-depth',)
+NOTIFICATION_VALUES = ('id', 'recipient_id', 'is_read')
+
+
+class Step:
+    """
+    One stage of a cascade: delete (or update) `queryset` rows chunk by chunk.
+
+    `after` is called with the list of (id, extra...) tuples of each chunk,
+    where the extra columns are the `values` fields beyond the id. `order`
+    picks which rows go first, e.g. replies before the comments they answer.
+    """
+
+    def __init__(self, name, queryset, values=('id',), after=None, update=None, order=()):
+        self.name = name
+        self.queryset = queryset
+        self.values = values
+        self.after = after
+        self.update = update
+        self.order = order
+
+    def run_chunk(self, chunk_size):
+        """Process one chunk. Returns how many rows it touched (0 when the step is done)."""
+        rows = list(self.queryset.order_by(*self.order).values_list(*self.values)[:chunk_size])
+        if not rows:
+            return 0
+        ids = [row[0] for row in rows]
+        with transaction.atomic():
+            if self.update:
+                self.queryset.model._base_manager.filter(pk__in=ids).update(**self.update)
+            else:
+                delete_ids(self.queryset.model, ids)
+            if self.after:
+                self.after(rows)
+        return len(rows)
+
+
+def delete_ids(model, ids):
+    """DELETE FROM <table> WHERE id IN (...), skipping the ORM collector and signals."""
+    table = connection.ops.quote_name(model._meta.db_table)
+    placeholders = ', '.join(['%s'] * len(ids))
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {table} WHERE id IN ({placeholders})', ids)
+        return cursor.rowcount
+
+
+def _refresh_likes(rows):
+    refresh_counts({post_id for _, post_id in rows}, comments=False)
+
+
+def _refresh_comments(rows):
+    refresh_counts({post_id for _, post_id, _ in rows}, likes=False)
+    refresh_reply_counts({ancestor for _, _, path in rows for ancestor in ancestor_ids(path)})
+
+
+def _uncount_tags(rows):
+    # What index_post added for these tags comes back off the trending counts
+    subtract_counts(Counter((tag, bucket_for(created_at)) for _, tag, created_at in rows))
+
+
+def _drop_notifications(rows):
+    NotificationActor.objects.filter(notification_id__in=[pk for pk, _, _ in rows]).delete()
+    # Unread rows going away come off their recipients' badges
+    unread = Counter(recipient_id for _, recipient_id, is_read in rows if not is_read)
+    for recipient_id, count in unread.items():
+        Inbox.objects.filter(user_id=recipient_id).update(unread_count=Greatest(F('unread_count') - count, 0))
+
+
+def _tombstone(rows):
+    now = timezone.now()
+    PostTombstone.objects.bulk_create(
+        [PostTombstone(post_id=post_id, author_id=author_id, deleted_at=now) for post_id, author_id in rows]
+    )
+
+
+def _refresh_follows(rows):
+    refresh_follow_counts({user_id for _, follower_id, followed_id in rows for user_id in (follower_id, followed_id)})
+
+
+def post_steps(post_id):
+    return [
+        Step('likes', Like.objects.filter(post_id=post_id)),
+        Step('comments', Comment.objects.filter(post_id=post_id), order=REPLIES_FIRST),
+        Step('notifications', Notification.objects.filter(post_id=post_id), values=NOTIFICATION_VALUES,
+             after=_drop_notifications),
+        Step('tags', PostTag.objects.filter(post_id=post_id), values=('id', 'tag', 'created_at'),
+             after=_uncount_tags),
+        Step('post', Post.all_objects.filter(pk=post_id)),
+    ]
+
+
+def user_steps(user_id):
+    now = timezone.now()
+    own_posts = Post.all_objects.filter(author_id=user_id)
+    return [
+        Step('hide_posts', Post.objects.filter(author_id=user_id), values=('id', 'author_id'),
+             update={'deleted_at': now}, after=_tombstone),
+        Step('likes', Like.objects.filter(user_id=user_id), values=('id', 'post_id'), after=_refresh_likes),
+        Step('comments', with_replies(Comment.objects.filter(author_id=user_id)), values=('id', 'post_id', 'path'),
+             after=_refresh_comments, order=REPLIES_FIRST),
+        Step('post_likes', Like.objects.filter(post__in=own_posts)),
+        Step('post_comments', Comment.objects.filter(post__in=own_posts), order=REPLIES_FIRST),
+        Step('post_notifications', Notification.objects.filter(post__in=own_posts), values=NOTIFICATION_VALUES,
+             after=_drop_notifications),
+        Step('post_tags', PostTag.objects.filter(post__in=own_posts), values=('id', 'tag', 'created_at'),
+             after=_uncount_tags),
+        Step('notifications', Notification.objects.filter(recipient_id=user_id), values=NOTIFICATION_VALUES,
+             after=_drop_notifications),
+        Step('acted_notifications', Notification.objects.filter(last_actor_id=user_id), update={'last_actor': None}),
+        Step('blocks', Block.objects.filter(Q(blocker_id=user_id) | Q(blocked_id=user_id))),
+        Step('mutes', Mute.objects.filter(Q(muter_id=user_id) | Q(muted_id=user_id))),
+        Step('follows', Follow.objects.filter(Q(follower_id=user_id) | Q(followed_id=user_id)),
+             values=('id', 'follower_id', 'followed_id'), after=_refresh_follows),
+        Step('posts', own_posts),
+    ]
+
+
+def steps_for(job):
+    return post_steps(job.object_id) if job.kind == DeletionJob.POST else user_steps(job.object_id)
+
+
+def schedule_user_deletion(user):
+    """Deactivate the account right away and queue the rest."""
+    user.is_active = False
+    user.save(update_fields=['is_active'])
+    job = DeletionJob.objects.create(kind=DeletionJob.USER, object_id=user.pk)
+    enqueue(DELETION_TASK, {'job_id': job.pk})
+    return job
+
+
+def schedule_post_deletion(post):
+    """Hide the post right away and queue the rest."""
+    post.deleted_at = timezone.now()
+    Post.all_objects.filter(pk=post.pk).update(deleted_at=post.deleted_at)
+    PostTombstone.objects.create(post_id=post.pk, author_id=post.author_id, deleted_at=post.deleted_at)
+    job = DeletionJob.objects.create(kind=DeletionJob.POST, object_id=post.pk)
+    enqueue(DELETION_TASK, {'job_id': job.pk})
+    return job
+
+
+def run_job(job, max_chunks=None):
+    """
+    Advance a job by up to `max_chunks` chunks (all of it if None).
+
+    Returns True once the job is finished.
+    """
+    chunk_size = settings.DELETION_CHUNK_SIZE
+    if job.status == DeletionJob.DONE:
+        return True
+    job.status = DeletionJob.RUNNING
+    chunks = 0
+    steps = steps_for(job)
+    names = [step.name for step in steps]
+    start = names.index(job.step) if job.step in names else 0
+
+    for step in steps[start:]:
+        if job.step != step.name:
+            job.step = step.name
+            job.save(update_fields=['status', 'step', 'updated_at'])
+        while True:
+            if max_chunks is not None and chunks >= max_chunks:
+                return False
+            touched = step.run_chunk(chunk_size)
+            if not touched:
+                break
+            chunks += 1
+            job.rows_processed += touched
+            job.save(update_fields=['status', 'rows_processed', 'updated_at'])
+
+    if job.kind == DeletionJob.USER:
+        # Only small per-user rows are left (profile, inbox, sessions...)
+        User.objects.filter(pk=job.object_id).delete()
+    # Clients holding sync tokens this old have to do a full refresh anyway
+    PostTombstone.objects.filter(deleted_at__lt=timezone.now() - timedelta(seconds=settings.FEED_SYNC_MAX_AGE)).delete()
+    job.status = DeletionJob.DONE
+    job.step = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'step', 'finished_at', 'updated_at'])
+    return True
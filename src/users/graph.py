@@ -0,0 +1,290 @@
+"""
+Read-only follow graph snapshot, shared by every worker process through mmap.
+
+`manage.py build_follow_graph` writes the whole Follow table as two CSR
+adjacency structures (who each user follows and who follows them, every row
+sorted) into one int64 .npy file at FOLLOW_GRAPH_PATH, swapping it in
+atomically. Processes map it read-only (np.load(mmap_mode='r')), so its pages
+sit once in the OS page cache however many workers there are; a user's
+follows are a slice and "does A follow B" is a binary search.
+
+Follows and unfollows since the build go through a delta log in the shared
+cache: once its transaction commits, each change takes a sequence number
+(cache.incr) and is stored under its own key. Before answering, a process
+replays entries it hasn't seen into small in-memory overlays, and drops them
+when it maps a newer snapshot (whose header records the last sequence number
+it already includes). If an entry has gone missing from the cache, the
+counter went backwards (cache flushed) or the overlays outgrow
+FOLLOW_GRAPH_MAX_DELTA, the process stops using the snapshot until the next
+rebuild and callers fall back to the database.
+
+Bulk writes that skip the Follow signals (the NDJSON importer, the follows
+step of account deletion) aren't logged, so rebuild after those. Leave
+FOLLOW_GRAPH_PATH unset to do without a snapshot.
+"""
+import logging
+import os
+import threading
+import time
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+SEQ_KEY = 'follow-graph:seq'
+DELTA_PREFIX = 'follow-graph:delta:'
+MAGIC = 0x46474150  # "FGAP"
+FORMAT_VERSION = 1
+HEADER = ('magic', 'version', 'size', 'edges', 'seq', 'built_at')
+# A delta entry can be missing for a moment (counter bumped, entry not set yet); longer means evicted
+GAP_SECONDS = 5
+
+
+def _csr(rows, cols, size):
+    """indptr/indices with each row's columns sorted."""
+    order = np.lexsort((cols, rows))
+    indptr = np.zeros(size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=size), out=indptr[1:])
+    return indptr, cols[order]
+
+
+def build_snapshot(path):
+    """Write the current follow graph to `path` (atomically) and return its header."""
+    from .models import Follow
+
+    # Read first: changes made while the table is read are replayed on top, which is harmless
+    seq = cache.get(SEQ_KEY, 0)
+    rows = Follow.objects.values_list('follower_id', 'followed_id').order_by()
+    pairs = np.fromiter(chain.from_iterable(rows.iterator(chunk_size=10_000)), dtype=np.int64)
+    followers, followed = pairs[0::2], pairs[1::2]
+    size = int(pairs.max(initial=0)) + 1
+    header = dict(zip(HEADER, (MAGIC, FORMAT_VERSION, size, len(followers), seq, int(time.time()))))
+    array = np.concatenate([
+        np.array(list(header.values()), dtype=np.int64),
+        *_csr(followers, followed, size),
+        *_csr(followed, followers, size),
+    ])
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+    return header
+
+
+class Snapshot:
+    """A mapped snapshot file."""
+
+    def __init__(self, array):
+        header = dict(zip(HEADER, array[:len(HEADER)].tolist()))
+        if header['magic'] != MAGIC or header['version'] != FORMAT_VERSION:
+            raise ValueError('Not a follow graph snapshot (or an old format)')
+        self.seq = header['seq']
+        self.built_at = header['built_at']
+        self.size = size = header['size']
+        edges = header['edges']
+        start = len(HEADER)
+        self.out_indptr = array[start:start + size + 1]
+        start += size + 1
+        self.out_indices = array[start:start + edges]
+        start += edges
+        self.in_indptr = array[start:start + size + 1]
+        start += size + 1
+        self.in_indices = array[start:start + edges]
+
+    @classmethod
+    def open(cls, path):
+        return cls(np.load(path, mmap_mode='r'))
+
+    def _row(self, indptr, indices, user_id):
+        if not 0 <= user_id < self.size:
+            return indices[:0]
+        return indices[indptr[user_id]:indptr[user_id + 1]]
+
+    def following(self, user_id):
+        return self._row(self.out_indptr, self.out_indices, user_id)
+
+    def followers(self, user_id):
+        return self._row(self.in_indptr, self.in_indices, user_id)
+
+    def has_edge(self, follower_id, followed_id):
+        row = self.following(follower_id)
+        i = int(np.searchsorted(row, followed_id))
+        return i < len(row) and row[i] == followed_id
+
+
+class FollowGraph:
+    """A snapshot plus the follows/unfollows made since, as this process has seen them."""
+
+    def __init__(self, snapshot, identity=None):
+        self.snapshot = snapshot
+        self.identity = identity
+        self.seq = snapshot.seq
+        self.broken = False
+        self.gap_since = None
+        self.delta = 0
+        # user id -> ids added/removed relative to the snapshot
+        self.added_out, self.removed_out = {}, {}
+        self.added_in, self.removed_in = {}, {}
+
+    def apply(self, follower_id, followed_id, following):
+        """Apply one change; the overlays only ever hold differences from the snapshot."""
+        in_snapshot = self.snapshot.has_edge(follower_id, followed_id)
+        for user_id, other_id, added, removed in (
+            (follower_id, followed_id, self.added_out, self.removed_out),
+            (followed_id, follower_id, self.added_in, self.removed_in),
+        ):
+            added.setdefault(user_id, set()).discard(other_id)
+            removed.setdefault(user_id, set()).discard(other_id)
+            if following and not in_snapshot:
+                added[user_id].add(other_id)
+            elif not following and in_snapshot:
+                removed[user_id].add(other_id)
+        self.delta += 1
+        if self.delta > settings.FOLLOW_GRAPH_MAX_DELTA:
+            logger.warning('Follow graph delta log is over FOLLOW_GRAPH_MAX_DELTA; using the database until a rebuild')
+            self.broken = True
+
+    def catch_up(self):
+        """Replay delta log entries this process hasn't seen yet."""
+        latest = cache.get(SEQ_KEY, 0)
+        if latest < self.seq:
+            self.broken = True  # the cache was flushed; entries after the snapshot are gone
+            return
+        if latest == self.seq:
+            return
+        if latest - self.seq > settings.FOLLOW_GRAPH_MAX_DELTA:
+            logger.warning('Follow graph delta log is over FOLLOW_GRAPH_MAX_DELTA; using the database until a rebuild')
+            self.broken = True
+            return
+        keys = [f'{DELTA_PREFIX}{seq}' for seq in range(self.seq + 1, latest + 1)]
+        entries = cache.get_many(keys)
+        for key in keys:
+            entry = entries.get(key)
+            if entry is None:
+                now = time.monotonic()
+                if self.gap_since is None:
+                    self.gap_since = now
+                elif now - self.gap_since > GAP_SECONDS:
+                    logger.warning('Follow graph delta entry %s is gone; using the database until a rebuild', key)
+                    self.broken = True
+                return
+            self.gap_since = None
+            self.apply(*entry)
+            self.seq += 1
+
+    def _merge(self, row, added, removed, user_id):
+        ids = row.tolist()
+        if removed.get(user_id):
+            ids = [other_id for other_id in ids if other_id not in removed[user_id]]
+        return ids + sorted(added.get(user_id, ()))
+
+    def following(self, user_id):
+        return self._merge(self.snapshot.following(user_id), self.added_out, self.removed_out, user_id)
+
+    def followers(self, user_id):
+        return self._merge(self.snapshot.followers(user_id), self.added_in, self.removed_in, user_id)
+
+    def is_following(self, follower_id, followed_id):
+        if followed_id in self.added_out.get(follower_id, ()):
+            return True
+        if followed_id in self.removed_out.get(follower_id, ()):
+            return False
+        return self.snapshot.has_edge(follower_id, followed_id)
+
+
+_graph = None
+_next_check = 0.0
+_lock = threading.Lock()
+
+
+def _file_identity(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def get_graph():
+    """This process's follow graph, or None when there's no usable snapshot (ask the database)."""
+    global _graph, _next_check
+    path = settings.FOLLOW_GRAPH_PATH
+    if not path:
+        return None
+    with _lock:
+        now = time.monotonic()
+        if now >= _next_check:
+            _next_check = now + settings.FOLLOW_GRAPH_CHECK_SECONDS
+            identity = _file_identity(path)
+            if identity is None:
+                _graph = None
+            elif _graph is None or _graph.identity != identity:
+                try:
+                    _graph = FollowGraph(Snapshot.open(path), identity)
+                except (OSError, ValueError):
+                    logger.exception('Could not map the follow graph snapshot at %s', path)
+                    _graph = None
+        if _graph is None or _graph.broken:
+            return None
+        _graph.catch_up()
+        return None if _graph.broken else _graph
+
+
+def reset_graph():
+    """Forget this process's mapped snapshot (tests, or right after a rebuild)."""
+    global _graph, _next_check
+    with _lock:
+        _graph, _next_check = None, 0.0
+
+
+def _publish(follower_id, followed_id, following):
+    try:
+        seq = cache.incr(SEQ_KEY)
+    except ValueError:
+        cache.add(SEQ_KEY, 0, None)
+        seq = cache.incr(SEQ_KEY)
+    cache.set(f'{DELTA_PREFIX}{seq}', (follower_id, followed_id, following), settings.FOLLOW_GRAPH_DELTA_TIMEOUT)
+
+
+def record_change(follower_id, followed_id, following):
+    """Log a follow (following=True) or unfollow for the mapped snapshots, once the transaction commits."""
+    if settings.FOLLOW_GRAPH_PATH:
+        transaction.on_commit(lambda: _publish(follower_id, followed_id, following))
+
+
+def follower_ids(user_id):
+    """Ids of the user's followers."""
+    graph = get_graph()
+    if graph is not None:
+        return graph.followers(user_id)
+    from .models import Follow
+
+    return list(Follow.objects.filter(followed_id=user_id).values_list('follower_id', flat=True))
+
+
+def is_following(follower_id, followed_id):
+    graph = get_graph()
+    if graph is not None:
+        return graph.is_following(follower_id, followed_id)
+    from .models import Follow
+
+    return Follow.objects.filter(follower_id=follower_id, followed_id=followed_id).exists()
+
+
+def mutual_ids(user_id):
+    """Ids of the people the user follows who follow them back."""
+    graph = get_graph()
+    if graph is not None:
+        return sorted(set(graph.following(user_id)) & set(graph.followers(user_id)))
+    from .models import Follow
+
+    return list(
+        Follow.objects.filter(follower_id=user_id, followed__following__followed_id=user_id)
+        .order_by('followed_id').values_list('followed_id', flat=True)
+    )
@@ -0,0 +1,73 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from feed.views import FeedViewSet
+from posts.models import Post
+from users.blocks import forget_exclusions
+from users.models import Block, Follow, Mute
+
+PREFIX = 'bench_blocks_'
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the feed endpoints for a viewer with no blocks and with --blocked blocked accounts '
+        '(plus some mutes), showing the queries stay the same. Runs in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--blocked', type=int, default=10_000)
+        parser.add_argument('--authors', type=int, default=50)
+        parser.add_argument('--posts', type=int, default=20, help='Posts per author')
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        with transaction.atomic():
+            viewer = User.objects.create_user(username=f'{PREFIX}viewer')
+            authors = User.objects.bulk_create(
+                [User(username=f'{PREFIX}author{i}') for i in range(options['authors'])]
+            )
+            Follow.objects.bulk_create([Follow(follower=viewer, followed=author) for author in authors])
+            Post.objects.bulk_create([
+                Post(author=author, content=f'Post {i} by {author.username}')
+                for author in authors for i in range(options['posts'])
+            ])
+
+            rows = []
+            for label, blocked in (('no blocks', 0), (f'{options["blocked"]:,} blocked', options['blocked'])):
+                if blocked:
+                    others = User.objects.bulk_create(
+                        [User(username=f'{PREFIX}blocked{i}') for i in range(blocked)], batch_size=2000
+                    )
+                    Block.objects.bulk_create([Block(blocker=viewer, blocked=user) for user in others],
+                                              batch_size=2000)
+                    # Some of the followed authors muted too, as happens
+                    Mute.objects.bulk_create([Mute(muter=viewer, muted=author) for author in authors[:5]])
+                    forget_exclusions(viewer.pk)
+                cache.delete_many([f'autocomplete:following:{viewer.pk}'])
+
+                for action in ('my_feed', 'discover', 'trending'):
+                    view = FeedViewSet.as_view({'get': action})
+                    timings, queries = [], 0
+                    for _ in range(options['repeat']):
+                        request = factory.get('/', HTTP_HOST='localhost')
+                        force_authenticate(request, user=viewer)
+                        with CaptureQueriesContext(connection) as captured:
+                            started = time.perf_counter()
+                            view(request).render()
+                            timings.append((time.perf_counter() - started) * 1000)
+                        queries = len(captured.captured_queries)
+                    rows.append((label, action, queries, statistics.median(timings)))
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{"viewer":<16} {"endpoint":<10} {"queries":>7} {"ms":>8}')
+        for label, action, queries, ms in rows:
+            self.stdout.write(f'{label:<16} {action:<10} {queries:>7} {ms:>8.2f}')
@@ -0,0 +1,85 @@
+import re
+from collections import Counter
+
+from django.contrib.auth import authenticate
+from django.contrib.auth.models import User, update_last_login
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from users.views import TokenViewSet, UserViewSet
+
+USERNAME = 'bench_writes_user'
+PASSWORD = 'bench-writes-pass-123'
+WRITE_RE = re.compile(r'^\s*(INSERT INTO|UPDATE|DELETE FROM)\s+"?(\w+)"?', re.IGNORECASE)
+
+
+def count_writes(queries):
+    """Counter of (statement, table) for the INSERT/UPDATE/DELETE queries captured."""
+    writes = Counter()
+    for query in queries:
+        match = WRITE_RE.match(query['sql'])
+        if match:
+            writes[match.group(1).split()[0].upper(), match.group(2)] += 1
+    return writes
+
+
+class Command(BaseCommand):
+    help = (
+        'Count the write queries behind registration, login and profile/user updates. '
+        'Runs everything in a transaction that is rolled back.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', action='store_true', help='Print the write statements too')
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        with transaction.atomic():
+            self.scenarios = []
+            self.measure('register', options, lambda: UserViewSet.as_view({'post': 'create'})(
+                factory.post('/', {
+                    'username': USERNAME, 'email': 'bench@example.com', 'password': PASSWORD,
+                    'password_confirm': PASSWORD,
+                }, HTTP_HOST='localhost', REMOTE_ADDR='10.0.0.1')
+            ))
+            user_id = User.objects.get(username=USERNAME).pk
+
+            # What django.contrib.auth.login() does to the user row
+            self.measure('session login', options, lambda: update_last_login(
+                None, authenticate(username=USERNAME, password=PASSWORD)
+            ))
+            self.measure('token login', options, lambda: TokenViewSet.as_view({'post': 'create'})(
+                factory.post('/', {'username': USERNAME, 'password': PASSWORD}, HTTP_HOST='localhost')
+            ))
+
+            def patch(action, data):
+                def run():
+                    request = factory.patch('/', data, HTTP_HOST='localhost')
+                    force_authenticate(request, user=User.objects.get(pk=user_id))
+                    return UserViewSet.as_view({'patch': action})(request, pk=user_id)
+                return run
+
+            self.measure('profile update', options, patch('update_profile', {'bio': 'Writes less'}))
+            self.measure('profile update (no change)', options, patch('update_profile', {'bio': 'Writes less'}))
+            self.measure('user update', options, patch('partial_update', {'first_name': 'Bench'}))
+            self.measure('user update (no change)', options, patch('partial_update', {'first_name': 'Bench'}))
+            transaction.set_rollback(True)
+
+        width = max(len(name) for name, _ in self.scenarios)
+        for name, writes in self.scenarios:
+            detail = ', '.join(f'{count} {verb} {table}' for (verb, table), count in sorted(writes.items()))
+            self.stdout.write(f'{name:<{width}}  {sum(writes.values()):>2} writes  {detail}')
+
+    def measure(self, name, options, run):
+        with CaptureQueriesContext(connection) as queries:
+            response = run()
+        status = getattr(response, 'status_code', 200)
+        if status >= 400:
+            self.stderr.write(f'{name}: HTTP {status} {getattr(response, "data", "")}')
+        self.scenarios.append((name, count_writes(queries.captured_queries)))
+        if options['sql']:
+            for query in queries.captured_queries:
+                if WRITE_RE.match(query['sql']):
+                    self.stdout.write(f'  {name}: {query["sql"]}')
@@ -0,0 +1,30 @@
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from users.graph import build_snapshot
+
+
+class Command(BaseCommand):
+    help = (
+        'Write the follow graph snapshot that worker processes memory-map (users/graph.py). '
+        'Run it periodically, e.g. every few minutes from cron; workers pick up the new file on their own.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.FOLLOW_GRAPH_PATH,
+                            help='Where to write it (default: FOLLOW_GRAPH_PATH)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('Set FOLLOW_GRAPH_PATH (or pass --path)')
+        started = time.perf_counter()
+        header = build_snapshot(path)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {header["edges"]:,} follows over {header["size"]:,} user ids to {path} '
+            f'({os.path.getsize(path) / 2 ** 20:.1f} MB) in {elapsed:.1f}s'
+        ))
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from users.suggestions import SHARD_SIZE, build_suggestions, stale_user_ids
+
+
+class Command(BaseCommand):
+    help = (
+        'Precompute who-to-follow suggestions (friends of friends by mutual follow count). '
+        'By default only users whose follows changed since their last build; --full rebuilds everyone. '
+        'Run it from cron, e.g. incremental every few minutes and --full nightly.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild every user from the whole follow graph')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='Score shards in this many processes (default: inline)')
+        parser.add_argument('--shard-size', type=int, default=SHARD_SIZE)
+
+    def handle(self, *args, **options):
+        user_ids = None if options['full'] else stale_user_ids()
+        if user_ids is not None and not user_ids:
+            self.stdout.write('No users with changed follows')
+            return
+
+        def progress(done, total, elapsed):
+            self.stderr.write(f'  {done:,}/{total:,} users ({done / elapsed:,.0f}/s)')
+
+        started = time.perf_counter()
+        written = build_suggestions(user_ids, options['workers'], options['shard_size'], progress)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Built suggestions for {written:,} users in {elapsed:.1f}s ({written / max(elapsed, 1e-9):,.0f} users/s)'
+        ))
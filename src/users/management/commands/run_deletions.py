@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+
+from users.deletion import run_job
+from users.models import DeletionJob
+
+
+class Command(BaseCommand):
+    help = 'Run or resume pending account/post deletion jobs in the foreground.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('job_ids', nargs='*', type=int, help='Only run these jobs')
+
+    def handle(self, *args, **options):
+        jobs = DeletionJob.objects.exclude(status=DeletionJob.DONE).order_by('created_at')
+        if options['job_ids']:
+            jobs = jobs.filter(pk__in=options['job_ids'])
+        for job in jobs:
+            self.stdout.write(f'{job} - resuming at step {job.step or "start"}')
+            run_job(job)
+            self.stdout.write(self.style.SUCCESS(f'{job}'))
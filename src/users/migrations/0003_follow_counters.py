@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-19 10:26
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    UserProfile = apps.get_model('users', 'UserProfile')
+    Follow = apps.get_model('users', 'Follow')
+
+    def count_of(field):
+        counts = Follow.objects.filter(**{field: OuterRef('user_id')}).order_by().values(field).annotate(total=Count('*')).values('total')
+        return Coalesce(Subquery(counts), Value(0))
+
+    UserProfile.objects.update(followers_total=count_of('followed'), following_total=count_of('follower'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_deletionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='userprofile',
+            name='followers_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='following_total',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:02
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0004_revokedtoken'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='follow',
+            index=models.Index(fields=['created_at'], name='users_follo_created_8655d4_idx'),
+        ),
+    ]
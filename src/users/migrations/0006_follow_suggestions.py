@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:00
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('users', '0005_created_at_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FollowSuggestions',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='follow_suggestions', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('suggestions', models.JSONField(default=list, help_text='[user_id, mutual follows] pairs, best first')),
+                ('computed_at', models.DateTimeField(help_text='When the follow graph this was built from was read')),
+                ('follows_changed_at', models.DateTimeField(blank=True, help_text='Last follow/unfollow by this user', null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'follow suggestions',
+            },
+        ),
+    ]
@@ -1,19 +1,41 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.utils import timezone
 
+from teacup.dirty import SaveChangesMixin, track_changes
 
-class UserProfile(models.Model):
+from .autocomplete import forget_following, mark_stale
+from .blocks import forget_exclusions
+from .cards import CARD_USER_FIELDS, invalidate_card
+from .graph import record_change
+from .tokens import forget_principal
+
+COUNTER_FIELDS = {'followers_total', 'following_total'}
+
+# So User saves can be narrowed to the changed columns too (see teacup/dirty.py)
+track_changes(User)
+
+
+class UserProfile(SaveChangesMixin, models.Model):
     """Extended user profile with additional fields for social media functionality."""
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     bio = models.TextField(max_length=500, blank=True, null=True)
     profile_picture = models.URLField(blank=True, null=True, help_text="URL to profile picture")
     website = models.URLField(blank=True, null=True)
     location = models.CharField(max_length=100, blank=True, null=True)
+    # Denormalized follow counts, kept in sync by the Follow signals below and users.counters
+    followers_total = models.PositiveIntegerField(default=0)
+    following_total = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Profiles can be saved from stale instances, so never write the counters
+    # back unless asked to explicitly (update_fields)
+    untracked_fields = COUNTER_FIELDS
+
     def __str__(self):
         return f"{self.user.username}'s Profile"
 
@@ -46,6 +68,9 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'followed')
+        indexes = [
+            models.Index(fields=['created_at']),  # admin date filter
+        ]
         constraints = [
             models.CheckConstraint(
                 check=~models.Q(follower=models.F('followed')),
@@ -57,6 +82,108 @@ class Follow(models.Model):
         return f"{self.follower.username} follows {self.followed.username}"
 
 
+class Block(models.Model):
+    """One user blocking another: neither sees the other's content, and they can't follow or reply to each other."""
+    blocker = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocking')
+    blocked = models.ForeignKey(User, on_delete=models.CASCADE, related_name='blocked_by')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('blocker', 'blocked')
+        constraints = [
+            models.CheckConstraint(
+                check=~models.Q(blocker=models.F('blocked')),
+                name='users_cannot_block_themselves'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.blocker_id} blocks {self.blocked_id}"
+
+
+class Mute(models.Model):
+    """One user muting another: the muted user's content is hidden from the muter only."""
+    muter = models.ForeignKey(User, on_delete=models.CASCADE, related_name='muting')
+    muted = models.ForeignKey(User, on_delete=models.CASCADE, related_name='muted_by')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('muter', 'muted')
+        constraints = [
+            models.CheckConstraint(
+                check=~models.Q(muter=models.F('muted')),
+                name='users_cannot_mute_themselves'
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.muter_id} mutes {self.muted_id}"
+
+
+class FollowSuggestions(models.Model):
+    """A user's precomputed who-to-follow list (see users/suggestions.py)."""
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='follow_suggestions')
+    suggestions = models.JSONField(default=list, help_text="[user_id, mutual follows] pairs, best first")
+    computed_at = models.DateTimeField(help_text="When the follow graph this was built from was read")
+    follows_changed_at = models.DateTimeField(null=True, blank=True, help_text="Last follow/unfollow by this user")
+
+    class Meta:
+        verbose_name_plural = 'follow suggestions'
+
+    def __str__(self):
+        return f"Suggestions for user {self.user_id} ({len(self.suggestions)})"
+
+
+class DeletionJob(models.Model):
+    """
+    Progress of a chunked background deletion of an account or a post.
+
+    See users/deletion.py; the job is resumable from whatever step it got to.
+    """
+    USER = 'user'
+    POST = 'post'
+    KIND_CHOICES = [
+        (USER, 'User'),
+        (POST, 'Post'),
+    ]
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (RUNNING, 'Running'),
+        (DONE, 'Done'),
+    ]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField(help_text="ID of the user or post being deleted")
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    step = models.CharField(max_length=50, blank=True, help_text="Current step of the cascade")
+    rows_processed = models.PositiveBigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Delete {self.kind} {self.object_id} ({self.status}, {self.rows_processed} rows)"
+
+
+class RevokedToken(models.Model):
+    """A bearer token revoked before its expiry (see users/tokens.py); pruned once it would have expired."""
+    jti = models.CharField(max_length=32, unique=True)
+    user_id = models.BigIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Revoked token {self.jti} (user {self.user_id})"
+
+
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     """Automatically create a UserProfile when a User is created."""
@@ -66,6 +193,102 @@ def create_user_profile(sender, instance, created, **kwargs):
 
 @receiver(post_save, sender=User)
 def save_user_profile(sender, instance, **kwargs):
-    """Save the UserProfile when the User is saved."""
-    if hasattr(instance, 'profile'):
+    """Save the UserProfile along with the User, if it was loaded (a no-op unless it changed)."""
+    if User.profile.is_cached(instance):
         instance.profile.save()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_card(sender, instance, update_fields=None, **kwargs):
+    """Drop the cached author card when the user's name fields change."""
+    # e.g. the last_login update on every login doesn't touch the card
+    if update_fields is not None and not CARD_USER_FIELDS & set(update_fields):
+        return
+    invalidate_card(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+def invalidate_profile_card(sender, instance, update_fields=None, **kwargs):
+    """Drop the cached author card when the profile picture may have changed."""
+    if update_fields is not None and 'profile_picture' not in update_fields:
+        return
+    invalidate_card(instance.user_id)
+
+
+@receiver(post_save, sender=Follow)
+def increment_follow_totals(sender, instance, created, **kwargs):
+    """Bump both users' stored follow counters on a new follow."""
+    if created:
+        UserProfile.objects.filter(user_id=instance.followed_id).update(followers_total=F('followers_total') + 1)
+        UserProfile.objects.filter(user_id=instance.follower_id).update(following_total=F('following_total') + 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_follow_totals(sender, instance, **kwargs):
+    """Drop both users' stored follow counters on an unfollow."""
+    UserProfile.objects.filter(user_id=instance.followed_id, followers_total__gt=0).update(
+        followers_total=F('followers_total') - 1
+    )
+    UserProfile.objects.filter(user_id=instance.follower_id, following_total__gt=0).update(
+        following_total=F('following_total') - 1
+    )
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def refresh_autocomplete(sender, instance, update_fields=None, **kwargs):
+    """Tell the autocomplete indexes when a user appears, disappears or is renamed."""
+    if update_fields is not None and not (CARD_USER_FIELDS | {'is_active'}) & set(update_fields):
+        return
+    mark_stale(instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def forget_cached_following(sender, instance, **kwargs):
+    forget_following(instance.follower_id)
+
+
+@receiver(post_save, sender=Follow)
+def log_follow(sender, instance, created, **kwargs):
+    """Add the follow to the follow graph's delta log (users/graph.py)."""
+    if created:
+        record_change(instance.follower_id, instance.followed_id, True)
+
+
+@receiver(post_delete, sender=Follow)
+def log_unfollow(sender, instance, **kwargs):
+    record_change(instance.follower_id, instance.followed_id, False)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def mark_suggestions_stale(sender, instance, **kwargs):
+    """Flag the follower's suggestions for the next incremental build_suggestions run."""
+    FollowSuggestions.objects.filter(user_id=instance.follower_id).update(follows_changed_at=timezone.now())
+
+
+@receiver(post_save, sender=Block)
+@receiver(post_delete, sender=Block)
+def forget_block_exclusions(sender, instance, **kwargs):
+    """A block changes what both users get to see."""
+    forget_exclusions(instance.blocker_id, instance.blocked_id)
+
+
+@receiver(post_save, sender=Mute)
+@receiver(post_delete, sender=Mute)
+def forget_mute_exclusions(sender, instance, **kwargs):
+    forget_exclusions(instance.muter_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_user_principal(sender, instance, **kwargs):
+    """Drop the cached token principal so deactivation/password changes apply at once here."""
+    forget_principal(instance.pk)
+
+
+@receiver(post_save, sender=UserProfile)
+def forget_profile_principal(sender, instance, **kwargs):
+    forget_principal(instance.user_id)
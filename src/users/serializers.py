@@ -1,13 +1,96 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
+from django.contrib.auth import authenticate
 from django.contrib.auth.password_validation import validate_password
+from django.db import models
+from drf_spectacular.utils import extend_schema_field
+
+from teacup.dirty import save_changes
+from teacup.fieldsets import SparseFieldsMixin
+
+from .blocks import request_exclusions
+from .cards import card_memo, get_cards
 from .models import UserProfile, Follow
 
 
+class AuthorCardSerializer(serializers.Serializer):
+    """Shape of an author card; only used for documentation, see AuthorCardField."""
+    id = serializers.IntegerField()
+    username = serializers.CharField()
+    first_name = serializers.CharField()
+    last_name = serializers.CharField()
+    profile_picture = serializers.URLField(allow_null=True)
+
+
+class UserAutocompleteSerializer(AuthorCardSerializer):
+    """An autocomplete match: the author card plus ranking info."""
+    followers_count = serializers.IntegerField()
+    is_following = serializers.BooleanField()
+
+
+class ListedUserSerializer(AuthorCardSerializer):
+    """A user on your block or mute list, and since when."""
+    since = serializers.DateTimeField()
+
+
+class FollowSuggestionSerializer(AuthorCardSerializer):
+    """A who-to-follow suggestion: the author card plus how many people you follow follow them."""
+    mutual_follows = serializers.IntegerField()
+
+
+@extend_schema_field(AuthorCardSerializer)
+class AuthorCardField(serializers.Field):
+    """
+    Read-only embedded user, served from the author card cache (users/cards.py).
+
+    `source` should point at the foreign key's id attribute, e.g. 'author_id',
+    so the user row itself never needs to be loaded.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, user_id):
+        memo = card_memo(self.context)
+        if user_id not in memo:
+            get_cards([user_id], memo)
+        return memo.get(user_id)
+
+
+def user_sources(serializer):
+    """Sources of every AuthorCardField a serializer (class) declares, shown or not (?fields=, ?expand=)."""
+    return [field.source for field in serializer._declared_fields.values() if isinstance(field, AuthorCardField)]
+
+
+class CardListSerializer(serializers.ListSerializer):
+    """
+    List serializer that fetches every author card for the page in one go.
+
+    Rows whose users the viewer has blocked, muted or been blocked by are
+    left out. Paginated listings already leave them out in the query
+    (ExcludedUsersFilter in users/blocks.py); this catches unpaginated lists.
+    """
+
+    def to_representation(self, data):
+        items = list(data.all() if isinstance(data, models.manager.BaseManager) else data)
+        sources = user_sources(self.child)
+        excluded = request_exclusions(self.context) if sources else None
+        if excluded:
+            items = [item for item in items if not any(getattr(item, source) in excluded for source in sources)]
+        card_sources = [
+            field.source for field in self.child.fields.values() if isinstance(field, AuthorCardField)
+        ]
+        if card_sources:
+            user_ids = {getattr(item, source) for item in items for source in card_sources}
+            get_cards(user_ids, card_memo(self.context))
+        return super().to_representation(items)
+
+
 class UserProfileSerializer(serializers.ModelSerializer):
     """Serializer for UserProfile model."""
-    followers_count = serializers.ReadOnlyField()
-    following_count = serializers.ReadOnlyField()
+    followers_count = serializers.IntegerField(source='followers_total', read_only=True)
+    following_count = serializers.IntegerField(source='following_total', read_only=True)
 
     class Meta:
         model = UserProfile
@@ -18,7 +101,7 @@ class UserProfileSerializer(serializers.ModelSerializer):
         read_only_fields = ['created_at', 'updated_at']
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for User model with profile information."""
     profile = UserProfileSerializer(read_only=True)
     password = serializers.CharField(write_only=True, validators=[validate_password])
@@ -34,6 +117,8 @@ class UserSerializer(serializers.ModelSerializer):
         extra_kwargs = {
             'email': {'required': True},
         }
+        expandable = {'profile': None}
+        relations = {'profile': ('select', 'profile')}
 
     def validate(self, attrs):
         """Validate that passwords match."""
@@ -47,10 +132,8 @@ class UserSerializer(serializers.ModelSerializer):
         # Remove password_confirm since we don't need it in the DB
         validated_data.pop('password_confirm', None)
         password = validated_data.pop('password')
-        user = User.objects.create_user(**validated_data)
-        user.set_password(password)  # Hash the password properly
-        user.save()
-        return user
+        # One INSERT with the hashed password (create_user hashes it)
+        return User.objects.create_user(password=password, **validated_data)
 
     def update(self, instance, validated_data):
         """Update user instance."""
@@ -63,7 +146,7 @@ class UserSerializer(serializers.ModelSerializer):
         if password:
             instance.set_password(password)
         
-        instance.save()
+        save_changes(instance)  # only the columns that changed, if any
         return instance
 
 
@@ -75,21 +158,51 @@ class UserProfileUpdateSerializer(serializers.ModelSerializer):
         fields = ['bio', 'profile_picture', 'website', 'location']
 
 
-class UserListSerializer(serializers.ModelSerializer):
+class UserListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Simplified serializer for user lists."""
     profile = UserProfileSerializer(read_only=True)
     
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'profile']
+        expandable = {'profile': None}
+        relations = {'profile': ('select', 'profile')}
 
 
-class FollowSerializer(serializers.ModelSerializer):
+class FollowSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serializer for Follow model."""
-    follower = UserListSerializer(read_only=True)
-    followed = UserListSerializer(read_only=True)
+    follower = AuthorCardField(source='follower_id')
+    followed = AuthorCardField(source='followed_id')
     
     class Meta:
         model = Follow
         fields = ['id', 'follower', 'followed', 'created_at']
         read_only_fields = ['id', 'created_at']
+        list_serializer_class = CardListSerializer
+        expandable = {'follower': 'follower_id', 'followed': 'followed_id'}
+
+
+class TokenObtainSerializer(serializers.Serializer):
+    """Username/password in exchange for a bearer token pair."""
+    username = serializers.CharField()
+    password = serializers.CharField(write_only=True, style={'input_type': 'password'})
+
+    def validate(self, attrs):
+        user = authenticate(self.context.get('request'), username=attrs['username'], password=attrs['password'])
+        if user is None:
+            raise serializers.ValidationError("Invalid username or password.")
+        attrs['user'] = user
+        return attrs
+
+
+class TokenRefreshSerializer(serializers.Serializer):
+    """A refresh token to rotate (or revoke, where it's optional)."""
+    refresh = serializers.CharField()
+
+
+class TokenPairSerializer(serializers.Serializer):
+    """Shape of the token endpoints' responses."""
+    access = serializers.CharField()
+    refresh = serializers.CharField()
+    token_type = serializers.CharField()
+    expires_in = serializers.IntegerField()
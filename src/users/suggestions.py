@@ -0,0 +1,200 @@
+"""
+Who-to-follow suggestions, precomputed by a batch job.
+
+Friends of friends straight off the Follow table is a self-join that grows
+with (follows per user)^2, so it isn't done per request. Instead
+`manage.py build_suggestions` loads the follow graph into CSR arrays (indptr
+and indices, as in scipy.sparse: user u follows indices[indptr[u]:indptr[u+1]],
+most recent first) and, for every user, counts how many of the people they
+follow follow each candidate. The top FOLLOW_SUGGESTIONS_TOP_K candidates by
+that mutual count are stored as one FollowSuggestions row per user, so
+/users/suggestions/ is a primary key read.
+
+Users are split into shards that a pool of worker processes scores against
+the same graph; the parent writes each shard in one upsert.
+
+Follows and unfollows stamp the follower's row (follows_changed_at), and an
+incremental run (the default) only rebuilds those users plus anyone who has
+follows but no row yet, loading just the part of the graph they need. The
+followers of those users also see slightly different counts, which the next
+--full run picks up.
+"""
+import time
+from itertools import chain
+
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Follow, FollowSuggestions
+
+SHARD_SIZE = 2000
+# Ids per IN (...) when loading part of the graph
+LOAD_CHUNK = 500
+
+
+class FollowGraph:
+    """Follow edges in CSR form, indexed by user id."""
+
+    def __init__(self, indptr, indices, excluded=None):
+        self.indptr = indptr
+        self.indices = indices
+        # Users never suggested (inactive), as a boolean mask over ids
+        self.excluded = excluded if excluded is not None else np.zeros(len(indptr) - 1, dtype=bool)
+
+    @classmethod
+    def from_edges(cls, followers, followed, excluded_ids=()):
+        """Build from parallel follower/followed arrays; order within each user's row is kept."""
+        size = int(max(followers.max(initial=0), followed.max(initial=0))) + 1
+        order = np.argsort(followers, kind='stable')
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(followers, minlength=size), out=indptr[1:])
+        excluded = np.zeros(size, dtype=bool)
+        excluded_ids = np.fromiter((i for i in excluded_ids if i < size), dtype=np.int64)
+        excluded[excluded_ids] = True
+        return cls(indptr, followed[order], excluded)
+
+    @property
+    def size(self):
+        return len(self.indptr) - 1
+
+    def following(self, user_id):
+        if user_id >= self.size:
+            return self.indices[:0]
+        return self.indices[self.indptr[user_id]:self.indptr[user_id + 1]]
+
+    def suggest(self, user_id, limit, seed_follows):
+        """
+        Up to `limit` (user_id, mutual follows) pairs for `user_id`, best first.
+
+        Only the `seed_follows` most recent follows are expanded, which bounds
+        the work for people who follow a great many accounts.
+        """
+        followees = self.following(user_id)
+        seeds = followees[:seed_follows]
+        starts = self.indptr[seeds]
+        lengths = self.indptr[seeds + 1] - starts
+        total = int(lengths.sum())
+        if not total:
+            return []
+        # Concatenate the seeds' rows without a Python loop: each output slot's
+        # offset is its row start plus its position within the row
+        row_offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        candidates = self.indices[row_offsets + np.arange(total)]
+
+        ids, mutuals = np.unique(candidates, return_counts=True)
+        keep = (ids != user_id) & ~self.excluded[ids] & ~np.isin(ids, followees)
+        ids, mutuals = ids[keep], mutuals[keep]
+        order = np.lexsort((ids, -mutuals))[:limit]
+        return list(zip(ids[order].tolist(), mutuals[order].tolist()))
+
+
+def _edges(queryset):
+    """(followers, followed) arrays for a Follow queryset, most recent follows first."""
+    rows = queryset.order_by('-pk').values_list('follower_id', 'followed_id')
+    pairs = np.fromiter(chain.from_iterable(rows.iterator(chunk_size=10_000)), dtype=np.int64)
+    return pairs[0::2], pairs[1::2]
+
+
+def _chunks(ids, size=LOAD_CHUNK):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def load_graph(user_ids=None):
+    """
+    The whole follow graph, or with `user_ids` just what their suggestions need:
+    their own follows and the follows of everyone they follow.
+    """
+    inactive = User.objects.filter(is_active=False).values_list('pk', flat=True)
+    if user_ids is None:
+        return FollowGraph.from_edges(*_edges(Follow.objects.all()), excluded_ids=inactive)
+
+    parts = [_edges(Follow.objects.filter(follower_id__in=chunk)) for chunk in _chunks(user_ids)]
+    seeds = {user_id for _, followed in parts for user_id in followed.tolist()} - set(user_ids)
+    parts += [_edges(Follow.objects.filter(follower_id__in=chunk)) for chunk in _chunks(seeds)]
+    if not parts:
+        return FollowGraph.from_edges(np.zeros(0, np.int64), np.zeros(0, np.int64), excluded_ids=inactive)
+    followers = np.concatenate([followers for followers, _ in parts])
+    followed = np.concatenate([followed for _, followed in parts])
+    return FollowGraph.from_edges(followers, followed, excluded_ids=inactive)
+
+
+def stale_user_ids():
+    """Users whose follows changed since their suggestions were built, or who have follows but no row."""
+    changed = FollowSuggestions.objects.filter(follows_changed_at__gt=F('computed_at')).values_list('user_id', flat=True)
+    missing = (
+        Follow.objects.filter(follower__follow_suggestions__isnull=True)
+        .values_list('follower_id', flat=True).distinct()
+    )
+    return set(changed) | set(missing)
+
+
+# Set in each worker process by _init_worker
+_graph = None
+
+
+def _init_worker(graph):
+    global _graph
+    _graph = graph
+
+
+def _suggest_shard(user_ids):
+    limit = settings.FOLLOW_SUGGESTIONS_TOP_K
+    seed_follows = settings.FOLLOW_SUGGESTIONS_SEED_FOLLOWS
+    return [(user_id, _graph.suggest(user_id, limit, seed_follows)) for user_id in user_ids]
+
+
+def save_shard(results, computed_at):
+    """Upsert one shard's suggestion lists."""
+    FollowSuggestions.objects.bulk_create(
+        [
+            FollowSuggestions(user_id=user_id, suggestions=[list(pair) for pair in pairs], computed_at=computed_at)
+            for user_id, pairs in results
+        ],
+        update_conflicts=True,
+        unique_fields=['user'],
+        update_fields=['suggestions', 'computed_at'],
+    )
+
+
+def build_suggestions(user_ids=None, workers=0, shard_size=SHARD_SIZE, progress=None):
+    """
+    Rebuild suggestions for `user_ids` (default: every user with follows) and return how many were written.
+
+    computed_at is taken before the graph is read, so a follow that lands
+    while the job runs leaves its user stale for the next run.
+    """
+    computed_at = timezone.now()
+    started = time.perf_counter()
+    graph = load_graph(user_ids)
+    if user_ids is None:
+        # Everyone who follows someone, plus old rows of people who no longer do (they get an empty list)
+        user_ids = set(np.flatnonzero(np.diff(graph.indptr)).tolist())
+        user_ids |= set(FollowSuggestions.objects.values_list('user_id', flat=True))
+    shards = list(_chunks(sorted(user_ids), shard_size))
+
+    written = 0
+
+    def save(results):
+        nonlocal written
+        save_shard(results, computed_at)
+        written += len(results)
+        if progress:
+            progress(written, len(user_ids), time.perf_counter() - started)
+
+    if not workers or len(shards) < 2:
+        _init_worker(graph)
+        for shard in shards:
+            save(_suggest_shard(shard))
+        return written
+
+    import multiprocessing
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(graph,)) as pool:
+        # Workers only do NumPy; all database writes stay in this process
+        for results in pool.imap_unordered(_suggest_shard, shards):
+            save(results)
+    return written
@@ -0,0 +1,17 @@
+from django.conf import settings
+
+from taskqueue.queue import enqueue, task
+
+from .models import DeletionJob
+
+
+@task('users.run_deletion', max_attempts=10)
+def run_deletion(job_id):
+    """Advance a deletion job by a bounded number of chunks, requeueing until it's done."""
+    from .deletion import DELETION_TASK, run_job
+
+    job = DeletionJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return
+    if not run_job(job, max_chunks=settings.DELETION_CHUNKS_PER_TASK):
+        enqueue(DELETION_TASK, {'job_id': job_id})
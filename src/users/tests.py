@@ -1,9 +1,29 @@
-from django.test import TestCase
+import os
+import tempfile
+import time
+from io import StringIO
+from unittest import mock
+
+from django.core.management import CommandError, call_command
+from django.test import TestCase, override_settings
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, APITestCase
 from rest_framework import status
 from django.urls import reverse
-from .models import UserProfile, Follow
+from notifications.models import Inbox, Notification
+from posts.models import Post, Like, Comment, TagCount
+from taskqueue.queue import run_pending
+from .blocks import forget_exclusions
+from .autocomplete import PrefixIndex, following_ids, get_index, load_rows, reset_index
+from .graph import follower_ids, get_graph, is_following, mutual_ids, reset_graph
+from .management.commands.bench_writes import count_writes
+from .cards import get_cards
+from .tokens import BearerTokenAuthentication, principals, revocations
+from .models import UserProfile, Follow, DeletionJob, FollowSuggestions, Block, Mute
+from .suggestions import build_suggestions, load_graph, stale_user_ids
 
 
 class UserModelTest(TestCase):
@@ -122,3 +142,735 @@ class UserAPITest(APITestCase):
         data = {'bio': 'Hacked bio'}
         response = self.client.patch(url, data)
         self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_sparse_fields(self):
+        """Test ?fields= and ?omit= trim the user and skip the profile join when it isn't shown."""
+        url = reverse('user-detail', kwargs={'pk': self.user.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {'omit': 'profile'})
+        self.assertNotIn('profile', response.data)
+        self.assertIn('username', response.data)
+        self.assertNotIn('userprofile', queries[0]['sql'])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('user-list'), {'fields': 'id,username'})
+        self.assertEqual(set(response.data[0]), {'id', 'username'})
+        self.assertNotIn('password', queries[0]['sql'])
+        self.assertIn('profile', self.client.get(url).data)
+
+
+class AuthorCardTest(APITestCase):
+    """Test the shared author card cache."""
+
+    def setUp(self):
+        cache.clear()
+        self.authors = [
+            User.objects.create_user(username=f'author{i}', password='testpass123') for i in range(3)
+        ]
+
+    def test_cards_are_cached(self):
+        """Test cards load in one query and then come from the cache."""
+        ids = [author.pk for author in self.authors]
+        with self.assertNumQueries(1):
+            cards = get_cards(ids)
+        self.assertEqual(cards[ids[0]]['username'], 'author0')
+        with self.assertNumQueries(0):
+            get_cards(ids)
+
+    def test_profile_update_invalidates_card(self):
+        """Test changing the profile picture refreshes the card."""
+        author = self.authors[0]
+        get_cards([author.pk])
+        self.client.force_authenticate(user=author)
+        url = reverse('user-update-profile', kwargs={'pk': author.pk})
+        self.client.patch(url, {'profile_picture': 'https://example.com/me.png'})
+        self.assertEqual(get_cards([author.pk])[author.pk]['profile_picture'], 'https://example.com/me.png')
+
+    def test_post_list_queries_do_not_grow_with_authors(self):
+        """Test a post list loads every author card in one query."""
+        def list_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as ctx:
+                self.client.get(reverse('post-list'))
+            return len(ctx)
+
+        Post.objects.create(content='First', author=self.authors[0])
+        few = list_queries()
+        for author in self.authors:
+            for i in range(3):
+                Post.objects.create(content=f'Post {i}', author=author)
+        self.assertEqual(list_queries(), few)
+
+
+class DeletionTest(APITestCase):
+    """Test chunked background deletion of accounts and posts."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='leaving', password='testpass123')
+        self.other_user = User.objects.create_user(username='staying', password='testpass123')
+        self.other_post = Post.objects.create(content='Staying around', author=self.other_user)
+        self.posts = [Post.objects.create(content=f'Post {i}', author=self.user) for i in range(5)]
+        for post in self.posts:
+            Like.objects.create(user=self.other_user, post=post)
+            Comment.objects.create(author=self.other_user, post=post, content='Hi')
+        Like.objects.create(user=self.user, post=self.other_post)
+        Comment.objects.create(author=self.user, post=self.other_post, content='Bye')
+        Follow.objects.create(follower=self.other_user, followed=self.user)
+        Notification.objects.create(recipient=self.other_user, verb=Notification.LIKE,
+                                    post=self.other_post, last_actor=self.user)
+
+    @override_settings(DELETION_CHUNK_SIZE=2, DELETION_CHUNKS_PER_TASK=3)
+    def test_account_deletion_runs_in_chunks(self):
+        """Test the account disappears at once and its content in bounded chunks."""
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('user-detail', kwargs={'pk': self.user.pk}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.client.get(reverse('user-detail', kwargs={'pk': self.user.pk})).status_code, 404)
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+        run_pending()
+        job = DeletionJob.objects.get(pk=response.data['deletion_job'])
+        self.assertEqual(job.status, DeletionJob.DONE)
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertEqual(Post.all_objects.filter(author_id=self.user.pk).count(), 0)
+        self.assertEqual(Like.objects.count(), 0)
+        self.assertEqual(Comment.objects.count(), 0)
+        self.assertEqual(Follow.objects.count(), 0)
+        self.assertIsNone(Notification.objects.get().last_actor)
+
+        self.other_post.refresh_from_db()
+        self.assertEqual((self.other_post.likes_total, self.other_post.comments_total), (0, 0))
+        self.assertEqual(UserProfile.objects.get(user=self.other_user).following_total, 0)
+
+    @override_settings(DELETION_CHUNK_SIZE=1)
+    def test_account_deletion_takes_replies_along(self):
+        """Test replies under the user's comments go too, and the counters above them are recounted."""
+        top = Comment.objects.create(author=self.other_user, post=self.other_post, content='Top')
+        mine = Comment.objects.create(author=self.user, post=self.other_post, content='Mine', parent=top)
+        below = Comment.objects.create(author=self.other_user, post=self.other_post, content='Below', parent=mine)
+        Comment.objects.create(author=self.other_user, post=self.other_post, content='Under', parent=below)
+        kept = Comment.objects.create(author=self.other_user, post=self.other_post, content='Kept', parent=top)
+        top.refresh_from_db()
+        self.assertEqual(top.replies_total, 4)
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('user-detail', kwargs={'pk': self.user.pk}))
+        run_pending()
+        self.assertEqual(list(Comment.objects.filter(post=self.other_post).order_by('path')), [top, kept])
+        top.refresh_from_db()
+        self.other_post.refresh_from_db()
+        self.assertEqual((top.replies_total, self.other_post.comments_total), (1, 2))
+
+    def test_post_deletion_hides_then_deletes(self):
+        """Test a deleted post is hidden immediately and removed by the job."""
+        post = self.posts[0]
+        self.client.force_authenticate(user=self.user)
+        response = self.client.delete(reverse('post-detail', kwargs={'pk': post.pk}))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(self.client.get(reverse('post-detail', kwargs={'pk': post.pk})).status_code, 404)
+
+        call_command('run_deletions', stdout=StringIO())
+        self.assertFalse(Post.all_objects.filter(pk=post.pk).exists())
+        self.assertFalse(Like.objects.filter(post_id=post.pk).exists())
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 4)
+
+    def test_post_deletion_clears_unread_badges(self):
+        """Test unread notifications deleted with a post come off the recipient's unread count."""
+        post = self.posts[0]
+        for verb in (Notification.LIKE, Notification.COMMENT):
+            Notification.objects.create(recipient=self.user, verb=verb, post=post, last_actor=self.other_user)
+        Notification.objects.create(recipient=self.user, verb=Notification.LIKE, post=self.posts[1],
+                                    last_actor=self.other_user)
+        Notification.objects.create(recipient=self.user, verb=Notification.FOLLOW, post=post,
+                                    last_actor=self.other_user, is_read=True)
+        Inbox.objects.update_or_create(user=self.user, defaults={'unread_count': 3})
+
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('post-detail', kwargs={'pk': post.pk}))
+        run_pending()
+        self.assertEqual(Inbox.objects.get(user=self.user).unread_count, 1)
+        response = self.client.get(reverse('notification-unread-count'))
+        self.assertEqual(response.data['unread_count'], 1)
+
+    def test_deleted_posts_leave_trending_tags(self):
+        """Test the tag counts of deleted posts come off the trending buckets."""
+        Post.objects.create(content='Farewell #teacup', author=self.user)
+        doomed = Post.objects.create(content='Another #teacup', author=self.other_user)
+        Post.objects.create(content='Still here #teacup', author=self.other_user)
+        def count():
+            return sum(TagCount.objects.filter(tag='#teacup').values_list('count', flat=True))
+
+        self.assertEqual(count(), 3)
+
+        self.client.force_authenticate(user=self.other_user)
+        self.client.delete(reverse('post-detail', kwargs={'pk': doomed.pk}))
+        self.client.force_authenticate(user=self.user)
+        self.client.delete(reverse('user-detail', kwargs={'pk': self.user.pk}))
+        run_pending()
+        self.assertEqual(count(), 1)
+
+
+@override_settings(AUTOCOMPLETE_BACKGROUND_REFRESH=False)
+class AutocompleteTest(APITestCase):
+    """Test username autocomplete and the stored follow counters behind it."""
+
+    def setUp(self):
+        cache.clear()
+        reset_index()
+        self.viewer = User.objects.create_user(username='viewer', password='testpass123')
+        self.popular = User.objects.create_user(username='alice', password='testpass123')
+        self.followed = User.objects.create_user(username='alfred', password='testpass123')
+        self.quiet = User.objects.create_user(username='alberta', password='testpass123',
+                                              first_name='Bert')
+        User.objects.create_user(username='bob', password='testpass123')
+        for i in range(3):
+            fan = User.objects.create_user(username=f'fan{i}', password='testpass123')
+            Follow.objects.create(follower=fan, followed=self.popular)
+        self.url = reverse('user-autocomplete')
+
+    def usernames(self, response):
+        return [match['username'] for match in response.data]
+
+    def test_follow_counters_are_stored(self):
+        """Test follow/unfollow keep the profile counters in sync."""
+        profile = UserProfile.objects.get(user=self.popular)
+        self.assertEqual(profile.followers_total, 3)
+        Follow.objects.filter(followed=self.popular).first().delete()
+        profile.refresh_from_db()
+        self.assertEqual(profile.followers_total, 2)
+
+        # Saving a stale user/profile instance must not clobber the counters
+        self.popular.first_name = 'Alice'
+        self.popular.save()
+        profile.refresh_from_db()
+        self.assertEqual(profile.followers_total, 2)
+
+    def test_ranked_by_follower_count(self):
+        """Test anonymous results are ranked by follower count."""
+        response = self.client.get(self.url, {'q': 'Al'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.usernames(response)[0], 'alice')
+        self.assertEqual(set(self.usernames(response)), {'alice', 'alfred', 'alberta'})
+        self.assertEqual(response.data[0]['followers_count'], 3)
+
+    def test_followed_users_come_first(self):
+        """Test people the viewer follows outrank more popular users."""
+        self.client.force_authenticate(user=self.viewer)
+        self.client.post(reverse('user-follow', kwargs={'pk': self.followed.pk}))
+        response = self.client.get(self.url, {'q': 'al', 'limit': 2})
+        self.assertEqual(self.usernames(response), ['alfred', 'alice'])
+        self.assertTrue(response.data[0]['is_following'])
+        self.assertFalse(response.data[1]['is_following'])
+
+    def test_matches_names_and_new_users(self):
+        """Test names match too and new or deactivated users show up on the next lookup."""
+        self.assertEqual(self.usernames(self.client.get(self.url, {'q': 'ber'})), ['alberta'])
+        User.objects.create_user(username='bertie', password='testpass123')
+        self.quiet.is_active = False
+        self.quiet.save(update_fields=['is_active'])
+        self.assertEqual(self.usernames(self.client.get(self.url, {'q': 'ber'})), ['bertie'])
+        self.assertEqual(self.client.get(self.url, {'q': ''}).data, [])
+
+    def test_user_changes_patch_the_index(self):
+        """Test sign-ups, renames and deactivations patch each process's index instead of rebuilding it."""
+        self.client.get(self.url, {'q': 'al'})
+        User.objects.create_user(username='alvin', password='testpass123')
+        self.followed.username = 'zed'
+        self.followed.save()
+        self.popular.is_active = False
+        self.popular.save(update_fields=['is_active'])
+        with mock.patch('users.autocomplete.PrefixIndex', side_effect=AssertionError('rebuilt')):
+            response = self.client.get(self.url, {'q': 'al'})
+        self.assertEqual(self.usernames(response), ['alberta', 'alvin'])
+
+        patched = get_index()
+        fresh = PrefixIndex(load_rows())
+        self.assertEqual((patched.keys, patched.ids), (fresh.keys, fresh.ids))
+        for prefix in ('a', 'al', 'z', 'ze'):
+            self.assertEqual(patched.top_matches(prefix), fresh.top_matches(prefix), prefix)
+
+
+class BearerTokenTest(APITestCase):
+    """Test signed bearer tokens: login, cached principal, rotation and revocation."""
+
+    def setUp(self):
+        principals.clear()
+        revocations.clear()
+        self.user = User.objects.create_user(username='tokenuser', password='testpass123')
+        response = self.client.post(reverse('token-list'), {'username': 'tokenuser', 'password': 'testpass123'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.tokens = response.data
+        self.me = reverse('user-detail', kwargs={'pk': self.user.pk})
+
+    def bearer(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_wrong_password(self):
+        """Test bad credentials get a 400 and no token."""
+        response = self.client.post(reverse('token-list'), {'username': 'tokenuser', 'password': 'nope'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertNotIn('access', response.data)
+
+    def test_authenticated_requests_skip_auth_queries(self):
+        """Test the user comes from the principal cache after the first request."""
+        self.bearer(self.tokens['access'])
+        self.client.patch(self.me, {'first_name': 'Warm'})  # fills the caches
+        principals.clear()
+        self.client.get(reverse('notification-list'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('notification-list'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tables = ' '.join(query['sql'] for query in queries.captured_queries)
+        self.assertNotIn('auth_user', tables)
+        self.assertNotIn('django_session', tables)
+        self.assertNotIn('users_revokedtoken', tables)
+
+    def test_requests_get_their_own_principal(self):
+        """Test changes a request makes to request.user or its profile don't reach later requests."""
+        def request_user():
+            request = APIRequestFactory().get(self.me, HTTP_AUTHORIZATION=f'Bearer {self.tokens["access"]}')
+            return BearerTokenAuthentication().authenticate(request)[0]
+
+        first = request_user()
+        first.first_name = 'Changed'
+        first.profile.bio = 'Changed'
+        second = request_user()
+        self.assertIsNot(second.profile, first.profile)
+        stored = User.objects.select_related('profile').get(pk=self.user.pk)
+        self.assertEqual((second.first_name, second.profile.bio), (stored.first_name, stored.profile.bio))
+
+    def test_refresh_rotates(self):
+        """Test a refresh token gives a new pair exactly once."""
+        url = reverse('token-refresh')
+        response = self.client.post(url, {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response.data['refresh'], self.tokens['refresh'])
+        again = self.client.post(url, {'refresh': self.tokens['refresh']})
+        self.assertEqual(again.status_code, status.HTTP_401_UNAUTHORIZED)
+        # Access tokens aren't accepted as refresh tokens and vice versa
+        self.assertEqual(self.client.post(url, {'refresh': self.tokens['access']}).status_code, 401)
+        self.bearer(response.data['refresh'])
+        self.assertEqual(self.client.get(self.me).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        # A second refresh racing the first gets past the revocation check but not the revoke
+        with mock.patch('users.views.is_revoked', return_value=False):
+            raced = self.client.post(url, {'refresh': self.tokens['refresh']})
+        self.assertEqual(raced.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_revoke_and_password_change(self):
+        """Test logout and password changes invalidate existing tokens."""
+        self.bearer(self.tokens['access'])
+        response = self.client.post(reverse('token-revoke'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.get(self.me).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials()
+        refreshed = self.client.post(reverse('token-refresh'), {'refresh': self.tokens['refresh']})
+        self.assertEqual(refreshed.status_code, status.HTTP_401_UNAUTHORIZED)
+
+        tokens = self.client.post(reverse('token-list'), {'username': 'tokenuser', 'password': 'testpass123'}).data
+        self.user.set_password('newpass456')
+        self.user.save()
+        self.bearer(tokens['access'])
+        self.assertEqual(self.client.get(self.me).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_expired_token(self):
+        """Test access tokens stop working after AUTH_TOKEN_TTL."""
+        self.bearer(self.tokens['access'])
+        with mock.patch('django.core.signing.time.time', return_value=time.time() + 7200):
+            response = self.client.get(self.me)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertIn('Bearer', response['WWW-Authenticate'])
+
+
+class WriteCountTest(APITestCase):
+    """Test saves only write what changed (teacup/dirty.py)."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='writer', password='testpass123')
+
+    def writes(self, run):
+        with CaptureQueriesContext(connection) as ctx:
+            run()
+        return count_writes(ctx.captured_queries)
+
+    def test_register(self):
+        """Test sign-up is one user INSERT and one profile INSERT."""
+        data = {
+            'username': 'newbie', 'email': 'new@example.com',
+            'password': 'complexpass123', 'password_confirm': 'complexpass123',
+        }
+        writes = self.writes(lambda: self.client.post(reverse('user-list'), data))
+        self.assertEqual(writes, {('INSERT', 'auth_user'): 1, ('INSERT', 'users_userprofile'): 1})
+        self.assertTrue(User.objects.get(username='newbie').check_password('complexpass123'))
+
+    def test_login_leaves_profile_alone(self):
+        """Test the last_login update doesn't re-save the profile."""
+        writes = self.writes(lambda: self.client.login(username='writer', password='testpass123'))
+        self.assertEqual(writes[('UPDATE', 'auth_user')], 1)
+        self.assertNotIn(('UPDATE', 'users_userprofile'), writes)
+
+    def test_updates(self):
+        """Test profile/user updates write only changed columns and no-op updates write nothing."""
+        self.client.force_authenticate(user=self.user)
+        profile_url = reverse('user-update-profile', kwargs={'pk': self.user.pk})
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(profile_url, {'bio': 'Hello'})
+        updates = [q['sql'] for q in ctx.captured_queries if q['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('"bio"', updates[0])
+        self.assertNotIn('"website"', updates[0])
+        self.assertNotIn('"followers_total"', updates[0])
+        self.assertEqual(self.writes(lambda: self.client.patch(profile_url, {'bio': 'Hello'})), {})
+
+        user_url = reverse('user-detail', kwargs={'pk': self.user.pk})
+        self.assertEqual(self.writes(lambda: self.client.patch(user_url, {'first_name': 'Wri'})),
+                         {('UPDATE', 'auth_user'): 1})
+        self.assertEqual(self.writes(lambda: self.client.patch(user_url, {'first_name': 'Wri'})), {})
+        self.assertEqual(User.objects.get(pk=self.user.pk).first_name, 'Wri')
+
+    def test_stale_profile_keeps_counters(self):
+        """Test saving a stale profile doesn't overwrite the follow counters."""
+        profile = UserProfile.objects.get(user=self.user)
+        Follow.objects.create(follower=User.objects.create_user(username='fan'), followed=self.user)
+        profile.bio = 'Stale'
+        profile.save()
+        profile = UserProfile.objects.get(user=self.user)
+        self.assertEqual((profile.bio, profile.followers_total), ('Stale', 1))
+
+    def test_bench_command(self):
+        """Test bench_writes reports each scenario and leaves no data behind."""
+        out = StringIO()
+        call_command('bench_writes', stdout=out)
+        self.assertIn('register                     2 writes', out.getvalue())
+        self.assertFalse(User.objects.filter(username='bench_writes_user').exists())
+
+
+class FollowSuggestionsTest(APITestCase):
+    """Test precomputed who-to-follow suggestions."""
+
+    def setUp(self):
+        cache.clear()
+        names = ['viewer', 'amy', 'ben', 'cat', 'dan', 'eve']
+        self.users = {name: User.objects.create_user(username=name, password='testpass123') for name in names}
+        # viewer follows amy and ben; both follow cat, only ben follows dan
+        for follower, followed in [('viewer', 'amy'), ('viewer', 'ben'), ('amy', 'cat'), ('ben', 'cat'),
+                                   ('ben', 'dan'), ('amy', 'ben')]:
+            self.follow(follower, followed)
+        self.client.force_authenticate(user=self.users['viewer'])
+        self.url = reverse('user-suggestions')
+
+    def follow(self, follower, followed):
+        Follow.objects.create(follower=self.users[follower], followed=self.users[followed])
+
+    def suggested(self, **params):
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(match['username'], match['mutual_follows']) for match in response.data]
+
+    def test_graph(self):
+        """Test the CSR graph and mutual counts, excluding yourself, people you follow and inactive users."""
+        graph = load_graph()
+        viewer, amy, ben, cat, dan = (self.users[name].pk for name in ['viewer', 'amy', 'ben', 'cat', 'dan'])
+        self.assertEqual(set(graph.following(viewer).tolist()), {amy, ben})
+        self.assertEqual(graph.following(10 ** 6).tolist(), [])
+        self.assertEqual(graph.suggest(viewer, 10, 500), [(cat, 2), (dan, 1)])
+        self.assertEqual(graph.suggest(viewer, 1, 500), [(cat, 2)])
+        self.assertEqual(graph.suggest(amy, 10, 500), [(dan, 1)])
+
+        self.users['dan'].is_active = False
+        self.users['dan'].save(update_fields=['is_active'])
+        self.assertEqual(load_graph().suggest(viewer, 10, 500), [(cat, 2)])
+
+    def test_endpoint(self):
+        """Test the endpoint serves the stored list and drops people followed since."""
+        self.assertEqual(self.suggested(), [])
+        self.assertEqual(build_suggestions(), 3)
+        self.assertEqual(self.suggested(), [('cat', 2), ('dan', 1)])
+        self.assertEqual(self.suggested(limit=1), [('cat', 2)])
+
+        self.follow('viewer', 'cat')
+        cache.clear()
+        self.assertEqual(self.suggested(), [('dan', 1)])
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_incremental(self):
+        """Test only users whose follows changed (or who have no list yet) are rebuilt."""
+        build_suggestions()
+        self.assertEqual(stale_user_ids(), set())
+        self.follow('viewer', 'eve')
+        self.follow('eve', 'amy')
+        self.follow('dan', 'eve')
+        self.assertEqual(stale_user_ids(), {self.users[name].pk for name in ['viewer', 'eve', 'dan']})
+
+        Follow.objects.filter(follower=self.users['viewer'], followed=self.users['ben']).delete()
+        out = StringIO()
+        call_command('build_suggestions', stdout=out, stderr=StringIO())
+        self.assertIn('Built suggestions for 3 users', out.getvalue())
+        self.assertEqual(stale_user_ids(), set())
+        stored = FollowSuggestions.objects.get(user=self.users['viewer']).suggestions
+        # Through amy only now; ben is back as a suggestion, amy is followed already
+        self.assertEqual(stored, [[self.users['ben'].pk, 1], [self.users['cat'].pk, 1]])
+
+    def test_workers(self):
+        """Test sharding across worker processes gives the same lists."""
+        build_suggestions(shard_size=2)
+        inline = dict(FollowSuggestions.objects.values_list('user_id', 'suggestions'))
+        FollowSuggestions.objects.all().delete()
+        call_command('build_suggestions', '--full', '--workers', '2', '--shard-size', '1',
+                     stdout=StringIO(), stderr=StringIO())
+        self.assertEqual(dict(FollowSuggestions.objects.values_list('user_id', 'suggestions')), inline)
+
+
+class FollowGraphTest(APITestCase):
+    """Test the memory-mapped follow graph snapshot and its delta log."""
+
+    def setUp(self):
+        cache.clear()
+        reset_graph()
+        self.addCleanup(reset_graph)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'follow_graph.npy')
+        settings = override_settings(FOLLOW_GRAPH_PATH=self.path, FOLLOW_GRAPH_CHECK_SECONDS=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.a, self.b, self.c, self.d = (
+            User.objects.create_user(username=name, password='testpass123') for name in 'abcd'
+        )
+        for follower, followed in [(self.a, self.b), (self.a, self.c), (self.b, self.a), (self.c, self.b)]:
+            self.follow(follower, followed)
+
+    def follow(self, follower, followed):
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.create(follower=follower, followed=followed)
+
+    def lookups(self):
+        a, b, c, d = self.a.pk, self.b.pk, self.c.pk, self.d.pk
+        return (
+            sorted(following_ids(a)), sorted(follower_ids(b)), mutual_ids(a),
+            is_following(a, b), is_following(b, c), is_following(d, a),
+        )
+
+    def test_snapshot_matches_database(self):
+        """Test lookups answer the same from the snapshot as from the database."""
+        self.assertIsNone(get_graph())
+        from_database = self.lookups()
+        call_command('build_follow_graph', stdout=StringIO())
+        self.assertIsNotNone(get_graph())
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.lookups(), from_database)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(from_database, (
+            sorted([self.b.pk, self.c.pk]), sorted([self.a.pk, self.c.pk]), [self.b.pk], True, False, False,
+        ))
+        self.assertEqual(get_graph().following(10 ** 6), [])
+
+    def test_delta_log(self):
+        """Test follows and unfollows after a build show up without a rebuild, and a rebuild absorbs them."""
+        call_command('build_follow_graph', stdout=StringIO())
+        self.follow(self.d, self.a)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.a, followed=self.c).delete()
+        self.follow(self.a, self.d)
+        with self.captureOnCommitCallbacks(execute=True):
+            Follow.objects.filter(follower=self.a, followed=self.d).delete()
+        self.follow(self.a, self.d)
+
+        graph = get_graph()
+        self.assertEqual(graph.following(self.a.pk), [self.b.pk, self.d.pk])
+        self.assertEqual(graph.followers(self.a.pk), sorted([self.b.pk, self.d.pk]))
+        self.assertTrue(is_following(self.d.pk, self.a.pk))
+        self.assertFalse(is_following(self.a.pk, self.c.pk))
+        self.assertEqual(mutual_ids(self.a.pk), sorted([self.b.pk, self.d.pk]))
+
+        # The feed reads follows from the graph too
+        post = Post.objects.create(content='From d', author=self.d)
+        self.client.force_authenticate(user=self.a)
+        response = self.client.get(reverse('feed-my-feed'))
+        self.assertIn(post.pk, [item['id'] for item in response.data['results']])
+
+        call_command('build_follow_graph', stdout=StringIO())
+        rebuilt = get_graph()
+        self.assertIsNot(rebuilt, graph)
+        self.assertEqual(rebuilt.added_out, {})
+        self.assertEqual(rebuilt.following(self.a.pk), [self.b.pk, self.d.pk])
+
+    def test_falls_back_when_log_is_lost(self):
+        """Test a flushed cache or an oversized delta log sends lookups back to the database."""
+        call_command('build_follow_graph', stdout=StringIO())
+        self.follow(self.d, self.c)
+        self.assertIsNotNone(get_graph())
+        cache.clear()
+        self.assertIsNone(get_graph())
+        self.assertTrue(is_following(self.d.pk, self.c.pk))
+
+        call_command('build_follow_graph', stdout=StringIO())
+        with override_settings(FOLLOW_GRAPH_MAX_DELTA=1):
+            self.follow(self.b, self.c)
+            self.follow(self.b, self.d)
+            self.assertIsNone(get_graph())
+
+    def test_command_needs_a_path(self):
+        with override_settings(FOLLOW_GRAPH_PATH=''):
+            with self.assertRaises(CommandError):
+                call_command('build_follow_graph', stdout=StringIO())
+
+
+class BlockMuteTest(APITestCase):
+    """Test blocking and muting, and that listings skip the people involved."""
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.viewer, self.troll, self.bore, self.friend = (
+            User.objects.create_user(username=name, password='testpass123')
+            for name in ['viewer', 'troll', 'bore', 'friend']
+        )
+        for author in (self.troll, self.bore, self.friend):
+            Follow.objects.create(follower=self.viewer, followed=author)
+        Follow.objects.create(follower=self.troll, followed=self.viewer)
+        self.posts = {user.username: Post.objects.create(content=f'By {user.username}', author=user)
+                      for user in (self.viewer, self.troll, self.bore, self.friend)}
+        self.client.force_authenticate(user=self.viewer)
+
+    def act(self, name, user):
+        return self.client.post(reverse(f'user-{name}', kwargs={'pk': user.pk}))
+
+    def authors(self, url):
+        data = self.client.get(url).data
+        items = data['results'] if isinstance(data, dict) else data
+        return {item['author']['username'] for item in items}
+
+    def test_block_and_mute(self):
+        """Test the endpoints, and that blocking drops follows both ways."""
+        self.assertEqual(self.act('block', self.troll).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.act('block', self.troll).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.act('block', self.viewer).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Follow.objects.filter(follower=self.viewer, followed=self.troll).exists())
+        self.assertFalse(Follow.objects.filter(follower=self.troll, followed=self.viewer).exists())
+        self.viewer.profile.refresh_from_db()
+        self.assertEqual((self.viewer.profile.followers_count, self.viewer.profile.following_count), (0, 2))
+
+        self.assertEqual(self.act('mute', self.bore).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.act('mute', self.bore).status_code, status.HTTP_400_BAD_REQUEST)
+        # Muting leaves the follow alone
+        self.assertTrue(Follow.objects.filter(follower=self.viewer, followed=self.bore).exists())
+
+        self.assertEqual(self.act('unblock', self.troll).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.act('unblock', self.troll).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.act('unmute', self.bore).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.act('unmute', self.bore).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Block.objects.exists() or Mute.objects.exists())
+
+    def test_blocked_cannot_follow_or_comment(self):
+        """Test a block stops follows and comments in both directions."""
+        self.act('block', self.troll)
+        self.client.force_authenticate(user=self.troll)
+        self.assertEqual(self.act('follow', self.viewer).status_code, status.HTTP_403_FORBIDDEN)
+        post = self.posts['viewer']
+        response = self.client.post(reverse('post-add-comment', kwargs={'pk': post.pk}), {'content': 'Hi'})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        response = self.client.post(reverse('comment-list'), {'content': 'Hi', 'post': post.pk})
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertFalse(Comment.objects.exists())
+
+        self.client.force_authenticate(user=self.viewer)
+        self.assertEqual(self.act('follow', self.troll).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_listings_skip_blocked_and_muted(self):
+        """Test feeds, post lists, comments, likes and follow lists leave them out."""
+        everyone = {'viewer', 'troll', 'bore', 'friend'}
+        self.assertEqual(self.authors(reverse('feed-my-feed')), everyone)
+        post = self.posts['viewer']
+        for user in (self.troll, self.bore, self.friend):
+            Comment.objects.create(post=post, author=user, content='Hi')
+            Like.objects.create(post=post, user=user)
+
+        self.act('block', self.troll)
+        self.act('mute', self.bore)
+        for url in (reverse('feed-my-feed'), reverse('feed-discover'), reverse('feed-trending'),
+                    reverse('post-list')):
+            self.assertEqual(self.authors(url), {'viewer', 'friend'}, url)
+        self.assertEqual(self.authors(reverse('post-comments', kwargs={'pk': post.pk})), {'friend'})
+        likes = self.client.get(reverse('post-likes', kwargs={'pk': post.pk})).data
+        self.assertEqual([like['user']['username'] for like in likes], ['friend'])
+        following = self.client.get(reverse('user-following', kwargs={'pk': self.viewer.pk})).data
+        self.assertEqual([row['followed']['username'] for row in following], ['friend'])
+        # Even when the author isn't in the response
+        ids = {item['id'] for item in self.client.get(reverse('feed-discover'), {'fields': 'id'}).data['results']}
+        self.assertEqual(ids, {self.posts['viewer'].pk, self.posts['friend'].pk})
+
+        # The blocked user doesn't see the blocker either; the muted one still does
+        self.client.force_authenticate(user=self.troll)
+        self.assertNotIn('viewer', self.authors(reverse('feed-discover')))
+        self.client.force_authenticate(user=self.bore)
+        self.assertIn('viewer', self.authors(reverse('feed-discover')))
+
+    def test_lists(self):
+        """Test the paginated blocked and muted lists."""
+        self.act('block', self.troll)
+        self.act('block', self.friend)
+        self.act('mute', self.bore)
+        response = self.client.get(reverse('user-blocked'), {'page_size': 1})
+        self.assertEqual(response.data['count'], 2)
+        self.assertEqual([user['username'] for user in response.data['results']], ['friend'])
+        self.assertIn('since', response.data['results'][0])
+        response = self.client.get(reverse('user-muted'))
+        self.assertEqual([user['username'] for user in response.data['results']], ['bore'])
+        self.client.force_authenticate(user=None)
+        self.assertEqual(self.client.get(reverse('user-blocked')).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_pages_stay_full(self):
+        """Test blocked and muted users are left out before paginating, so pages and counts line up."""
+        for i in range(3):
+            Post.objects.create(content=f'More #noise {i}', author=self.troll)
+            Post.objects.create(content=f'More #noise {i}', author=self.bore)
+        Post.objects.create(content='Signal #noise', author=self.friend)
+        self.act('block', self.troll)
+        self.act('mute', self.bore)
+
+        # The viewer's own posts aren't for_you candidates
+        for name, count in [('my-feed', 3), ('discover', 3), ('trending', 3), ('for-you', 2)]:
+            response = self.client.get(reverse(f'feed-{name}'), {'page_size': 1})
+            self.assertEqual((response.data['count'], len(response.data['results'])), (count, 1), name)
+        response = self.client.get(reverse('tag-detail', kwargs={'tag': 'noise'}), {'page_size': 1})
+        self.assertEqual([post['author']['username'] for post in response.data['results']], ['friend'])
+        self.assertIsNone(response.data['next'])
+
+        Notification.objects.bulk_create([
+            Notification(recipient=self.viewer, verb=Notification.FOLLOW, last_actor=self.friend),
+            Notification(recipient=self.viewer, verb=Notification.FOLLOW, last_actor=None, is_read=True),
+        ] + [
+            Notification(recipient=self.viewer, verb=Notification.LIKE, last_actor=self.bore,
+                         post=Post.objects.create(content=f'Mine {i}', author=self.viewer))
+            for i in range(3)
+        ])
+        response = self.client.get(reverse('notification-list'), {'page_size': 2})
+        self.assertEqual([row['verb'] for row in response.data['results']], [Notification.FOLLOW] * 2)
+
+    def test_feed_queries_dont_grow(self):
+        """Test a long block list costs the feed no extra queries, nor longer ones."""
+        def feed_queries():
+            forget_exclusions(self.viewer.pk)
+            self.client.get(reverse('feed-discover'))  # warm the caches
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('feed-discover'))
+            return len(queries), max(len(query['sql']) for query in queries)
+
+        self.act('block', self.troll)
+        self.act('mute', self.bore)
+        before = feed_queries()
+        others = User.objects.bulk_create([User(username=f'blocked{i}') for i in range(300)])
+        Block.objects.bulk_create([Block(blocker=self.viewer, blocked=user) for user in others[:200]])
+        Mute.objects.bulk_create([Mute(muter=self.viewer, muted=user) for user in others[200:]])
+        self.assertEqual(feed_queries(), before)
+
+    def test_bench_command(self):
+        out = StringIO()
+        call_command('bench_blocks', '--blocked', '20', '--authors', '3', '--posts', '2', '--repeat', '1',
+                     stdout=out)
+        self.assertIn('20 blocked', out.getvalue())
+        self.assertFalse(User.objects.filter(username__startswith='bench_blocks_').exists())
@@ -0,0 +1,199 @@
+"""
+Stateless bearer tokens for the API.
+
+    Authorization: Bearer <access token>
+
+Tokens are signed with SECRET_KEY (django.core.signing), so checking one
+needs no database: the payload carries the user id, a random token id (jti),
+the token type and a fragment of the user's session auth hash, which means
+changing the password invalidates every token issued before.
+
+Access tokens live AUTH_TOKEN_TTL seconds. POST /auth/token/refresh/ trades a
+refresh token for a new pair and revokes the old refresh token (rotation),
+and POST /auth/token/revoke/ revokes tokens on logout. Revoked ids are stored
+in RevokedToken until they'd have expired anyway; each process remembers
+lookups in an LRU for AUTH_REVOCATION_CACHE_SECONDS, so a revocation takes at
+most that long to reach the other processes.
+
+The user and profile are kept in a small per-process TTL cache, so an
+authenticated request normally does no auth queries at all. Saving the user
+or profile drops the entry in this process; other processes pick changes up
+within AUTH_PRINCIPAL_CACHE_SECONDS.
+"""
+import copy
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+SALT = 'users.tokens'
+ACCESS = 'access'
+REFRESH = 'refresh'
+KEYWORD = 'Bearer'
+HASH_LENGTH = 12
+FOREVER = None
+_DEFAULT = object()
+
+
+class TTLCache:
+    """A small thread-safe LRU whose entries also expire after `ttl` seconds (FOREVER: never)."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=_DEFAULT):
+        ttl = self.ttl if ttl is _DEFAULT else ttl
+        with self._lock:
+            self._data[key] = (value, None if ttl is None else time.monotonic() + ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+principals = TTLCache(maxsize=10_000, ttl=settings.AUTH_PRINCIPAL_CACHE_SECONDS)
+revocations = TTLCache(maxsize=100_000, ttl=settings.AUTH_REVOCATION_CACHE_SECONDS)
+
+
+def _user_hash(user):
+    return user.get_session_auth_hash()[:HASH_LENGTH]
+
+
+def user_hash_matches(user, payload):
+    """False once the user changed their password after the token was issued."""
+    return secrets.compare_digest(_user_hash(user), payload.get('h', ''))
+
+
+def _ttl(kind):
+    return settings.AUTH_TOKEN_TTL if kind == ACCESS else settings.AUTH_REFRESH_TOKEN_TTL
+
+
+def make_token(user, kind=ACCESS):
+    payload = {'u': user.pk, 'j': secrets.token_hex(8), 't': kind, 'h': _user_hash(user)}
+    return signing.dumps(payload, salt=SALT, compress=False)
+
+
+def issue_tokens(user):
+    """A fresh access/refresh pair, in the shape the token endpoints return."""
+    return {
+        'access': make_token(user, ACCESS),
+        'refresh': make_token(user, REFRESH),
+        'token_type': KEYWORD,
+        'expires_in': settings.AUTH_TOKEN_TTL,
+    }
+
+
+def read_token(token, kind=ACCESS):
+    """The payload of a valid, unexpired token of the given kind, else AuthenticationFailed."""
+    try:
+        payload = signing.loads(token, salt=SALT, max_age=_ttl(kind))
+    except signing.SignatureExpired:
+        raise exceptions.AuthenticationFailed(_('Token has expired.'))
+    except signing.BadSignature:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if payload.get('t') != kind:
+        raise exceptions.AuthenticationFailed(_('Wrong token type.'))
+    return payload
+
+
+def is_revoked(jti):
+    from .models import RevokedToken
+
+    revoked = revocations.get(jti)
+    if revoked is None:
+        revoked = RevokedToken.objects.filter(jti=jti).exists()
+        # A revocation is final, so only "not revoked" answers need rechecking
+        revocations.set(jti, revoked, ttl=FOREVER if revoked else settings.AUTH_REVOCATION_CACHE_SECONDS)
+    return revoked
+
+
+def revoke(payload, kind):
+    """
+    Revoke a token (by its payload) until it would have expired anyway.
+
+    Returns False if it was already revoked. The unique jti decides between
+    concurrent calls, so exactly one of them gets True.
+    """
+    from .models import RevokedToken
+
+    now = timezone.now()
+    _, created = RevokedToken.objects.get_or_create(
+        jti=payload['j'], defaults={'user_id': payload['u'], 'expires_at': now + timedelta(seconds=_ttl(kind))}
+    )
+    revocations.set(payload['j'], True, ttl=FOREVER)
+    RevokedToken.objects.filter(expires_at__lt=now).delete()
+    return created
+
+
+def get_principal(user_id):
+    """Active user with its profile loaded, from the TTL cache when possible."""
+    user = principals.get(user_id)
+    if user is None:
+        user = User.objects.filter(pk=user_id, is_active=True).select_related('profile').first()
+        if user is None:
+            return None
+        principals.set(user_id, user)
+    # Each request gets its own copy, related objects (the profile) included,
+    # so nothing it does leaks into the cache
+    return copy.deepcopy(user)
+
+
+def forget_principal(user_id):
+    principals.delete(user_id)
+
+
+class BearerTokenAuthentication(BaseAuthentication):
+    """DRF authentication for `Authorization: Bearer <access token>`."""
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != KEYWORD.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+        try:
+            token = auth[1].decode()
+        except UnicodeError:
+            raise exceptions.AuthenticationFailed(_('Invalid token header.'))
+
+        payload = read_token(token, ACCESS)
+        if is_revoked(payload['j']):
+            raise exceptions.AuthenticationFailed(_('Token has been revoked.'))
+        user = get_principal(payload['u'])
+        if user is None or not user_hash_matches(user, payload):
+            raise exceptions.AuthenticationFailed(_('Token is no longer valid.'))
+        return user, payload
+
+    def authenticate_header(self, request):
+        return f'{KEYWORD} realm="api"'
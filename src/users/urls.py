@@ -1,10 +1,20 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet
+from .views import UserViewSet, TokenViewSet
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
+router.register(r'auth/token', TokenViewSet, basename='token')
 
 urlpatterns = [
     path('', include(router.urls)),
 ]
+
+# Async read paths in front of the DRF views when served over ASGI (teacup/async_api.py)
+if settings.ASYNC_READ_VIEWS:
+    from . import async_views
+
+    urlpatterns = [
+        path('users/<int:pk>/', async_views.user_detail),
+    ] + urlpatterns
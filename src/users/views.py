@@ -1,30 +1,55 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.pagination import PageNumberPagination
+from drf_spectacular.utils import extend_schema
 
-from .models import UserProfile, Follow
+from notifications.events import notify
+from notifications.models import Notification
+from teacup.fieldsets import SparseViewMixin
+
+from .autocomplete import following_ids, search_users
+from .blocks import block, exclusions, is_blocked
+from .cards import card_memo, get_cards
+from .deletion import schedule_user_deletion
+from .models import UserProfile, Follow, FollowSuggestions, Block, Mute
 from .serializers import (
     UserSerializer, UserListSerializer, UserProfileUpdateSerializer,
-    FollowSerializer
+    FollowSerializer, UserAutocompleteSerializer, FollowSuggestionSerializer, ListedUserSerializer,
+    TokenObtainSerializer, TokenRefreshSerializer, TokenPairSerializer
+)
+from .tokens import (
+    ACCESS, REFRESH, BearerTokenAuthentication, get_principal, is_revoked, issue_tokens,
+    read_token, revoke, user_hash_matches
 )
 
 
-class UserViewSet(viewsets.ModelViewSet):
+class ListedUserPagination(PageNumberPagination):
+    """Pagination for block and mute lists, which can run to thousands."""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class UserViewSet(SparseViewMixin, viewsets.ModelViewSet):
     """
     ViewSet for User CRUD operations.
-    
-    TODO: Maybe add rate limiting for user creation to prevent spam accounts
+
+    Sign-ups are rate limited like every other write (teacup/throttling.py).
     """
-    queryset = User.objects.all().select_related('profile')
+    queryset = User.objects.filter(is_active=True).select_related('profile')
     serializer_class = UserSerializer
     filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
     search_fields = ['username', 'first_name', 'last_name', 'profile__bio']
     ordering_fields = ['username', 'date_joined']
     ordering = ['username']
+    throttle_scope = None  # set per action, e.g. autocomplete counts as search
 
     def get_serializer_class(self):
         """Return appropriate serializer based on action."""
@@ -37,8 +62,8 @@ class UserViewSet(viewsets.ModelViewSet):
         # Allow anyone to create accounts (registration)
         if self.action == 'create':
             permission_classes = [permissions.AllowAny]
-        # Only authenticated users can modify/delete
-        elif self.action in ['update', 'partial_update', 'destroy']:
+        # Only authenticated users can modify/delete (or have suggestions)
+        elif self.action in ['update', 'partial_update', 'destroy', 'me', 'suggestions', 'blocked', 'muted']:
             permission_classes = [permissions.IsAuthenticated] 
         else:
             # Default: read-only for anonymous, full access for authenticated
@@ -57,14 +82,72 @@ class UserViewSet(viewsets.ModelViewSet):
         return super().update(request, *args, **kwargs)
 
     def destroy(self, request, *args, **kwargs):
-        """Only allow users to delete their own account."""
+        """
+        Only allow users to delete their own account.
+
+        The account is deactivated right away and its content is removed
+        in the background, so this returns 202 with the deletion job id.
+        """
         user = self.get_object()
         if request.user != user:
             return Response(
                 {'error': 'You can only delete your own account.'},
                 status=status.HTTP_403_FORBIDDEN
             )
-        return super().destroy(request, *args, **kwargs)
+        job = schedule_user_deletion(user)
+        return Response(
+            {'message': 'Your account is being deleted.', 'deletion_job': job.id},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+    @action(detail=False, methods=['get'])
+    def me(self, request):
+        """The signed-in user."""
+        return Response(self.get_serializer(request.user).data)
+
+    @action(detail=False, methods=['get'], throttle_scope='search')
+    def autocomplete(self, request):
+        """
+        Prefix search on username and names, e.g. for @mention boxes.
+
+        Takes ?q= and an optional ?limit= (max 25). People the viewer follows
+        come first, then everyone else by follower count.
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), 25))
+        except ValueError:
+            limit = 10
+        viewer_id = request.user.id if request.user.is_authenticated else None
+        matches = search_users(request.query_params.get('q', ''), limit, viewer_id)
+        cards = get_cards([user_id for user_id, _, _ in matches], card_memo({'request': request}))
+        results = [
+            {**cards[user_id], 'followers_count': followers, 'is_following': is_following}
+            for user_id, followers, is_following in matches if user_id in cards
+        ]
+        return Response(UserAutocompleteSerializer(results, many=True).data)
+
+    @action(detail=False, methods=['get'], permission_classes=[permissions.IsAuthenticated])
+    def suggestions(self, request):
+        """
+        Who to follow: people followed by the people you follow, most mutual follows first.
+
+        Read from the lists `manage.py build_suggestions` precomputes; takes an
+        optional ?limit= (default 10). Anyone followed since is left out.
+        """
+        try:
+            limit = max(1, min(int(request.query_params.get('limit', 10)), settings.FOLLOW_SUGGESTIONS_TOP_K))
+        except ValueError:
+            limit = 10
+        stored = FollowSuggestions.objects.filter(user=request.user).values_list('suggestions', flat=True).first()
+        following = set(following_ids(request.user.id))
+        excluded = exclusions(request.user.id)
+        picks = [
+            (user_id, mutuals) for user_id, mutuals in stored or []
+            if user_id not in following and user_id not in excluded
+        ][:limit]
+        cards = get_cards([user_id for user_id, _ in picks], card_memo({'request': request}))
+        results = [{**cards[user_id], 'mutual_follows': mutuals} for user_id, mutuals in picks if user_id in cards]
+        return Response(FollowSuggestionSerializer(results, many=True).data)
 
     @action(detail=True, methods=['patch'], permission_classes=[permissions.IsAuthenticated])
     def update_profile(self, request, pk=None):
@@ -97,6 +180,11 @@ class UserViewSet(viewsets.ModelViewSet):
                 {'error': 'You cannot follow yourself.'},
                 status=status.HTTP_400_BAD_REQUEST
             )
+        if is_blocked(request.user.id, user_to_follow.id):
+            return Response(
+                {'error': 'You cannot follow this user.'},
+                status=status.HTTP_403_FORBIDDEN
+            )
         
         follow, created = Follow.objects.get_or_create(
             follower=request.user,
@@ -109,6 +197,7 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        notify(user_to_follow.id, Notification.FOLLOW, request.user.id)
         return Response(
             {'message': f'You are now following {user_to_follow.username}.'},
             status=status.HTTP_201_CREATED
@@ -139,14 +228,163 @@ class UserViewSet(viewsets.ModelViewSet):
     def followers(self, request, pk=None):
         """Get list of user's followers."""
         user = self.get_object()
-        followers = Follow.objects.filter(followed=user).select_related('follower__profile')
-        serializer = FollowSerializer(followers, many=True)
+        followers = Follow.objects.filter(followed=user)
+        serializer = FollowSerializer(followers, many=True, context={'request': request})
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def following(self, request, pk=None):
         """Get list of users this user is following."""
         user = self.get_object()
-        following = Follow.objects.filter(follower=user).select_related('followed__profile')
-        serializer = FollowSerializer(following, many=True)
+        following = Follow.objects.filter(follower=user)
+        serializer = FollowSerializer(following, many=True, context={'request': request})
         return Response(serializer.data)
+
+    def _listed(self, request, relations, target_field):
+        """Page through the viewer's blocks or mutes, newest first."""
+        rows = relations.order_by('-created_at').values_list(target_field, 'created_at')
+        paginator = ListedUserPagination()
+        page = paginator.paginate_queryset(rows, request, view=self)
+        cards = get_cards([user_id for user_id, _ in page], card_memo({'request': request}))
+        results = [{**cards[user_id], 'since': since} for user_id, since in page if user_id in cards]
+        return paginator.get_paginated_response(ListedUserSerializer(results, many=True).data)
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def block(self, request, pk=None):
+        """
+        Block a user: you stop seeing each other's posts, comments and likes,
+        any follows between you are removed, and neither can follow or comment
+        on the other.
+        """
+        user_to_block = self.get_object()
+        if request.user == user_to_block:
+            return Response(
+                {'error': 'You cannot block yourself.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if not block(request.user, user_to_block):
+            return Response(
+                {'error': 'You have already blocked this user.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'message': f'You have blocked {user_to_block.username}.'},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def unblock(self, request, pk=None):
+        """Unblock a user (follows removed by the block aren't restored)."""
+        user_to_unblock = self.get_object()
+        blocked = Block.objects.filter(blocker=request.user, blocked=user_to_unblock).first()
+        if blocked is None:
+            return Response(
+                {'error': 'You have not blocked this user.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        blocked.delete()
+        return Response(
+            {'message': f'You have unblocked {user_to_unblock.username}.'},
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def mute(self, request, pk=None):
+        """Mute a user: their posts, comments and likes are hidden from you, and they aren't told."""
+        user_to_mute = self.get_object()
+        if request.user == user_to_mute:
+            return Response(
+                {'error': 'You cannot mute yourself.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        _, created = Mute.objects.get_or_create(muter=request.user, muted=user_to_mute)
+        if not created:
+            return Response(
+                {'error': 'You have already muted this user.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(
+            {'message': f'You have muted {user_to_mute.username}.'},
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def unmute(self, request, pk=None):
+        """Unmute a user."""
+        user_to_unmute = self.get_object()
+        muted = Mute.objects.filter(muter=request.user, muted=user_to_unmute).first()
+        if muted is None:
+            return Response(
+                {'error': 'You have not muted this user.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        muted.delete()
+        return Response(
+            {'message': f'You have unmuted {user_to_unmute.username}.'},
+            status=status.HTTP_200_OK
+        )
+
+    @action(detail=False, methods=['get'])
+    def blocked(self, request):
+        """The users you've blocked, newest first (paginated)."""
+        return self._listed(request, Block.objects.filter(blocker=request.user), 'blocked_id')
+
+    @action(detail=False, methods=['get'])
+    def muted(self, request):
+        """The users you've muted, newest first (paginated)."""
+        return self._listed(request, Mute.objects.filter(muter=request.user), 'muted_id')
+
+
+class TokenViewSet(viewsets.ViewSet):
+    """
+    Bearer token login, rotation and logout (see users/tokens.py).
+
+    No authentication on obtain/refresh: an expired access token in the
+    header shouldn't get in the way of getting a new one.
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+
+    def get_authenticate_header(self, request):
+        # Bad refresh tokens are a 401 with a Bearer challenge, like bad access tokens
+        return BearerTokenAuthentication().authenticate_header(request)
+
+    @extend_schema(request=TokenObtainSerializer, responses=TokenPairSerializer)
+    def create(self, request):
+        """Exchange a username and password for an access/refresh token pair."""
+        serializer = TokenObtainSerializer(data=request.data, context={'request': request})
+        if serializer.is_valid():
+            return Response(issue_tokens(serializer.validated_data['user']))
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @extend_schema(request=TokenRefreshSerializer, responses=TokenPairSerializer)
+    @action(detail=False, methods=['post'])
+    def refresh(self, request):
+        """Trade a refresh token for a new pair; the old refresh token stops working."""
+        serializer = TokenRefreshSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        payload = read_token(serializer.validated_data['refresh'], REFRESH)
+        if is_revoked(payload['j']):
+            raise AuthenticationFailed('Token has been revoked.')
+        user = get_principal(payload['u'])
+        if user is None or not user_hash_matches(user, payload):
+            raise AuthenticationFailed('Token is no longer valid.')
+        # Claims the refresh token; a concurrent refresh with it loses here
+        if not revoke(payload, REFRESH):
+            raise AuthenticationFailed('Token has been revoked.')
+        return Response(issue_tokens(user))
+
+    @extend_schema(request=TokenRefreshSerializer, responses=None)
+    @action(
+        detail=False, methods=['post'],
+        authentication_classes=[BearerTokenAuthentication], permission_classes=[permissions.IsAuthenticated]
+    )
+    def revoke(self, request):
+        """Log out: revoke the access token used for this call, and the refresh token if given."""
+        revoke(request.auth, ACCESS)
+        token = request.data.get('refresh')
+        if token:
+            payload = read_token(token, REFRESH)
+            if payload['u'] == request.user.id:
+                revoke(payload, REFRESH)
+        return Response({'message': 'Logged out.'}, status=status.HTTP_200_OK)